@@ -0,0 +1,230 @@
+import argparse
+import hashlib
+import importlib.util
+import os
+import sys
+import time
+from core import PROGRAM_START
+from jit import JitCore, SKIPS, XO_SKIPS, BRANCHES, MAX_BLOCK
+
+# part of the cache key, bump it whenever the generated code changes
+CODEGEN_VERSION = 4
+
+# compiled modules kept in the cache, the least recently used ones are
+# deleted beyond that
+MAX_MODULES = 256
+
+
+def user_cache_dir():
+    # per user, never relative to the working directory. modules in it are
+    # imported and executed, so it must only be writable by the user
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "chip8", "aot")
+
+
+CACHE_DIR = user_cache_dir()
+
+
+def code_end(core):
+    # end of the code the analysis follows: the end of the rom. the empty
+    # memory after it decodes to long chains of 00E0, on XO-CHIP up to 64
+    # KB of them. code that runs there anyway is translated lazily
+    return min(PROGRAM_START + core.rom_size, len(core.memory))
+
+
+def entry_points(core, start=PROGRAM_START):
+    # static control flow analysis of the code in memory, starting at start.
+    # follows straight-line code, both ways out of skips, jumps and calls.
+    # BNNN depends on V0 and 00EE on the stack, both end the path here
+    # (calls continue after the call instead), so do addresses past the
+    # code_end. returns every address execution can enter a block at
+    memory = core.memory
+    table = core.dispatch
+    end = code_end(core)
+
+    entries = {start}
+    seen = set()
+    pending = [start]
+
+    while pending:
+        addr = pending.pop()
+        if addr in seen or addr < PROGRAM_START or addr + 1 >= end:
+            continue
+        seen.add(addr)
+
+        handler, a, b = table[(memory[addr] << 8) | memory[addr + 1]]
+        name = handler.__name__
+
+        if name in SKIPS:
+            pending += [addr + 2, addr + 4]
+            entries.add(addr + 4)
+        elif name in XO_SKIPS:
+            # over one instruction or over F000 NNNN
+            pending += [addr + 2, addr + 4, addr + 6]
+            entries |= {addr + 2, addr + 4, addr + 6}
+        elif name == "op_f000":
+            pending.append(addr + 4)
+        elif name == "op_1nnn":
+            pending.append(a)
+            entries.add(a)
+        elif name == "op_2nnn":
+            pending += [a, addr + 2]
+            entries |= {a, addr + 2}
+        elif name == "op_fx0a":
+            # repeated until a key is down
+            pending.append(addr + 2)
+            entries |= {addr, addr + 2}
+        elif name in BRANCHES:
+            pass
+        else:
+            pending.append(addr + 2)
+
+    return entries
+
+
+def module_source(core, start=PROGRAM_START):
+    # python module with one function per block reachable from start and
+    # BLOCKS = {start address: (function, instructions, end address)}
+    memory = core.memory
+    table = core.dispatch
+    limit = code_end(core)
+
+    pending = sorted(addr for addr in entry_points(core, start) if PROGRAM_START <= addr < limit)
+    done = set()
+    functions = []
+    blocks = []
+    handlers = set()
+
+    while pending:
+        addr = pending.pop()
+        if addr in done:
+            continue
+        done.add(addr)
+
+        generated = core.block_source(addr, f"block_{addr:03x}")
+        if generated is None:
+            continue
+        source, used, count, end = generated
+        functions.append(source)
+        blocks.append(f"    {addr:#05x}: (block_{addr:03x}, {count}, {end:#05x}),")
+        handlers |= set(used)
+
+        # a block cut off at MAX_BLOCK continues in the next one
+        last = table[(memory[end - 2] << 8) | memory[end - 1]][0].__name__
+        if last not in BRANCHES and end + 1 < limit:
+            pending.append(end)
+
+    return "".join((
+        "# generated by aot.py, do not edit.\n",
+        "# the handlers in HANDLERS are filled in by aot.load_module\n\n",
+        "\n".join(functions),
+        "\nBLOCKS = {\n",
+        "\n".join(sorted(blocks)),
+        "\n}\n",
+        f"HANDLERS = {sorted(handlers)!r}\n",
+    ))
+
+
+def cache_key(core):
+    # compiled code depends on the memory it was compiled from, the size
+    # of the rom in it, the platform and quirks that change code
+    # generation and the code generator itself
+    digest = hashlib.sha1(bytes(core.memory))
+    digest.update(f"{core.platform}/{core.rom_size}".encode())
+    digest.update(",".join(sorted(core.quirks)).encode())
+    digest.update(f"{CODEGEN_VERSION}/{MAX_BLOCK}".encode())
+    return digest.hexdigest()
+
+
+def prune(cache_dir, keep=MAX_MODULES):
+    # deletes all but the keep most recently used modules and their bytecode
+    modules = [name for name in os.listdir(cache_dir) if name.startswith("rom_") and name.endswith(".py")]
+    if len(modules) <= keep:
+        return
+    modules.sort(key=lambda name: os.path.getatime(os.path.join(cache_dir, name)))
+    bytecode = os.path.join(cache_dir, "__pycache__")
+    compiled = os.listdir(bytecode) if os.path.isdir(bytecode) else []
+    for name in modules[:len(modules) - keep]:
+        stem = name[:-3]
+        paths = [os.path.join(cache_dir, name)]
+        paths += [os.path.join(bytecode, other) for other in compiled if other.startswith(stem + ".")]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                # another run pruned it first
+                pass
+
+
+def load_module(core, cache_dir=CACHE_DIR):
+    # compiles the memory of core into cache_dir unless that was done
+    # before, then imports it. python keeps the bytecode of the module in
+    # cache_dir/__pycache__, so later launches skip code generation and
+    # compiling alike
+    key = cache_key(core)
+    path = os.path.join(cache_dir, f"rom_{key}.py")
+
+    if os.path.exists(path):
+        # the access time marks when it was last used, see prune. the
+        # modification time stays, python checks the bytecode against it
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+    else:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        # parallel runs may compile the same rom, only whole files are
+        # ever visible under path
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(module_source(core))
+        os.replace(tmp, path)
+        prune(cache_dir)
+
+    spec = importlib.util.spec_from_file_location(f"rom_{key}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for name in module.HANDLERS:
+        setattr(module, name, getattr(type(core), name))
+    return module
+
+
+class AotCore(JitCore):
+    # jit core that starts out with every block that is statically
+    # reachable from PROGRAM_START compiled ahead of time and cached on
+    # disk by the hash of the memory. code found only at run time (BNNN
+    # targets, return addresses of computed calls, ...) is translated
+    # lazily as before, and writes into compiled code drop the blocks
+    # they hit exactly like translated ones
+
+    cache_dir = CACHE_DIR
+
+    def load_rom(self, path=None):
+        super().load_rom(path)
+        self.load_compiled()
+
+    def load_compiled(self):
+        module = load_module(self, self.cache_dir)
+        for start, (func, count, end) in module.BLOCKS.items():
+            self.add_block(start, func, count, end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a rom ahead of time into the cache used by --aot")
+    parser.add_argument("rom")
+    parser.add_argument("--cache", default=CACHE_DIR, help="directory of compiled roms, only ever point it at one you trust")
+    args = parser.parse_args()
+
+    emu = AotCore()
+    emu.cache_dir = args.cache
+
+    start = time.perf_counter()
+    emu.load_rom(args.rom)
+    elapsed = time.perf_counter() - start
+
+    instructions = sum(count for func, count, end in emu.blocks.values())
+    print(f"{len(emu.blocks)} blocks, {instructions} instructions, key {cache_key(emu)}, {elapsed * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+from array import array
+
+# the buzzer: a square wave, generated once and looped for as long as the
+# sound timer runs
+FREQUENCY = 440
+VOLUME = 0.15
+SAMPLE_RATE = 44100
+
+# samples per mixer buffer, small so the tone starts and stops within a
+# few milliseconds of the frame that asked for it
+BUFFER = 512
+
+
+def square_wave(frequency, volume, sample_rate):
+    # signed 16 bit mono samples of one second, a whole number of periods
+    # at integer frequencies, so looping it has no seam
+    amplitude = int(volume * 32767)
+    period = sample_rate / frequency
+    return array("h", [
+        amplitude if (idx % period) < period / 2 else -amplitude
+        for idx in range(sample_rate)
+    ])
+
+
+class NullAudio:
+    # silent sink, for headless runs and machines without a sound device.
+    # update(sound_timer) is called once per frame before the timers tick
+
+    def start(self):
+        pass
+
+    def update(self, sound_timer):
+        pass
+
+    def close(self):
+        pass
+
+
+class ToneAudio(NullAudio):
+    # plays the tone while the sound timer is non-zero. pygame's mixer
+    # mixes in its own thread, starting and stopping the loop only flips
+    # a channel, so update never waits on the sound device
+
+    def __init__(self, frequency=FREQUENCY, volume=VOLUME, sample_rate=SAMPLE_RATE):
+
+        self.frequency = frequency
+        self.volume = volume
+        self.sample_rate = sample_rate
+
+        self.sound = None
+        self.playing = False
+
+    def start(self):
+        # returns False when there is no sound device to play on
+        import pygame
+        try:
+            # no changes allowed, SDL converts to whatever the device plays
+            pygame.mixer.init(self.sample_rate, -16, 1, BUFFER, allowedchanges=0)
+        except pygame.error:
+            return False
+        # the mixer may have been opened before with other settings, in
+        # which case init leaves it as it is. the samples follow its rate
+        # and channel count, else the tone plays at the wrong pitch
+        sample_rate, size, channels = pygame.mixer.get_init()
+        samples = square_wave(self.frequency, self.volume, sample_rate)
+        if channels > 1:
+            samples = array("h", [sample for sample in samples for _ in range(channels)])
+        self.sound = pygame.mixer.Sound(buffer=samples.tobytes())
+        return True
+
+    def update(self, sound_timer):
+        playing = sound_timer > 0
+        if playing == self.playing or self.sound is None:
+            return
+        if playing:
+            self.sound.play(loops=-1)
+        else:
+            self.sound.stop()
+        self.playing = playing
+
+    def close(self):
+        self.update(0)
+        if self.sound is not None:
+            import pygame
+            pygame.mixer.quit()
+            self.sound = None
@@ -0,0 +1,359 @@
+from array import array
+import numpy as np
+from core import DEFAULT_IPS, FPS, MEMORY_SIZE
+from utils import Utils
+
+
+class BatchCore:
+    # runs n independent chip8 machines in lockstep.
+    # every piece of machine state is a numpy array whose first axis is the
+    # instance, e.g. memory[k] is the memory of machine k. each step fetches
+    # one opcode per machine, groups the machines by the leading nibble of
+    # their opcode and executes every group with a handful of array
+    # operations. the semantics follow Core opcode for opcode.
+    # where Core would raise (pc or I past the end of memory, a key index
+    # above 0xF) the machine is marked in self.faulted and stops stepping
+
+    def __init__(self, n, seed=None):
+
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        self.cycles_per_frame = 0
+        self.set_speed(DEFAULT_IPS)
+        self.init_system()
+
+        self.groups = [
+            self.op_0, self.op_1nnn, self.op_2nnn, self.op_3xnn,
+            self.op_4xnn, self.op_5xy0, self.op_6xnn, self.op_7xnn,
+            self.op_8, self.op_9xy0, self.op_annn, self.op_bnnn,
+            self.op_cxnn, self.op_dxyn, self.op_e, self.op_f,
+        ]
+
+    def init_system(self):
+        n = self.n
+
+        self.counter = 0
+        self.memory = np.zeros((n, MEMORY_SIZE), dtype=np.uint8)
+        self.stack = np.zeros((n, 16), dtype=np.int32)
+        self.pc = np.full(n, 0x200, dtype=np.int32)
+        self.sp = np.zeros(n, dtype=np.int32)
+        self.delay_timer = np.zeros(n, dtype=np.int32)
+        self.sound_timer = np.zeros(n, dtype=np.int32)
+        self.v = np.zeros((n, 16), dtype=np.uint8)
+        self.i = np.zeros(n, dtype=np.int32)
+        self.keys = np.zeros((n, 16), dtype=bool)
+
+        # framebuffer rows packed like Framebuffer.rows, pixel x of row y
+        # is bit (63 - x) of rows[k, y]
+        self.rows = np.zeros((n, 32), dtype=np.uint64)
+        self.draw_flag = np.ones(n, dtype=bool)
+        self.faulted = np.zeros(n, dtype=bool)
+
+        font = Utils.get_font()
+        self.memory[:, :len(font)] = font
+
+    def set_speed(self, ips):
+        self.cycles_per_frame = max(1, round(ips / FPS))
+
+    def load_rom(self, data, instances=None):
+        # data is the raw rom, instances a list of machine indices
+        # (default: every machine)
+        if instances is None:
+            instances = slice(None)
+        rom = np.frombuffer(bytes(data), dtype=np.uint8)
+        if 0x200 + len(rom) > MEMORY_SIZE:
+            raise ValueError(f"rom is {len(rom)} bytes, at most {MEMORY_SIZE - 0x200} fit into memory")
+        self.memory[instances, 0x200:0x200 + len(rom)] = rom
+
+    def copy_to(self, k, core):
+        # copy the state of machine k into a scalar Core
+        core.memory[:] = self.memory[k].tobytes()
+        core.v[:] = self.v[k].tolist()
+        core.stack[:] = array("H", self.stack[k].tolist())
+        core.i = int(self.i[k])
+        core.pc = int(self.pc[k])
+        core.sp = int(self.sp[k])
+        core.delay_timer = int(self.delay_timer[k])
+        core.sound_timer = int(self.sound_timer[k])
+        core.keys[:] = self.keys[k].tolist()
+        core.framebuffer.rows = [int(row) for row in self.rows[k]]
+        core.framebuffer.mark_all_dirty()
+
+    def step(self, n=1):
+        # flat view of all memories, machine k starts at k * MEMORY_SIZE
+        memory = self.memory.reshape(-1)
+
+        for _ in range(n):
+            live = np.flatnonzero(~self.faulted)
+            pc = self.pc[live]
+
+            past_end = pc + 1 >= MEMORY_SIZE
+            if past_end.any():
+                self.faulted[live[past_end]] = True
+                live = live[~past_end]
+                pc = pc[~past_end]
+
+            addr = live * MEMORY_SIZE + pc
+            opcode = (memory[addr].astype(np.int32) << 8) | memory[addr + 1]
+            group = opcode >> 12
+
+            counts = np.bincount(group, minlength=16)
+            for g in np.flatnonzero(counts):
+                if counts[g] == len(live):
+                    # every machine runs the same opcode group
+                    self.groups[g](live, opcode)
+                else:
+                    selected = group == g
+                    self.groups[g](live[selected], opcode[selected])
+
+        self.counter += n
+
+    def tick_timers(self):
+        np.subtract(self.delay_timer, 1, out=self.delay_timer, where=self.delay_timer > 0)
+        np.subtract(self.sound_timer, 1, out=self.sound_timer, where=self.sound_timer > 0)
+
+    def run_frame(self):
+        self.step(self.cycles_per_frame)
+        self.tick_timers()
+
+    def run_frames(self, n):
+        for _ in range(n):
+            self.run_frame()
+
+    def fault(self, idx, op, bad):
+        # drops machines that would raise in Core from this step
+        if bad.any():
+            self.faulted[idx[bad]] = True
+            return idx[~bad], op[~bad]
+        return idx, op
+
+    def skip_if(self, idx, cond):
+        self.pc[idx] += np.where(cond, 4, 2)
+
+    # 00E0 / 00EE / 0NNN
+    def op_0(self, idx, op):
+        n = op & 0xF
+
+        cls = idx[n == 0x0]
+        self.rows[cls] = 0
+        self.draw_flag[cls] = True
+        self.pc[cls] += 2
+
+        ret = idx[n == 0xE]
+        # returning with an empty stack does nothing, pc is not advanced
+        ret = ret[self.sp[ret] > 0]
+        self.sp[ret] -= 1
+        self.pc[ret] = self.stack[ret, self.sp[ret]] + 2
+
+    # 1NNN
+    def op_1nnn(self, idx, op):
+        self.pc[idx] = op & 0xFFF
+
+    # 2NNN
+    def op_2nnn(self, idx, op):
+        sp = self.sp[idx]
+        self.stack[idx, sp] = self.pc[idx]
+        self.sp[idx] = np.where(sp < 0xF, sp + 1, sp)
+        self.pc[idx] = op & 0xFFF
+
+    # 3XNN
+    def op_3xnn(self, idx, op):
+        self.skip_if(idx, self.v[idx, (op >> 8) & 0xF] == (op & 0xFF))
+
+    # 4XNN
+    def op_4xnn(self, idx, op):
+        self.skip_if(idx, self.v[idx, (op >> 8) & 0xF] != (op & 0xFF))
+
+    # 5XY0
+    def op_5xy0(self, idx, op):
+        v = self.v
+        self.skip_if(idx, v[idx, (op >> 8) & 0xF] == v[idx, (op >> 4) & 0xF])
+
+    # 6XNN
+    def op_6xnn(self, idx, op):
+        self.v[idx, (op >> 8) & 0xF] = op & 0xFF
+        self.pc[idx] += 2
+
+    # 7XNN
+    def op_7xnn(self, idx, op):
+        x = (op >> 8) & 0xF
+        self.v[idx, x] = (self.v[idx, x] + (op & 0xFF)) & 0xFF
+        self.pc[idx] += 2
+
+    # 8XYN
+    def op_8(self, idx, op):
+        v = self.v
+        n = op & 0xF
+
+        for kind in np.flatnonzero(np.bincount(n, minlength=16)):
+            selected = n == kind
+            k = idx[selected]
+            x = (op[selected] >> 8) & 0xF
+            vx = v[k, x].astype(np.int32)
+            vy = v[k, (op[selected] >> 4) & 0xF].astype(np.int32)
+            flag = None
+
+            if kind == 0x0:
+                result = vy
+            elif kind == 0x1:
+                result = vx | vy
+            elif kind == 0x2:
+                result = vx & vy
+            elif kind == 0x3:
+                result = vx ^ vy
+            elif kind == 0x4:
+                result = vx + vy
+                flag = result > 0xFF
+            elif kind == 0x5:
+                result = vx - vy
+                flag = vy <= vx
+            elif kind == 0x6:
+                result = vx >> 1
+                flag = vx & 1
+            elif kind == 0x7:
+                result = vy - vx
+                flag = vx <= vy
+            elif kind == 0xE:
+                result = vx << 1
+                flag = vx >> 7
+            else:
+                # unknown 8XYN opcodes do not advance pc
+                continue
+
+            # VF first, then VX, so that VX wins when X is F
+            if flag is not None:
+                v[k, 0xF] = flag
+            v[k, x] = result & 0xFF
+            self.pc[k] += 2
+
+    # 9XY0
+    def op_9xy0(self, idx, op):
+        v = self.v
+        self.skip_if(idx, v[idx, (op >> 8) & 0xF] != v[idx, (op >> 4) & 0xF])
+
+    # ANNN
+    def op_annn(self, idx, op):
+        self.i[idx] = op & 0xFFF
+        self.pc[idx] += 2
+
+    # BNNN
+    def op_bnnn(self, idx, op):
+        self.pc[idx] = (op & 0xFFF) + self.v[idx, 0]
+
+    # CXNN
+    def op_cxnn(self, idx, op):
+        rand = self.rng.integers(0, 256, size=len(idx))
+        self.v[idx, (op >> 8) & 0xF] = rand & op & 0xFF
+        self.pc[idx] += 2
+
+    # DXYN
+    def op_dxyn(self, idx, op):
+        n_rows = op & 0xF
+        idx, op = self.fault(idx, op, self.i[idx] + n_rows > MEMORY_SIZE)
+        n_rows = op & 0xF
+
+        v = self.v
+        x_coord = v[idx, (op >> 8) & 0xF].astype(np.int64)
+        y_coord = v[idx, (op >> 4) & 0xF].astype(np.int64)
+        base = self.i[idx]
+
+        # sprites are clipped, not wrapped. a sprite row moved 8 or more
+        # pixels right of the edge is empty
+        shift = 56 - x_coord
+        left = np.clip(shift, 0, 63).astype(np.uint64)
+        right = np.clip(-shift, 0, 63).astype(np.uint64)
+        visible = shift > -8
+
+        collision = np.zeros(len(idx), dtype=bool)
+        rows = self.rows
+
+        for row in range(int(n_rows.max(initial=0))):
+            y = y_coord + row
+            active = (row < n_rows) & (y < 32) & visible
+            if not active.any():
+                continue
+
+            k = idx[active]
+            bits = self.memory[k, base[active] + row].astype(np.uint64)
+            line = np.where(shift[active] >= 0, bits << left[active], bits >> right[active])
+
+            y = y[active]
+            collision[active] |= (rows[k, y] & line) != 0
+            rows[k, y] ^= line
+
+        v[idx, 0xF] = collision
+        self.draw_flag[idx] = True
+        self.pc[idx] += 2
+
+    # EX9E / EXA1
+    def op_e(self, idx, op):
+        n = op & 0xF
+        known = (n == 0xE) | (n == 0x1)
+        idx, op, n = idx[known], op[known], n[known]
+
+        vx = self.v[idx, (op >> 8) & 0xF]
+        idx, op = self.fault(idx, op, vx > 0xF)
+        n = op & 0xF
+        vx = self.v[idx, (op >> 8) & 0xF]
+
+        pressed = self.keys[idx, vx]
+        self.skip_if(idx, np.where(n == 0xE, pressed, ~pressed))
+
+    # FXNN
+    def op_f(self, idx, op):
+        x = (op >> 8) & 0xF
+        kind = op & 0xF
+        # FX?5 is decoded on the third nibble
+        kind = np.where(kind == 0x5, 0x50 | ((op >> 4) & 0xF), kind)
+        v = self.v
+
+        # FX07
+        k = kind == 0x7
+        v[idx[k], x[k]] = self.delay_timer[idx[k]]
+        # FX15
+        k = kind == 0x51
+        self.delay_timer[idx[k]] = v[idx[k], x[k]]
+        # FX18
+        k = kind == 0x8
+        self.sound_timer[idx[k]] = v[idx[k], x[k]]
+        # FX1E
+        k = kind == 0xE
+        self.i[idx[k]] = (self.i[idx[k]] + v[idx[k], x[k]]) & 0xFFFF
+        # FX29
+        k = kind == 0x9
+        self.i[idx[k]] = v[idx[k], x[k]].astype(np.int32) * 5
+
+        # FX0A, pc only moves on once a key is pressed
+        k = kind == 0xA
+        waiting = idx[k]
+        pressed = self.keys[waiting].any(axis=1)
+        done = waiting[pressed]
+        v[done, x[k][pressed]] = self.keys[done].argmax(axis=1)
+        self.pc[done] += 2
+
+        # FX33
+        k = kind == 0x3
+        bcd, bcd_x = self.fault(idx[k], x[k], self.i[idx[k]] + 2 >= MEMORY_SIZE)
+        vx = v[bcd, bcd_x]
+        base = self.i[bcd]
+        self.memory[bcd, base] = vx // 100
+        self.memory[bcd, base + 1] = (vx // 10) % 10
+        self.memory[bcd, base + 2] = vx % 10
+
+        # FX55 / FX65
+        k = kind == 0x55
+        store, store_x = self.fault(idx[k], x[k], self.i[idx[k]] + x[k] >= MEMORY_SIZE)
+        k = kind == 0x56
+        load, load_x = self.fault(idx[k], x[k], self.i[idx[k]] + x[k] >= MEMORY_SIZE)
+        for reg in range(16):
+            s = store[store_x >= reg]
+            self.memory[s, self.i[s] + reg] = v[s, reg]
+            s = load[load_x >= reg]
+            v[s, reg] = self.memory[s, self.i[s] + reg]
+
+        # everything else in the F group is unknown and leaves pc alone
+        advance = np.isin(kind, (0x7, 0x51, 0x8, 0xE, 0x9))
+        self.pc[idx[advance]] += 2
+        self.pc[bcd] += 2
+        self.pc[store] += 2
+        self.pc[load] += 2
@@ -0,0 +1,219 @@
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from core import Core
+from jit import JitCore
+
+# synthetic programs, each a loop made mostly of one opcode family.
+# setup runs once, body is repeated and followed by a jump back to it
+FAMILIES = {
+    "alu_8xyn": (
+        [0x6001, 0x6102],
+        [0x8014, 0x8015, 0x8016, 0x801E, 0x8017, 0x8011, 0x8012, 0x8013, 0x8010] * 3,
+    ),
+    "jump_call": (
+        [],
+        [0x2204, 0x1200, 0x00EE],
+    ),
+    "dxyn": (
+        [0xA000, 0x6000, 0x6100],
+        [0xD015, 0x7005, 0xD015, 0x7105] * 6,
+    ),
+    "fx55_fx65": (
+        [0xA300],
+        [0xF555, 0xF565] * 12,
+    ),
+    "fx33": (
+        [0xA300, 0x60FF],
+        [0xF033] * 24,
+    ),
+    "mixed": (
+        [0xA300],
+        [0x6005, 0x7001, 0x8014, 0x3000, 0xF033, 0xF265, 0xD015, 0x4001, 0x8126, 0xA000],
+    ),
+}
+
+ENGINES = {"core": Core, "jit": JitCore}
+
+# metrics measured in these units get better when they go up, all
+# other units are times where lower is better
+HIGHER_IS_BETTER = {"ips"}
+
+
+def family_rom(setup, body):
+    # the loop body starts right after the setup code
+    start = 0x200 + 2 * len(setup)
+    program = setup + body + [0x1000 | start]
+    return b"".join(op.to_bytes(2, "big") for op in program)
+
+
+def best_of(repeats, func):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run_rom(cls, path, instructions):
+    emu = cls(0)
+    emu.load_rom(path)
+    # warm up, for the jit this translates the hot blocks
+    emu.step(1000)
+    return best_of(3, lambda: emu.step(instructions))
+
+
+def bench_families(results, instructions):
+    with tempfile.TemporaryDirectory() as tmp:
+        for family, (setup, body) in FAMILIES.items():
+            path = os.path.join(tmp, f"{family}.ch8")
+            with open(path, "wb") as f:
+                f.write(family_rom(setup, body))
+
+            for engine, cls in ENGINES.items():
+                elapsed = run_rom(cls, path, instructions)
+                results[f"{engine}.{family}.ips"] = {"value": instructions / elapsed, "unit": "ips"}
+                results[f"{engine}.{family}.per_op"] = {"value": elapsed / instructions * 1e9, "unit": "ns"}
+
+
+def bench_roms(results, rom_dir, instructions):
+    for name in sorted(os.listdir(rom_dir)):
+        if not name.lower().endswith(".ch8"):
+            continue
+        path = os.path.join(rom_dir, name)
+        for engine, cls in ENGINES.items():
+            try:
+                elapsed = run_rom(cls, path, instructions)
+            except Exception as e:
+                print(f"skipping {name} on {engine}: {type(e).__name__}: {e}")
+                continue
+            results[f"{engine}.rom.{name}.ips"] = {"value": instructions / elapsed, "unit": "ips"}
+
+
+def bench_load(results, path):
+    emu = Core()
+    repeats = 200
+    elapsed = best_of(3, lambda: [emu.load_rom(path) for _ in range(repeats)])
+    results["rom_load"] = {"value": elapsed / repeats * 1e6, "unit": "us"}
+
+
+def bench_refresh(results):
+    # needs pygame, rendered into an offscreen window
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    try:
+        from screen import Screen
+    except ImportError:
+        print("pygame not available, skipping Screen.refresh")
+        return
+
+    emu = Core(0)
+    screen = Screen(emu.framebuffer)
+    screen.start()
+    emu.load_rom(os.path.join(os.path.dirname(__file__), "..", "no_rom_selected.ch8"))
+    emu.run_frames(10)
+
+    repeats = 100
+    results["refresh_full"] = {
+        "value": best_of(3, lambda: [screen.refresh(full=True) for _ in range(repeats)]) / repeats * 1e6,
+        "unit": "us",
+    }
+
+    def sprite_frame():
+        # one 5 row sprite drawn per frame, the common case in games
+        emu.framebuffer.draw(10, 10, [0xF0, 0x90, 0x90, 0x90, 0xF0])
+        screen.refresh()
+
+    results["refresh_sprite"] = {
+        "value": best_of(3, lambda: [sprite_frame() for _ in range(repeats)]) / repeats * 1e6,
+        "unit": "us",
+    }
+    screen.destroy()
+
+
+def bench_startup(results):
+    # wall time of whole processes, from interpreter start until the first
+    # frame ran, headless and with an offscreen window (needs pygame)
+    here = os.path.dirname(os.path.abspath(__file__))
+    rom = os.path.join(here, "..", "no_rom_selected.ch8")
+    command = [sys.executable, os.path.join(here, "chip8.py"), rom, "--frames", "1"]
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy")
+
+    def launch(args):
+        subprocess.run(command + args, env=env, check=True, stdout=subprocess.DEVNULL)
+
+    results["startup_headless"] = {"value": best_of(5, lambda: launch(["--headless"])) * 1e3, "unit": "ms"}
+    if importlib.util.find_spec("pygame") is None:
+        print("pygame not available, skipping windowed startup")
+        return
+    results["startup_window"] = {"value": best_of(5, lambda: launch([])) * 1e3, "unit": "ms"}
+
+
+def compare(results, baseline, threshold):
+    # returns the names of all metrics that got worse by more than threshold
+    regressions = []
+    for name, metric in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]["value"]
+        new = metric["value"]
+        if metric["unit"] in HIGHER_IS_BETTER:
+            change = (new - old) / old
+        else:
+            change = (old - new) / old
+
+        marker = ""
+        if change < -threshold:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        print(f"{name:<40} {old:14.1f} -> {new:14.1f} {metric['unit']:<4} {change:+7.1%}{marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark interpreter throughput, opcode costs, rom loading, rendering and startup")
+    parser.add_argument("--roms", default=None, help="directory of .ch8 files to benchmark as well")
+    parser.add_argument("--instructions", type=int, default=200000, help="instructions per measurement")
+    parser.add_argument("--output", default=None, help="write results as json")
+    parser.add_argument("--baseline", default=None, help="json results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    parser.add_argument("--no-render", action="store_true", help="skip the Screen.refresh benchmark")
+    parser.add_argument("--no-startup", action="store_true", help="skip the cold start benchmark")
+    args = parser.parse_args()
+
+    results = {}
+    bench_families(results, args.instructions)
+    if args.roms:
+        bench_roms(results, args.roms, args.instructions)
+    bench_load(results, os.path.join(os.path.dirname(__file__), "..", "no_rom_selected.ch8"))
+    if not args.no_render:
+        bench_refresh(results)
+    if not args.no_startup:
+        bench_startup(results)
+
+    for name, metric in sorted(results.items()):
+        print(f"{name:<40} {metric['value']:14.1f} {metric['unit']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,665 +1,478 @@
-import tkinter
-from tkinter.filedialog import askopenfilename
-from screen import Screen
-import pygame
-from pygame.locals import *
-from utils import Utils
-from random import randint
+import argparse
+import hashlib
+import os
+import time
+from audio import NullAudio
+from core import Core, DEFAULT_IPS, PLATFORMS, guess_platform
+from display import Input
+from rewind import Rewind
+from savestate import StateError
+from scheduler import FrameScheduler
+
+# pygame (window, font, sound), tkinter (file dialog) and the library are
+# imported where they are first used, so that a Chip8 which only runs
+# headless or loads a state starts without them
+
+# keyboard to keypad, by pygame key name (pygame.K_<name>)
+# 1|2|3|C    1|2|3|4
+# 4|5|6|D    q|w|e|r
+# 7|8|9|E    a|s|d|f
+# A|0|B|F    z|x|c|v
+KEYPAD = {
+    "1": 0x1, "2": 0x2, "3": 0x3, "4": 0xC,
+    "q": 0x4, "w": 0x5, "e": 0x6, "r": 0xD,
+    "a": 0x7, "s": 0x8, "d": 0x9, "f": 0xE,
+    "z": 0xA, "x": 0x0, "c": 0xB, "v": 0xF,
+}
+
+
+class Chip8(Core):
+    # front-end around the headless core: the frame loop, save states,
+    # rewinding and recording, drawn by a display.Display and driven by a
+    # display.Input. start() opens a pygame window unless it is given
+    # other backends
+
+    def __init__(self, ips=DEFAULT_IPS, rewind_seconds=30, rewind_mb=8, library=None, seed=None):
 
-class Chip8:
-
-    def __init__(self):
-
-        self.rom_path = None
         self.rom_path_none_selected = "no_rom_selected.ch8"
-        self.running = False
-        self.screen = Screen()
-        self.beep = pygame.mixer.Sound("beep.ogg")
-        self.init_system()
-
-    def init_system(self):
-
-        self.counter = 0
-        self.paused = False
-        
-        self.memory = [0] * 4096
-        self.stack = [0] * 16
-
-        # program counter
-        # most programs start at 0x200 (==512)
-        # lower memory space is reserved for interpreter
-        self.pc = 512
-
-        # stack pointer
-        self.sp = 0
-
-        # timers
-        self.delay_timer = 0
-        self.sound_timer = 0
-
-        # registers
-        self.v = [0] * 16
-        self.i = 0
-
-        # we have 16 keys as input
-        # 1|2|3|C
-        # 4|5|6|D
-        # 7|8|9|E
-        # A|0|B|F
-        # doing array here instead of dict because
-        # then we can simply query for keys[{hex_val}]
-        # keys[0xf]
-        # which will translate into an array index
-        self.keys = [False] * 16
-
-        self.load_font()
-
-        self.screen.clear()
-        self.draw_flag = True
-
-    def load_font(self):
-        # load font set into memory
-        # first 80 elements of memory will be font set
-        for i, val in enumerate(Utils.get_font()):
-            self.memory[i] = val
-
-    def dump(self):
-        fname = "dump_mem_reg.txt"
-        op = (self.memory[self.pc] << 8) | self.memory[self.pc + 1]
-        
-        with open(fname, "w") as f:
-            f.write(f"Instruction counter: {self.counter}\n")
-            f.write(f"Opcode: {op}\n")
-            f.write(f"I: {self.i}\n")
-            f.write(f"PC: {self.pc}\n")
-            f.write(f"SP: {self.sp}\n")
-            f.write(f"sound timer: {self.sound_timer}\n")
-            f.write(f"delay timer: {self.delay_timer}\n")
-
-            f.write(f"\n-----------------------------------------------------------\n\n")
-            for i, val in enumerate(self.stack):
-                f.write(f"stack[{i}] : {val}\n")
-
-            f.write(f"\n-----------------------------------------------------------\n\n")
-            for i, val in enumerate(self.v):
-                f.write(f"V[{i}] : {val}\n")
-
-            f.write(f"\n-----------------------------------------------------------\n\n")
-            for i, val in enumerate(self.memory):
-                f.write(f"{hex(i)} : {val}\n")
-        return fname
-
-    def start(self):
-        self.screen.start()
-        self.run()
-        self.shutdown()
+        # one snapshot per frame, stepped back through while backspace is held
+        self.rewind = Rewind(rewind_mb * 1024 * 1024, rewind_seconds * 60)
+        self.rewinding = False
+        # optional replay.InputRecorder, fed in front of every frame
+        self.recorder = None
+        # optional spectator.Instance, gets every frame that was drawn
+        self.spectator = None
+        # platform for every rom, None picks it per rom, see load_rom
+        self.forced_platform = None
+        super().__init__(seed)
+        # idle loops are skipped instead of burning cpu until the next frame
+        self.skip_idle = True
+        self.set_speed(ips)
+        # speed for roms the library has no preference for
+        self.default_cycles_per_frame = self.cycles_per_frame
+        # optional library.Library, F1 then opens a picker instead of the
+        # file dialog and per rom settings are applied on load
+        self.library = library
+        self.scheduler = FrameScheduler()
+        # display, input and sound, created by start. runs without a
+        # window stay silent
+        self.display = None
+        self.input = None
+        self.audio = NullAudio()
+        # stop after this many frames, None runs until the window is closed
+        self.frame_limit = None
+
+    def start(self, display=None, source=None):
+        # runs until the player quits. without backends that is in a
+        # pygame window with sound, keys come from the same window
+        if display is None:
+            from audio import ToneAudio
+            from screen import Screen
+            display = Screen(self.framebuffer)
+            source = PygameInput()
+            audio = ToneAudio()
+            if audio.start():
+                self.audio = audio
+            else:
+                print("no sound device, running without sound")
+        self.display = display
+        self.input = source
+        try:
+            self.input.start(self)
+            self.display.start()
+            self.run()
+        finally:
+            self.shutdown()
 
     def run(self):
         self.running = True
+        self.scheduler.reset()
 
         while self.running:
 
-            self.handle_events()
-
-            while self.paused and self.running:
-                self.handle_events()
-
-            # get current opcode
-            opcode = (self.memory[self.pc] << 8) | self.memory[self.pc + 1]
-
-            # execute opcode
-            self.execute_opcode(opcode)
-            self.counter += 1
-            oc = hex(opcode)
-
-            # do draw/timer update 60 times pers second
-            # we do 1024 isntruction per second
-            # 1024/60 = draw/timer update every 17 instructions
-            if self.counter == 17:
-                if self.draw_flag:
-                    self.screen.refresh()
-                    # print(f"{self.counter}: draw flag in run")
-                    self.draw_flag = False
-
-                # update timers
-                if self.delay_timer > 0:
-                    self.delay_timer -= 1
-                
-                if self.sound_timer > 0:
-                    if self.sound_timer == 1:
-                        self.beep.play()
-                    self.sound_timer -= 1
-                self.counter = 0
-
-            # slow down emulation to 1024 instructions per second
-            pygame.time.delay(round((1/1024)*1000))
-
-    def execute_opcode(self, opcode):
-        ident = opcode & 0xF000
-
-        if ident == 0x0000:
-            param = opcode & 0x000F
-
-            # 00E0
-            if param == 0x0000:
-                # display clear
-                self.screen.clear()
-                self.draw_flag = True
-                self.pc += 2
-            
-            # 00EE
-            elif param == 0x000E:
-                # return from subroutine
-                if self.sp > 0:
-                    self.sp -= 1
-                    self.pc = self.stack[self.sp] & 0x00FFFF
-                    self.pc += 2
-
-            else:
-                # opcode is 0NNN, not necessary for most roms
-                pass
-
-        # 1NNN
-        elif ident == 0x1000:
-            # jump to address NNN
-            addr = opcode & 0x0FFF
-            self.pc = addr & 0x00FFFF
-
-        # 2NNN
-        elif ident == 0x2000:
-            # calls subroutine at address NNN
-            self.stack[self.sp] = self.pc
-            if self.sp < 0xF:
-                self.sp += 1 
-            addr = opcode & 0x0FFF
-            self.pc = addr & 0x00FFFF
-
-        # 3XNN
-        elif ident == 0x3000:
-            # skips next instr if V[X] == NN
-            x = (opcode & 0x0F00) >> 8
-            nn = opcode & 0x00FF
-            if self.v[x] == nn:
-                self.pc += 2
-            self.pc += 2
-
-        # 4XNN
-        elif ident == 0x4000:
-            # skips next instr if VX != NN
-            x = (opcode & 0x0F00) >> 8
-            nn = opcode & 0x00FF
-            if self.v[x] != nn:
-                self.pc += 2
-            self.pc += 2
-
-        # 5XY0
-        elif ident == 0x5000:
-            # skips next instr if VX == VY
-            x = (opcode & 0x0F00) >> 8
-            y = (opcode & 0x00F0) >> 4
-            if self.v[x] == self.v[y]:
-                self.pc += 2
-            self.pc += 2
-
-        # 6XNN
-        elif ident == 0x6000:
-            # sets VX to NN
-            x = (opcode & 0x0F00) >> 8
-            nn = opcode & 0x00FF
-            self.v[x] = nn & 0x00FF
-            self.pc += 2
-
-        # 7XNN
-        elif ident == 0x7000:
-            # adds NN to VX (carry flag not changed)
-            x = (opcode & 0x0F00) >> 8
-            nn = opcode & 0x00FF
-            self.v[x] = (self.v[x] + nn)& 0x00FF
-            self.pc += 2
-
-        elif ident == 0x8000:
-            param = opcode & 0x000F
-
-            # 8XY0
-            if param == 0x0000:
-                # Sets VX to the value of VY
-                x = (opcode & 0x0F00) >> 8
-                y = (opcode & 0x00F0) >> 4
-                self.v[x] = self.v[y]
-                self.pc += 2
-
-            # 8XY1
-            elif param == 0x0001:
-                # set VX to VX or VY. (bitwise OR operation)
-                x = (opcode & 0x0F00) >> 8
-                y = (opcode & 0x00F0) >> 4
-                self.v[x] = (self.v[x] | self.v[y]) & 0x00FF
-                self.pc += 2
-
-            # 8XY2
-            elif param == 0x0002:
-                # set VX to VX and VY. (bitwise AND operation)
-                x = (opcode & 0x0F00) >> 8
-                y = (opcode & 0x00F0) >> 4
-                self.v[x] = (self.v[x] & self.v[y]) & 0x00FF
-                self.pc += 2
-
-            # 8XY3
-            elif param == 0x0003:
-                # set VX to VX xor VY.
-                x = (opcode & 0x0F00) >> 8
-                y = (opcode & 0x00F0) >> 4
-                self.v[x] = (self.v[x] ^ self.v[y]) & 0x00FF
-                self.pc += 2
-
-            # 8XY4
-            elif param == 0x0004:
-                # Adds VY to VX. VF is set to 1 when there is a
-                # carry (meaning result > 0xFF (==255)) 
-                # and to 0 when not
-                x = (opcode & 0x0F00) >> 8
-                y = (opcode & 0x00F0) >> 4
-                vx = self.v[x]
-                vy = self.v[y]
-
-                self.v[0xF] = 0
-                if (vy + vx) > 0xFF:
-                    self.v[0xF] = 1
-
-                self.v[x] = (vx + vy) & 0x000FF
-                self.pc += 2
-
-            # 8XY5
-            elif param == 0x0005:
-                # VY is subtracted from VX
-                # VF is set to 0 when there is a borrow
-                # and 1 when not
-                x = (opcode & 0x0F00) >> 8
-                y = (opcode & 0x00F0) >> 4
-                vx = self.v[x]
-                vy = self.v[y]
-
-                self.v[0xF] = 1
-                if vy > vx:
-                    self.v[0xF] = 0
-                
-                self.v[x] = (vx - vy) & 0x000FF # TODO is correct?
-                self.pc += 2
-
-            # 8XY6
-            elif param == 0x0006:
-                # store the least significant bit of VX in VF
-                # and then shift VX to the right by 1
-                x = (opcode & 0x0F00) >> 8
-                vx = self.v[x]
-                self.v[0xF] = Utils.get_LSB(vx)
-                self.v[x] = (vx >> 1) & 0x00FF
-                self.pc += 2
-
-            # 8XY7
-            elif param == 0x0007:
-                # set VX to VY minus VX
-                # VF is set to 0 when there is a borrow
-                # and 1 when not
-                x = (opcode & 0x0F00) >> 8
-                y = (opcode & 0x00F0) >> 4
-                vx = self.v[x]
-                vy = self.v[y]
-                
-                self.v[0xF] = 1
-                if vx > vy:
-                    self.v[0xF] = 0
-                
-                self.v[x] = (vy - vx) & 0x000FF # TODO is correct?
-                self.pc += 2
-
-            # 8XYE
-            elif param == 0x000E:
-                # store the most significant bit of VX in VF
-                # and then shifts VX to the left by 1
-                x = (opcode & 0x0F00) >> 8
-                vx = self.v[x]
-                self.v[0xF] = Utils.get_MSB(vx)
-                self.v[x] = (vx << 1) & 0x00FF
-                self.pc += 2
-
-        # 9XY0
-        elif ident == 0x9000:
-            # skip next instr if VX != VY
-            x = (opcode & 0x0F00) >> 8
-            y = (opcode & 0x00F0) >> 4
-            if self.v[x] != self.v[y]:
-                self.pc += 2
-            self.pc += 2
-
-        # ANNN
-        elif ident == 0xA000:
-            # set I to the address NNN
-            nnn = opcode & 0x0FFF
-            self.i = nnn
-            self.pc += 2
-
-        # BNNN
-        elif ident == 0xB000:
-            # jump to adress NNN plus V0
-            nnn = opcode & 0x0FFF
-            v0 = self.v[0]
-            self.pc = (nnn + v0) & 0x000FFFF
-
-        # CXNN
-        elif ident == 0xC000:
-            # set VX to a random number (0 to 255) 
-            # masked with NN
-            x = (opcode & 0x0F00) >> 8
-            nn = opcode & 0x00FF
-            self.v[x] = (randint(0, 255) & nn) & 0x00FF
-            self.pc += 2
-
-        # DXYN
-        elif ident == 0xD000:
-            # draw sprite at position (VX, VY)
-            # using N bytes of sprite data at the address stored in I 
-            # sprites are XORed onto existing screen
-            # if any pre-existing pixels are erasid in that process, the collision flag VF is set
-            x = (opcode & 0x0F00) >> 8
-            y = (opcode & 0x00F0) >> 4
-            n_rows = opcode & 0x000F
-
-            x_coord = self.v[x]
-            y_coord = self.v[y]
-
-            # set to no collision initially
-            self.v[0xF] = 0
-            
-            # draw 8 bits x n bits big sprite
-            for row in range(n_rows):
-                sprite_row = self.memory[self.i + row]
-
-                if (y_coord + row) >= 32:
-                    continue
-
-                for idx in range(8):
-
-                    if (x_coord + idx) >= 64:
-                        continue
-
-                    # check each bit in the sprite row
-                    # start with MSB (left)
-                    mask = 0x80 >> idx
-                    if (sprite_row & mask) != 0:
-
-                        # check for collision
-                        old_pixel = self.screen.pixels[x_coord + idx][y_coord + row]
-
-                        if old_pixel == 1:
-                            self.v[0xF] = 1
-
-                        self.screen.pixels[x_coord + idx][y_coord + row] = old_pixel ^ 1
-                
-            self.draw_flag = True
-            self.pc += 2
-
-        elif ident == 0xE000:
-            param = opcode & 0x000F
-
-            # EX9E
-            if param == 0x000E:
-                # skip the next instruction if the key stored in VX is pressed
-                x = (opcode & 0x0F00) >> 8
-                vx = self.v[x]
-                if self.keys[vx]:
-                    self.pc += 2
-                self.pc += 2
-
-            # EXA1
-            elif param == 0x0001:
-                # skip the next instruction if the key stored in VX is not pressed
-                x = (opcode & 0x0F00) >> 8
-                vx = self.v[x]
-                
-                if not self.keys[vx]:
-                    self.pc += 2
-                self.pc += 2
-
-        elif ident == 0xF000:
-            param = opcode & 0x000F
-
-            # FX07
-            if param == 0x0007:
-                # set VX to the value of the delay timer
-                x = (opcode & 0x0F00) >> 8
-                self.v[x] = self.delay_timer & 0x00FF
-                self.pc += 2
-
-            # FX0A
-            elif param == 0x000A:
-                # wait for key press and then store key in VX
-                # this blocks until a key has been pressed
-                if 1 in self.keys:  
-                    idx = self.keys.index(1)
-                    x = (opcode & 0x0F00) >> 8
-                    self.v[x] = idx & 0x00FF
-                    self.pc += 2
+            self.input.poll(self)
+
+            if self.paused or self.idle():
+                # nothing changes until the next input, sleep until it
+                # arrives instead of polling
+                self.audio.update(0)
+                while (self.paused or self.idle()) and self.running:
+                    self.input.wait(self)
+                    if self.spectator is not None:
+                        self.spectator.apply_keys(before_frame=False)
+                # do not try to catch up on the time spent waiting
+                self.scheduler.reset()
+                continue
+
+            # sleep until the next 60 Hz frame is due, then run every
+            # frame that is due as a batch of cycles_per_frame instructions
+            # followed by one timer tick
+            for _ in range(self.scheduler.wait()):
+                if self.rewinding:
+                    self.step_back()
                 else:
-                    # repeat opcode until key has been pressed
-                    self.pc -= 2
-
-            elif param == 0x0005:
-                param = opcode & 0x00F0
-
-                # FX15
-                if param == 0x0010:
-                    # set the delay timer to VX
-                    x = (opcode & 0x0F00) >> 8
-                    vx = self.v[x]
-                    self.delay_timer = vx
-                    self.pc += 2
-
-                # FX55
-                elif param == 0x0050:
-                    # store V0 to VX (including VX) in memory starting at
-                    # address I
-                    # [LEGACY] I is set to I + X + 1 after operation
-                    x = (opcode & 0x0F00) >> 8
-                    for idx in range(x + 1): # +1 for inclusive
-                        self.memory[self.i + idx] = self.v[idx] & 0x00FF
-                    # self.i = (self.i + x + 1) & 0x000FFFF # legacy
-                    self.pc += 2
-
-                # FX65
-                elif param == 0x0060:
-                    # fill V0 to VX (including VX) with values from memory
-                    # starting at address I
-                    # [LEGACY] I is set to I + X + 1 after operation
-                    x = (opcode & 0x0F00) >> 8
-                    for idx in range(x + 1): # +1 for inclusive
-                        self.v[idx] = (self.memory[self.i + idx]) & 0x000FF
-                    # self.i = (self.i + x + 1) & 0x000FFFF # legacy
-                    self.pc += 2
-
-            # FX18
-            elif param == 0x0008:
-                # set the sound timer to VX
-                x = (opcode & 0x0F00) >> 8
-                vx = self.v[x]
-                self.sound_timer = vx
-                self.pc += 2
-
-            # FX1E
-            elif param == 0x000E:
-                # add VX to I
-                x = (opcode & 0x0F00) >> 8
-                vx = self.v[x]
-                self.i = (self.i + vx) & 0x00FFFF # TODO is modulo here correct or not? test rom only passes without modulo. why??
-                self.pc += 2
-
-            # FX29
-            elif param == 0x0009:
-                # set I to the location of the sprite for the character in VX
-                # characters 0-F are represented by a 4x5 font
-                x = (opcode & 0x0F00) >> 8
-                vx = self.v[x]
-                self.i = (vx * 5) & 0x000FFFF  # times 5 because each char is 5 long
-                self.pc += 2
-
-            # FX33
-            elif param == 0x0003:
-                # Stores the binary-coded decimal representation of VX.)
-                x = (opcode & 0x0F00) >> 8
-                # vx is 3 digit decimal number
-                vx = self.v[x]
-                # get hundreds
-                self.memory[self.i] = vx // 100
-                # get tens
-                self.memory[self.i + 1] = (vx // 10) % 10
-                # get ones
-                self.memory[self.i + 2] = vx % 10
-                self.pc += 2
-                
-        else:
-            print(f"unknown ident: {hex(ident)} opcode: {hex(opcode)}")
-            self.shutdown()
+                    self.before_frame()
+                    self.run_frame()
+                    self.rewind.push(self)
+                self.input.frame_done(self)
+                if self.frame_limit is not None:
+                    self.frame_limit -= 1
+                    if self.frame_limit <= 0:
+                        self.running = False
+                        break
+
+            if self.draw_flag:
+                self.display.refresh()
+                if self.spectator is not None:
+                    self.spectator.publish()
+                self.draw_flag = False
+
+    def before_frame(self):
+        # keys of spectators only change here, between frames, so that
+        # the recording sees them and idle loop skipping can rely on them
+        if self.spectator is not None:
+            self.spectator.apply_keys()
+        if self.recorder is not None:
+            self.recorder.before_frame(self)
+
+    def wake(self):
+        # from any thread, see spectator.Instance
+        if self.input is not None:
+            self.input.wake()
+
+    def idle(self):
+        # waiting on FX0A with both timers run out. frames would only
+        # repeat FX0A, so the window can block on the next event
+        return self.waiting_for_key() and not self.delay_timer and not self.sound_timer and not self.rewinding
+
+    def init_system(self):
+        super().init_system()
+        # history of another rom or an earlier boot is of no use
+        self.rewind.clear()
+        if self.recorder is not None:
+            self.recorder.state_changed()
+
+    def load_state(self, data):
+        # covers F7 and rewinding
+        super().load_state(data)
+        if self.recorder is not None:
+            self.recorder.state_changed()
+
+    def step_back(self):
+        # the snapshot has the keys and pause flag of its frame, keep the
+        # ones the player is holding right now. rewinding is silent
+        self.audio.update(0)
+        keys = list(self.keys)
+        paused = self.paused
+        if self.rewind.step_back(self):
+            self.keys[:] = keys
+            self.paused = paused
+
+    def tick_timers(self):
+        # the tone runs from the frame that set the sound timer until the
+        # frame it reached zero in, sound_timer frames in total
+        self.audio.update(self.sound_timer)
+        super().tick_timers()
 
     def shutdown(self):
-        self.screen.destroy()
+        super().shutdown()
+        self.audio.close()
+        if self.display is not None:
+            self.display.destroy()
+        if self.input is not None:
+            self.input.stop(self)
 
-    def reboot(self):
-        self.init_system()
-        self.load_rom()
+    def load_rom(self, path=None):
 
-    def load_rom(self):
+        if path:
+            self.rom_path = path
 
         if not self.rom_path:
-            root = tkinter.Tk()
-            self.rom_path = askopenfilename()
-            root.destroy()
+            self.rom_path = self.ask_rom()
 
         if not self.rom_path:
             self.rom_path = self.rom_path_none_selected
 
-        # programs start at 0x200 in memory
-        i = 0x200
-        with open(self.rom_path, "rb") as f:
-            byte = f.read(1)
-            while byte:
-                self.memory[i] = int.from_bytes(byte, "big", signed=False)
-                i += 1
-                byte = f.read(1)
+        # --platform, then the library, then the file extension
+        platform = self.forced_platform
+        if self.library is not None:
+            entry = self.library.apply(self, self.rom_path, self.default_cycles_per_frame)
+            if platform is None and entry is not None:
+                platform = entry.get("platform")
+        platform = platform or guess_platform(self.rom_path)
+        if platform != self.platform:
+            self.set_platform(platform)
+
+        super().load_rom()
+
+    def ask_rom(self):
+        import tkinter
+        from tkinter.filedialog import askopenfilename
+        root = tkinter.Tk()
+        path = askopenfilename()
+        root.destroy()
+        return path
+
+    def state_path(self):
+        # one save state slot per rom, next to the rom
+        return os.path.splitext(self.rom_path)[0] + ".state"
 
     def change_rom(self):
+        self.audio.update(0)
+        path = None
+        if self.library is not None and self.library.entries:
+            path = self.input.pick_rom(self)
+            # keys released while the picker was open never reached us
+            self.keys[:] = [False] * 16
+            if path is None:
+                # cancelled, back to the running rom
+                self.display.show_menu()
+                if self.paused:
+                    self.display.show_paused(True)
+                self.scheduler.reset()
+                return
+
         self.init_system()
-        self.rom_path = None
+        self.rom_path = path
         self.load_rom()
+        self.display.show_menu()
+        # do not try to catch up on the time spent choosing
+        self.scheduler.reset()
 
-    def handle_events(self):
-        for event in pygame.event.get():
+    # what the player can do, called by the input
+
+    def press(self, key):
+        self.keys[key] = True
+
+    def release(self, key):
+        self.keys[key] = False
+
+    def quit(self):
+        self.running = False
 
-            if event.type == QUIT:
-                self.running = False
-
-            elif event.type == KEYDOWN:
-
-                if event.key == K_ESCAPE:
-                    self.running = False
-                elif event.key == K_F1:
-                    # change rom
-                    self.change_rom()
-                    pass
-                elif event.key == K_F2:
-                    # reboot
-                    self.reboot()
-                    pass
-                elif event.key == K_F3:
-                    # pause/unpause
-                    self.paused = not self.paused
-                    self.screen.show_paused(self.paused)
-                    pass
-                elif event.key == K_F4:
-                    # dump screen to file
-                    fname = self.screen.dump()
-                    print(f"dumped screen to {fname}")
-                    pass
-                elif event.key == K_F5:
-                    # dump memory and registers to file
-                    fname = self.dump()
-                    print(f"dumped memory and registers to {fname}")
-                    pass
-
-                if event.key == K_1:
-                    self.keys[0x1] = True
-                elif event.key == K_2:
-                    self.keys[0x2] = True
-                elif event.key == K_3:
-                    self.keys[0x3] = True
-                elif event.key == K_4:
-                    self.keys[0xC] = True
-
-                elif event.key == K_q:
-                    self.keys[0x4] = True
-                elif event.key == K_w:
-                    self.keys[0x5] = True
-                elif event.key == K_e:
-                    self.keys[0x6] = True
-                elif event.key == K_r:
-                    self.keys[0xD] = True
-
-                elif event.key == K_a:
-                    self.keys[0x7] = True
-                elif event.key == K_s:
-                    self.keys[0x8] = True
-                elif event.key == K_d:
-                    self.keys[0x9] = True
-                elif event.key == K_f:
-                    self.keys[0xE] = True
-
-                elif event.key == K_z:
-                    self.keys[0xA] = True
-                elif event.key == K_x:
-                    self.keys[0x0] = True
-                elif event.key == K_c:
-                    self.keys[0xB] = True
-                elif event.key == K_v:
-                    self.keys[0xF] = True
-            elif event.type == KEYUP:
-
-                if event.key == K_1:
-                    self.keys[0x1] = False
-                elif event.key == K_2:
-                    self.keys[0x2] = False
-                elif event.key == K_3:
-                    self.keys[0x3] = False
-                elif event.key == K_4:
-                    self.keys[0xC] = False
-
-                elif event.key == K_q:
-                    self.keys[0x4] = False
-                elif event.key == K_w:
-                    self.keys[0x5] = False
-                elif event.key == K_e:
-                    self.keys[0x6] = False
-                elif event.key == K_r:
-                    self.keys[0xD] = False
-
-                elif event.key == K_a:
-                    self.keys[0x7] = False
-                elif event.key == K_s:
-                    self.keys[0x8] = False
-                elif event.key == K_d:
-                    self.keys[0x9] = False
-                elif event.key == K_f:
-                    self.keys[0xE] = False
-
-                elif event.key == K_z:
-                    self.keys[0xA] = False
-                elif event.key == K_x:
-                    self.keys[0x0] = False
-                elif event.key == K_c:
-                    self.keys[0xB] = False
-                elif event.key == K_v:
-                    self.keys[0xF] = False
-
-def main():
-    emu = Chip8()
+    def toggle_pause(self):
+        self.paused = not self.paused
+        self.display.show_paused(self.paused)
+
+    def dump_screen(self):
+        fname = self.framebuffer.dump()
+        print(f"dumped screen to {fname}")
+
+    def dump_memory(self):
+        fname = self.dump()
+        print(f"dumped memory and registers to {fname}")
+
+    def save_slot(self):
+        try:
+            with open(self.state_path(), "wb") as f:
+                f.write(self.save_state())
+        except OSError as e:
+            # e.g. a rom directory that is not writable
+            print(f"could not save {self.state_path()}: {e}")
+            return
+        print(f"saved state to {self.state_path()}")
+
+    def load_slot(self):
+        if not os.path.exists(self.state_path()):
+            return
+        try:
+            with open(self.state_path(), "rb") as f:
+                self.load_state(f.read())
+        except (StateError, OSError) as e:
+            # nothing was loaded, the rom keeps running
+            print(f"could not load {self.state_path()}: {e}")
+            return
+        self.display.show_paused(self.paused)
+        print(f"loaded state from {self.state_path()}")
+
+    def set_rewinding(self, rewinding):
+        # rewinds one frame per frame while set
+        self.rewinding = rewinding
+
+
+class PygameInput(Input):
+    # keyboard of the pygame window, keys as listed by Screen.show_menu
+
+    def __init__(self):
+
+        # pygame key code to keypad, see KEYPAD
+        self.keypad = {}
+
+    def start(self, emu):
+        import pygame
+        self.keypad = {getattr(pygame, f"K_{name}"): key for name, key in KEYPAD.items()}
+
+    def poll(self, emu):
+        import pygame
+        for event in pygame.event.get():
+            self.handle_event(emu, event)
+
+    def wait(self, emu):
+        import pygame
+        self.handle_event(emu, pygame.event.wait())
+
+    def wake(self):
+        # pygame.event.post may be called from other threads, the event
+        # itself is ignored by handle_event
+        import pygame
+        try:
+            pygame.event.post(pygame.event.Event(pygame.USEREVENT))
+        except pygame.error:
+            # the window is already closed
+            pass
+
+    def handle_event(self, emu, event):
+        import pygame
+
+        if event.type == pygame.QUIT:
+            emu.quit()
+
+        elif event.type == pygame.KEYDOWN:
+
+            key = self.keypad.get(event.key)
+            if key is not None:
+                emu.press(key)
+
+            elif event.key == pygame.K_ESCAPE:
+                emu.quit()
+            elif event.key == pygame.K_F1:
+                emu.change_rom()
+            elif event.key == pygame.K_F2:
+                emu.reboot()
+            elif event.key == pygame.K_F3:
+                emu.toggle_pause()
+            elif event.key == pygame.K_F4:
+                emu.dump_screen()
+            elif event.key == pygame.K_F5:
+                emu.dump_memory()
+            elif event.key == pygame.K_F6:
+                emu.save_slot()
+            elif event.key == pygame.K_F7:
+                emu.load_slot()
+            elif event.key == pygame.K_BACKSPACE:
+                # rewind while held
+                emu.set_rewinding(True)
+
+        elif event.type == pygame.KEYUP:
+
+            key = self.keypad.get(event.key)
+            if key is not None:
+                emu.release(key)
+
+            elif event.key == pygame.K_BACKSPACE:
+                emu.set_rewinding(False)
+
+    def pick_rom(self, emu):
+        # in-window list of the library. returns the path of the chosen rom
+        # or None when cancelled
+        import pygame
+        entries = emu.library.titles()
+        selected = 0
+
+        while emu.running:
+            emu.display.show_picker(entries, selected)
+
+            # wake up now and then to draw thumbnails that were finished
+            # in the background
+            event = pygame.event.wait(250)
+
+            if event.type == pygame.QUIT:
+                emu.quit()
+            elif event.type != pygame.KEYDOWN:
+                continue
+            elif event.key == pygame.K_ESCAPE:
+                return None
+            elif event.key == pygame.K_UP:
+                selected = max(0, selected - 1)
+            elif event.key == pygame.K_DOWN:
+                selected = min(len(entries) - 1, selected + 1)
+            elif event.key == pygame.K_PAGEUP:
+                selected = max(0, selected - emu.display.picker_rows())
+            elif event.key == pygame.K_PAGEDOWN:
+                selected = min(len(entries) - 1, selected + emu.display.picker_rows())
+            elif event.key == pygame.K_RETURN:
+                return entries[selected][1]["path"]
+            elif event.key == pygame.K_F1:
+                # rom outside of the library
+                return emu.ask_rom()
+
+        return None
+
+
+def with_engine(engine):
+    # the window on top of the jit or aot engine instead of the interpreter
+    if engine == "jit":
+        from jit import JitCore
+        return type("JitChip8", (Chip8, JitCore), {})
+    if engine == "aot":
+        from aot import AotCore
+        return type("AotChip8", (Chip8, AotCore), {})
+    return Chip8
+
+
+def make_parser(description="Chip8 interpreter", dialog=True):
+    # options of every front-end, see main. without a file dialog the rom
+    # is required
+    parser = argparse.ArgumentParser(description=description)
+    if dialog:
+        parser.add_argument("rom", nargs="?", help="rom to load, asks with a file dialog if left out")
+    else:
+        parser.add_argument("rom", help="rom to load")
+    parser.add_argument("--ips", type=int, default=DEFAULT_IPS, help="instructions per second, most roms want 500 to 2000")
+    parser.add_argument("--jit", action="store_true", help="translate hot code into python functions")
+    parser.add_argument("--aot", action="store_true", help="like --jit, with the reachable code compiled up front and cached, see aot.py")
+    parser.add_argument("--profile", default=None, help="count executed opcodes and addresses, write them to this json file on exit")
+    parser.add_argument("--rewind-seconds", type=int, default=30, help="how far back holding backspace can rewind")
+    parser.add_argument("--rewind-mb", type=int, default=8, help="memory limit of the rewind history")
+    parser.add_argument("--trace", default=None, help="record every executed instruction to this file, see tracer.py")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the CXNN random numbers")
+    parser.add_argument("--record", default=None, help="record key presses to this input log, replay it with replay.py")
+    parser.add_argument("--library", action="append", default=[], help="directory of roms for the F1 picker, can be given more than once")
+    parser.add_argument("--library-index", default="library.json", help="where the library keeps titles, thumbnails and per rom settings")
+    parser.add_argument("--spectate", default=None, metavar="[HOST:]PORT", help="stream the screen to spectator.py clients")
+    parser.add_argument("--spectate-input", action="store_true", help="let spectators press keys")
+    parser.add_argument("--platform", choices=PLATFORMS, default=None, help="machine to emulate, by default taken from the library or guessed from the file extension")
+    parser.add_argument("--state", default=None, help="save state to load after the rom, as written by F6")
+    parser.add_argument("--frames", type=int, default=None, help="quit after this many frames")
+    parser.add_argument("--headless", action="store_true", help="run --frames frames as fast as possible without a window and print a hash of the screen")
+    return parser
+
+
+def main(parser=None, frontend=None):
+    # frontend(emu) returns the display and input to run with, None opens
+    # a pygame window
+    if parser is None:
+        parser = make_parser()
+    args = parser.parse_args()
+
+    if args.headless and (args.rom is None or args.frames is None):
+        parser.error("--headless needs a rom and --frames")
+
+    if args.profile and args.trace:
+        # both replace the interpreter loop, see Core.step
+        parser.error("--profile and --trace cannot be combined")
+
+    library = None
+    if args.library or os.path.exists(args.library_index):
+        from library import Library
+        library = Library(args.library_index)
+        for directory in args.library:
+            library.scan(directory)
+        library.generate_thumbnails()
+
+    engine = "aot" if args.aot else "jit" if args.jit else None
+    emu = with_engine(engine)(args.ips, args.rewind_seconds, args.rewind_mb, library, args.seed)
+    emu.rom_path = args.rom
+    emu.frame_limit = args.frames
+    emu.forced_platform = args.platform
+
+    if args.profile:
+        from profiler import Profiler
+        emu.profiler = Profiler()
+
+    if args.trace:
+        from tracer import Tracer
+        emu.tracer = Tracer(args.trace, emu.counter)
 
     # emu.rom_path = "BC_test.ch8"
     # emu.rom_path = "roms/Space Invaders [David Winter].ch8"
@@ -667,7 +480,52 @@ def main():
     # emu.rom_path = "roms/Brix [Andreas Gustafsson, 1990].ch8"
 
     emu.load_rom()
-    emu.start()
+
+    if args.state:
+        with open(args.state, "rb") as f:
+            emu.load_state(f.read())
+
+    if args.record:
+        from replay import InputRecorder
+        emu.recorder = InputRecorder(args.record)
+
+    server = None
+    if args.spectate:
+        from spectator import SpectatorServer, parse_address
+        server = SpectatorServer(*parse_address(args.spectate))
+        print(f"spectator server on port {server.start()}")
+        emu.spectator = server.add(emu, allow_input=args.spectate_input, wake=emu.wake)
+
+    if args.headless:
+        start = time.perf_counter()
+        for _ in range(args.frames):
+            emu.before_frame()
+            emu.run_frame()
+            if emu.draw_flag and emu.spectator is not None:
+                emu.spectator.publish()
+                emu.draw_flag = False
+        elapsed = time.perf_counter() - start
+        digest = hashlib.sha1(emu.framebuffer.to_bytes()).hexdigest()
+        print(f"{args.frames} frames in {elapsed:.3f}s, screen {digest}")
+    elif frontend is None:
+        emu.start()
+    else:
+        emu.start(*frontend(emu))
+
+    if server is not None:
+        server.close()
+
+    if args.record:
+        print(f"wrote input log to {emu.recorder.close()}")
+
+    if library is not None:
+        library.close()
+
+    if args.profile:
+        print(f"wrote profile to {emu.profiler.save(emu, args.profile)}")
+
+    if args.trace:
+        print(f"wrote trace to {emu.tracer.close()}")
 
 
 if __name__ == "__main__":
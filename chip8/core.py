@@ -0,0 +1,1117 @@
+import argparse
+import os
+import time
+from array import array
+from random import Random
+from framebuffer import Framebuffer
+from utils import Utils
+import savestate
+
+# frames per second for timers and drawing
+FPS = 60
+
+# instructions per second if a rom does not ask for anything else
+DEFAULT_IPS = 1024
+
+MEMORY_SIZE = 4096
+
+# most programs start at 0x200 (==512),
+# lower memory space is reserved for interpreter
+PROGRAM_START = 0x200
+
+# longest loop skip_idle looks for, in instructions
+IDLE_PROBE = 16
+
+# shorter steps are not worth probing
+IDLE_MIN_STEP = 64
+
+# handlers that change state skip_idle_loop does not compare: CXNN the
+# random number generator, FX33, FX55 and XO-CHIP 5XY2 memory, FX75, FN01,
+# F002 and FX3A other state. keyed by name, many encodings decode to the
+# same handler
+IDLE_EFFECTS = {"op_cxnn", "op_fx33", "op_fx55", "op_5xy2", "op_fx75", "op_fn01", "op_f002", "op_fx3a"}
+
+# after a step without an idle loop the next steps are not probed, up to
+# this many in a row
+IDLE_BACKOFF = 32
+
+# behaviour that differs between interpreters and that some roms rely on,
+# switched on per machine with Core.set_quirks
+QUIRKS = {
+    "legacy_load_store": "FX55/FX65 leave I at I + X + 1",
+    "legacy_shift": "8XY6/8XYE shift VY and store the result in VX",
+}
+
+# machines the core can be, switched with Core.set_platform
+PLATFORMS = {
+    "chip8": "CHIP-8, 64x32 pixels and 4 KB of memory",
+    "schip": "SUPER-CHIP 1.1, adds a 128x64 mode, scrolling and 16x16 sprites",
+    "xochip": "XO-CHIP, SUPER-CHIP plus two bit planes (4 colors) and 64 KB of memory",
+}
+
+# platform of a rom by its file extension, see guess_platform
+EXTENSIONS = {
+    ".ch8": "chip8",
+    ".sc8": "schip",
+    ".xo8": "xochip",
+}
+
+XO_MEMORY_SIZE = 0x10000
+
+# the SUPER-CHIP 8x10 font follows the 4x5 one
+BIG_FONT_START = 0x50
+
+
+def guess_platform(path):
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), "chip8")
+
+
+class Core:
+    # headless chip8 machine: memory, registers, timers and framebuffer.
+    # nothing in here may touch pygame or tkinter, front-ends (see chip8.py)
+    # attach to an instance and read self.framebuffer / self.draw_flag
+
+    def __init__(self, seed=None):
+
+        self.rom_path = None
+        # bytes the last load_rom put at PROGRAM_START
+        self.rom_size = 0
+        # every machine has its own random number generator for CXNN so
+        # runs can be made reproducible by seeding it
+        self.rng = Random(seed)
+        # optional profiler.Profiler and tracer.Tracer, see step(). only
+        # one of them runs, the profiler when both are set
+        self.profiler = None
+        self.tracer = None
+        self.quirks = frozenset()
+        self.platform = "chip8"
+        # skip the rest of idle loops, see skip_idle_loop()
+        self.skip_idle = False
+        self.idle_backoff = 0
+        self.idle_wait = 0
+        self.running = False
+        self.set_speed(DEFAULT_IPS)
+        self.framebuffer = Framebuffer()
+
+        # machine state is allocated once and cleared in place by
+        # init_system. memory is a bytearray so roms, save states and
+        # FX55/FX65 copy it with single slice operations, the stack holds 16
+        # bit addresses. V stays a list: it is indexed several times per
+        # instruction and cpython indexes lists faster than bytearrays
+        self.memory = bytearray(MEMORY_SIZE)
+        self.v = [0] * 16
+        self.stack = array("H", bytes(32))
+
+        self.dispatch = self.build_dispatch(self.platform)
+        self.init_system()
+
+    def init_system(self):
+
+        # total number of executed instructions
+        self.counter = 0
+        self.paused = False
+
+        self.memory[:] = bytes(len(self.memory))
+        self.stack[:] = array("H", bytes(32))
+
+        # program counter
+        self.pc = PROGRAM_START
+
+        # stack pointer
+        self.sp = 0
+
+        # timers
+        self.delay_timer = 0
+        self.sound_timer = 0
+
+        # registers
+        self.v[:] = [0] * 16
+        self.i = 0
+
+        # we have 16 keys as input
+        # 1|2|3|C
+        # 4|5|6|D
+        # 7|8|9|E
+        # A|0|B|F
+        # doing array here instead of dict because
+        # then we can simply query for keys[{hex_val}]
+        # keys[0xf]
+        # which will translate into an array index
+        self.keys = [False] * 16
+
+        # SUPER-CHIP RPL user flags (FX75/FX85), XO-CHIP audio pattern and
+        # pitch (F002/FX3A)
+        self.flags = [0] * 16
+        self.pattern = bytes(16)
+        self.pitch = 64
+
+        self.load_font()
+
+        # XO-CHIP draws on two planes, every platform starts in 64x32
+        self.framebuffer.resize(64, 32, 2 if self.platform == "xochip" else 1)
+        self.draw_flag = True
+
+    def load_font(self):
+        # load font set into memory
+        # first 80 elements of memory will be font set
+        font = Utils.get_font()
+        self.memory[:len(font)] = bytes(font)
+        if self.platform != "chip8":
+            big_font = Utils.get_big_font()
+            self.memory[BIG_FONT_START:BIG_FONT_START + len(big_font)] = bytes(big_font)
+
+    def load_rom(self, path=None):
+
+        if path:
+            self.rom_path = path
+
+        # the rom is read straight into memory at PROGRAM_START
+        space = len(self.memory) - PROGRAM_START
+        with open(self.rom_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > space:
+                raise ValueError(f"{self.rom_path} is {size} bytes, at most {space} fit into memory")
+            with memoryview(self.memory) as view:
+                f.readinto(view[PROGRAM_START:PROGRAM_START + size])
+        self.rom_size = size
+
+    def set_speed(self, ips):
+        # roms differ a lot in how fast they expect to run, the speed is
+        # expressed as instructions per second and executed in batches
+        # of cycles_per_frame instructions per 60 Hz frame
+        self.cycles_per_frame = max(1, round(ips / FPS))
+
+    def set_quirks(self, quirks):
+        unknown = set(quirks) - set(QUIRKS)
+        if unknown:
+            raise ValueError(f"unknown quirks: {', '.join(sorted(unknown))}")
+        self.quirks = frozenset(quirks)
+        # engines that cached code for the old behaviour have to drop it
+        self.invalidate(0, len(self.memory))
+
+    @staticmethod
+    def memory_size(platform):
+        return XO_MEMORY_SIZE if platform == "xochip" else MEMORY_SIZE
+
+    def set_platform(self, platform):
+        # switches to another machine and resets it. every platform decodes
+        # with its own dispatch table, so CHIP-8 roms run on the same table
+        # as before and the additions cost nothing there
+        if platform not in PLATFORMS:
+            raise ValueError(f"unknown platform {platform}, expected one of: {', '.join(PLATFORMS)}")
+        self.platform = platform
+        self.dispatch = self.build_dispatch(platform)
+        size = self.memory_size(platform)
+        if len(self.memory) != size:
+            self.memory = bytearray(size)
+        self.init_system()
+
+    def reboot(self):
+        self.init_system()
+        self.load_rom()
+
+    def dump(self):
+        fname = "dump_mem_reg.txt"
+        op = (self.memory[self.pc] << 8) | self.memory[self.pc + 1]
+
+        with open(fname, "w") as f:
+            f.write(f"Instruction counter: {self.counter}\n")
+            f.write(f"Opcode: {op}\n")
+            f.write(f"I: {self.i}\n")
+            f.write(f"PC: {self.pc}\n")
+            f.write(f"SP: {self.sp}\n")
+            f.write(f"sound timer: {self.sound_timer}\n")
+            f.write(f"delay timer: {self.delay_timer}\n")
+
+            f.write(f"\n-----------------------------------------------------------\n\n")
+            for i, val in enumerate(self.stack):
+                f.write(f"stack[{i}] : {val}\n")
+
+            f.write(f"\n-----------------------------------------------------------\n\n")
+            for i, val in enumerate(self.v):
+                f.write(f"V[{i}] : {val}\n")
+
+            f.write(f"\n-----------------------------------------------------------\n\n")
+            for i, val in enumerate(self.memory):
+                f.write(f"{hex(i)} : {val}\n")
+        return fname
+
+    def save_state(self):
+        # compact binary snapshot of the whole machine, see savestate.py
+        return savestate.save(self)
+
+    def load_state(self, data):
+        savestate.load(self, data)
+
+    def invalidate(self, start, end):
+        # memory in [start, end) was changed outside of the opcode handlers.
+        # nothing is cached here, engines that cache code override this
+        pass
+
+    def step(self, n=1):
+        # execute n instructions
+        if self.profiler is not None:
+            return self.profiler.step(self, n)
+        if self.tracer is not None:
+            return self.tracer.step(self, n)
+
+        total = n
+        if self.skip_idle:
+            n = self.skip_idle_loop(n)
+
+        memory = self.memory
+        table = self.dispatch
+
+        for _ in range(n):
+            pc = self.pc
+            handler, a, b = table[(memory[pc] << 8) | memory[pc + 1]]
+            handler(self, a, b)
+        self.counter += total
+
+    def skip_idle_loop(self, n):
+        # timers and keys only change between step() calls, so a loop that
+        # comes back to its start address with nothing else changed (a jump
+        # to itself, polling FX07 or a key, FX0A without a key) repeats
+        # exactly until the end of the step. probes at most two times for
+        # such a loop, executing the instructions on the way, and drops all
+        # whole iterations of it. returns how many instructions are left to
+        # execute, the caller counts the skipped ones as executed so results
+        # are the same as running the loop.
+        # busy code is probed less and less often, probing costs about as
+        # much as the instructions it runs
+        if n < IDLE_MIN_STEP:
+            return n
+        if self.idle_wait:
+            self.idle_wait -= 1
+            return n
+
+        memory = self.memory
+        table = self.dispatch
+        v = self.v
+        fb = self.framebuffer
+
+        for _ in range(2):
+            if n <= 0:
+                break
+
+            start = self.pc
+            before = (v[:], self.i, self.sp, self.delay_timer, self.sound_timer, self.stack.tobytes(), [rows[:] for rows in fb.planes])
+            effects = False
+            executed = 0
+            limit = min(n, IDLE_PROBE)
+
+            while executed < limit:
+                pc = self.pc
+                handler, a, b = table[(memory[pc] << 8) | memory[pc + 1]]
+                # none of these effects are part of the comparison below
+                effects |= handler.__name__ in IDLE_EFFECTS
+                handler(self, a, b)
+                executed += 1
+                if self.pc == start:
+                    break
+
+            n -= executed
+            if self.pc == start and not effects:
+                after = (v[:], self.i, self.sp, self.delay_timer, self.sound_timer, self.stack.tobytes(), [rows[:] for rows in fb.planes])
+                if after == before:
+                    self.idle_backoff = 0
+                    return n % executed
+
+        self.idle_backoff = min(self.idle_backoff * 2 + 1, IDLE_BACKOFF)
+        self.idle_wait = self.idle_backoff
+        return n
+
+    def waiting_for_key(self):
+        # FX0A at pc and no key down, the machine cannot get past it
+        # until a key is pressed
+        memory = self.memory
+        pc = self.pc
+        if pc + 1 >= len(memory):
+            return False
+        return memory[pc] >> 4 == 0xF and memory[pc + 1] == 0x0A and not any(self.keys)
+
+    def tick_timers(self):
+        # called 60 times per second by whoever drives the machine
+        if self.delay_timer > 0:
+            self.delay_timer -= 1
+
+        if self.sound_timer > 0:
+            self.sound_timer -= 1
+
+    def run_frame(self):
+        # one 60 Hz frame: a batch of instructions, then one timer tick
+        self.step(self.cycles_per_frame)
+        self.tick_timers()
+        if self.profiler is not None:
+            self.profiler.frame_done(self)
+
+    def run_frames(self, n):
+        # no throttling, runs as fast as the host allows
+        for _ in range(n):
+            self.run_frame()
+
+    def execute_opcode(self, opcode):
+        handler, a, b = self.dispatch[opcode]
+        handler(self, a, b)
+
+    @classmethod
+    def build_dispatch(cls, platform="chip8"):
+        # decode every possible opcode once up front, one table per platform
+        # built when it is first used.
+        # dispatch[opcode] is (handler, a, b) with the operands already
+        # extracted, so executing an instruction is one list lookup and a call
+        if "dispatch_tables" not in cls.__dict__:
+            cls.dispatch_tables = {}
+        tables = cls.dispatch_tables
+        if platform not in tables:
+            tables[platform] = [cls.decode(opcode, platform) for opcode in range(0x10000)]
+        return tables[platform]
+
+    @classmethod
+    def decode(cls, opcode, platform="chip8"):
+        # returns (handler, a, b). handlers are looked up by name so
+        # subclasses can override single opcodes
+        handler, a, b = cls.decode_name(opcode, platform)
+        return (getattr(cls, handler), a, b)
+
+    @classmethod
+    def decode_name(cls, opcode, platform="chip8"):
+        if platform != "chip8":
+            decoded = cls.decode_extension(opcode, platform)
+            if decoded is not None:
+                return decoded
+
+        ident = opcode & 0xF000
+        x = (opcode & 0x0F00) >> 8
+        y = (opcode & 0x00F0) >> 4
+        n = opcode & 0x000F
+        nn = opcode & 0x00FF
+        nnn = opcode & 0x0FFF
+
+        if ident == 0x0000:
+            if n == 0x0:
+                return ("op_00e0", 0, 0)
+            if n == 0xE:
+                return ("op_00ee", 0, 0)
+            # opcode is 0NNN, not necessary for most roms
+            return ("op_nop", 0, 0)
+
+        if ident == 0x8000:
+            alu = cls.alu_ops.get(n)
+            if alu is None:
+                return ("op_nop", 0, 0)
+            return (alu, x, y)
+
+        if ident == 0xD000:
+            return ("op_dxyn", x, (y, n))
+
+        if ident == 0xE000:
+            if n == 0xE:
+                return ("op_ex9e", x, 0)
+            if n == 0x1:
+                return ("op_exa1", x, 0)
+            return ("op_nop", 0, 0)
+
+        if ident == 0xF000:
+            if n == 0x5:
+                handler = cls.f5_ops.get(y)
+            else:
+                handler = cls.f_ops.get(n)
+            if handler is None:
+                return ("op_nop", 0, 0)
+            return (handler, x, 0)
+
+        handler, operands = cls.ops[ident >> 12]
+        if operands == "nnn":
+            return (handler, nnn, 0)
+        if operands == "xnn":
+            return (handler, x, nn)
+        return (handler, x, y)
+
+    @classmethod
+    def decode_extension(cls, opcode, platform):
+        # SUPER-CHIP and XO-CHIP opcodes and the CHIP-8 ones they change,
+        # None for opcodes that decode like on CHIP-8
+        ident = opcode & 0xF000
+        x = (opcode & 0x0F00) >> 8
+        y = (opcode & 0x00F0) >> 4
+        n = opcode & 0x000F
+        nn = opcode & 0x00FF
+        xo = platform == "xochip"
+
+        if ident == 0x0000 and x == 0:
+            if nn & 0xF0 == 0xC0:
+                return ("op_00cn", n, 0)
+            if xo and nn & 0xF0 == 0xD0:
+                return ("op_00dn", n, 0)
+            if nn in cls.schip_00_ops:
+                return (cls.schip_00_ops[nn], 0, 0)
+
+        if ident == 0xD000:
+            return ("op_dxyn_planes", x, (y, n))
+
+        if ident == 0xF000:
+            if nn in cls.schip_f_ops:
+                return (cls.schip_f_ops[nn], x, 0)
+            if xo and opcode == 0xF000:
+                return ("op_f000", 0, 0)
+            if xo and opcode == 0xF002:
+                return ("op_f002", 0, 0)
+            if xo and nn in cls.xo_f_ops:
+                return (cls.xo_f_ops[nn], x, 0)
+
+        if xo and ident == 0x5000 and n in (0x2, 0x3):
+            return (f"op_5xy{n}", x, y)
+
+        if xo:
+            handler, a, b = cls.decode_name(opcode)
+            if handler in cls.xo_skips:
+                return (cls.xo_skips[handler], a, b)
+
+        return None
+
+    def op_nop(self, a, b):
+        # unknown opcode, pc is not advanced
+        pass
+
+    # 00E0
+    def op_00e0(self, a, b):
+        # display clear
+        # [XO-CHIP] only the selected planes
+        fb = self.framebuffer
+        fb.clear(fb.selected)
+        self.draw_flag = True
+        self.pc += 2
+
+    # 00CN (SUPER-CHIP)
+    def op_00cn(self, n, b):
+        # scroll the screen down by N rows
+        self.framebuffer.scroll_down(n)
+        self.draw_flag = True
+        self.pc += 2
+
+    # 00DN (XO-CHIP)
+    def op_00dn(self, n, b):
+        # scroll the screen up by N rows
+        self.framebuffer.scroll_up(n)
+        self.draw_flag = True
+        self.pc += 2
+
+    # 00FB (SUPER-CHIP)
+    def op_00fb(self, a, b):
+        # scroll the screen right by 4 pixels
+        self.framebuffer.scroll_right(4)
+        self.draw_flag = True
+        self.pc += 2
+
+    # 00FC (SUPER-CHIP)
+    def op_00fc(self, a, b):
+        # scroll the screen left by 4 pixels
+        self.framebuffer.scroll_left(4)
+        self.draw_flag = True
+        self.pc += 2
+
+    # 00FD (SUPER-CHIP)
+    def op_00fd(self, a, b):
+        # exit the interpreter. pc is not advanced, the machine stays here
+        pass
+
+    # 00FE (SUPER-CHIP)
+    def op_00fe(self, a, b):
+        # switch to 64x32, clears the screen
+        self.framebuffer.resize(64, 32)
+        self.draw_flag = True
+        self.pc += 2
+
+    # 00FF (SUPER-CHIP)
+    def op_00ff(self, a, b):
+        # switch to 128x64, clears the screen
+        self.framebuffer.resize(128, 64)
+        self.draw_flag = True
+        self.pc += 2
+
+    # 00EE
+    def op_00ee(self, a, b):
+        # return from subroutine
+        if self.sp > 0:
+            self.sp -= 1
+            self.pc = self.stack[self.sp] & 0x00FFFF
+            self.pc += 2
+
+    # 1NNN
+    def op_1nnn(self, nnn, b):
+        # jump to address NNN
+        self.pc = nnn
+
+    # 2NNN
+    def op_2nnn(self, nnn, b):
+        # calls subroutine at address NNN
+        self.stack[self.sp] = self.pc
+        if self.sp < 0xF:
+            self.sp += 1
+        self.pc = nnn
+
+    # 3XNN
+    def op_3xnn(self, x, nn):
+        # skips next instr if V[X] == NN
+        if self.v[x] == nn:
+            self.pc += 4
+        else:
+            self.pc += 2
+
+    # 4XNN
+    def op_4xnn(self, x, nn):
+        # skips next instr if VX != NN
+        if self.v[x] != nn:
+            self.pc += 4
+        else:
+            self.pc += 2
+
+    # 5XY0
+    def op_5xy0(self, x, y):
+        # skips next instr if VX == VY
+        v = self.v
+        if v[x] == v[y]:
+            self.pc += 4
+        else:
+            self.pc += 2
+
+    # 6XNN
+    def op_6xnn(self, x, nn):
+        # sets VX to NN
+        self.v[x] = nn
+        self.pc += 2
+
+    # 7XNN
+    def op_7xnn(self, x, nn):
+        # adds NN to VX (carry flag not changed)
+        v = self.v
+        v[x] = (v[x] + nn) & 0x00FF
+        self.pc += 2
+
+    # 8XY0
+    def op_8xy0(self, x, y):
+        # Sets VX to the value of VY
+        v = self.v
+        v[x] = v[y]
+        self.pc += 2
+
+    # 8XY1
+    def op_8xy1(self, x, y):
+        # set VX to VX or VY. (bitwise OR operation)
+        v = self.v
+        v[x] = v[x] | v[y]
+        self.pc += 2
+
+    # 8XY2
+    def op_8xy2(self, x, y):
+        # set VX to VX and VY. (bitwise AND operation)
+        v = self.v
+        v[x] = v[x] & v[y]
+        self.pc += 2
+
+    # 8XY3
+    def op_8xy3(self, x, y):
+        # set VX to VX xor VY.
+        v = self.v
+        v[x] = v[x] ^ v[y]
+        self.pc += 2
+
+    # 8XY4
+    def op_8xy4(self, x, y):
+        # Adds VY to VX. VF is set to 1 when there is a
+        # carry (meaning result > 0xFF (==255))
+        # and to 0 when not
+        v = self.v
+        total = v[x] + v[y]
+        v[0xF] = 0
+        if total > 0xFF:
+            v[0xF] = 1
+        v[x] = total & 0x00FF
+        self.pc += 2
+
+    # 8XY5
+    def op_8xy5(self, x, y):
+        # VY is subtracted from VX
+        # VF is set to 0 when there is a borrow
+        # and 1 when not
+        v = self.v
+        vx = v[x]
+        vy = v[y]
+        v[0xF] = 1
+        if vy > vx:
+            v[0xF] = 0
+        v[x] = (vx - vy) & 0x00FF
+        self.pc += 2
+
+    # 8XY6
+    def op_8xy6(self, x, y):
+        # store the least significant bit of VX in VF
+        # and then shift VX to the right by 1
+        # [LEGACY] VY is shifted instead of VX
+        v = self.v
+        vx = v[y] if "legacy_shift" in self.quirks else v[x]
+        v[0xF] = vx & 1
+        v[x] = vx >> 1
+        self.pc += 2
+
+    # 8XY7
+    def op_8xy7(self, x, y):
+        # set VX to VY minus VX
+        # VF is set to 0 when there is a borrow
+        # and 1 when not
+        v = self.v
+        vx = v[x]
+        vy = v[y]
+        v[0xF] = 1
+        if vx > vy:
+            v[0xF] = 0
+        v[x] = (vy - vx) & 0x00FF
+        self.pc += 2
+
+    # 8XYE
+    def op_8xye(self, x, y):
+        # store the most significant bit of VX in VF
+        # and then shifts VX to the left by 1
+        # [LEGACY] VY is shifted instead of VX
+        v = self.v
+        vx = v[y] if "legacy_shift" in self.quirks else v[x]
+        v[0xF] = (vx >> 7) & 1
+        v[x] = (vx << 1) & 0x00FF
+        self.pc += 2
+
+    # 9XY0
+    def op_9xy0(self, x, y):
+        # skip next instr if VX != VY
+        v = self.v
+        if v[x] != v[y]:
+            self.pc += 4
+        else:
+            self.pc += 2
+
+    # ANNN
+    def op_annn(self, nnn, b):
+        # set I to the address NNN
+        self.i = nnn
+        self.pc += 2
+
+    # BNNN
+    def op_bnnn(self, nnn, b):
+        # jump to adress NNN plus V0
+        self.pc = nnn + self.v[0]
+
+    # CXNN
+    def op_cxnn(self, x, nn):
+        # set VX to a random number (0 to 255)
+        # masked with NN
+        self.v[x] = self.rng.randint(0, 255) & nn
+        self.pc += 2
+
+    # DXYN
+    def op_dxyn(self, x, yn):
+        # draw sprite at position (VX, VY)
+        # using N bytes of sprite data at the address stored in I
+        # sprites are XORed onto existing screen
+        # if any pre-existing pixels are erasid in that process, the collision flag VF is set
+        y, n_rows = yn
+        v = self.v
+        i = self.i
+
+        if i + n_rows > len(self.memory):
+            raise IndexError("DXYN reads sprite data past the end of memory")
+
+        v[0xF] = self.framebuffer.draw(v[x], v[y], self.memory[i:i + n_rows])
+
+        self.draw_flag = True
+        self.pc += 2
+
+    # DXYN (SUPER-CHIP, XO-CHIP)
+    def op_dxyn_planes(self, x, yn):
+        # DXYN on every selected plane, the sprites of the planes follow
+        # each other at I. N = 0 draws a 16x16 sprite, 32 bytes per plane.
+        # the position wraps around, pixels past the edges are clipped
+        y, n_rows = yn
+        v = self.v
+        memory = self.memory
+        fb = self.framebuffer
+        px = v[x] % fb.x_size
+        py = v[y] % fb.y_size
+        i = self.i
+        collision = 0
+
+        for plane in fb.selected_planes():
+            size = n_rows or 32
+            if i + size > len(memory):
+                raise IndexError("DXYN reads sprite data past the end of memory")
+            if n_rows:
+                collision |= fb.draw(px, py, memory[i:i + n_rows], plane)
+            else:
+                sprite = [(memory[k] << 8) | memory[k + 1] for k in range(i, i + 32, 2)]
+                collision |= fb.draw(px, py, sprite, plane, 16)
+            i += size
+
+        v[0xF] = collision
+        self.draw_flag = True
+        self.pc += 2
+
+    # EX9E
+    def op_ex9e(self, x, b):
+        # skip the next instruction if the key stored in VX is pressed
+        if self.keys[self.v[x]]:
+            self.pc += 4
+        else:
+            self.pc += 2
+
+    # EXA1
+    def op_exa1(self, x, b):
+        # skip the next instruction if the key stored in VX is not pressed
+        if not self.keys[self.v[x]]:
+            self.pc += 4
+        else:
+            self.pc += 2
+
+    # FX07
+    def op_fx07(self, x, b):
+        # set VX to the value of the delay timer
+        self.v[x] = self.delay_timer & 0x00FF
+        self.pc += 2
+
+    # FX0A
+    def op_fx0a(self, x, b):
+        # wait for key press and then store key in VX
+        # this blocks until a key has been pressed
+        if 1 in self.keys:
+            self.v[x] = self.keys.index(1)
+            self.pc += 2
+        # else: leave pc on this opcode so it is repeated until a
+        # key has been pressed
+
+    # FX15
+    def op_fx15(self, x, b):
+        # set the delay timer to VX
+        self.delay_timer = self.v[x]
+        self.pc += 2
+
+    # FX18
+    def op_fx18(self, x, b):
+        # set the sound timer to VX
+        self.sound_timer = self.v[x]
+        self.pc += 2
+
+    # FX1E
+    def op_fx1e(self, x, b):
+        # add VX to I
+        self.i = (self.i + self.v[x]) & 0x00FFFF # TODO is modulo here correct or not? test rom only passes without modulo. why??
+        self.pc += 2
+
+    # FX29
+    def op_fx29(self, x, b):
+        # set I to the location of the sprite for the character in VX
+        # characters 0-F are represented by a 4x5 font
+        self.i = self.v[x] * 5  # times 5 because each char is 5 long
+        self.pc += 2
+
+    # FX33
+    def op_fx33(self, x, b):
+        # Stores the binary-coded decimal representation of VX.)
+        # vx is 3 digit decimal number
+        vx = self.v[x]
+        i = self.i
+        memory = self.memory
+        # get hundreds
+        memory[i] = vx // 100
+        # get tens
+        memory[i + 1] = (vx // 10) % 10
+        # get ones
+        memory[i + 2] = vx % 10
+        self.pc += 2
+
+    # FX30 (SUPER-CHIP)
+    def op_fx30(self, x, b):
+        # set I to the 8x10 font character for the digit in VX
+        self.i = BIG_FONT_START + (self.v[x] & 0xF) * 10
+        self.pc += 2
+
+    # FX75 (SUPER-CHIP)
+    def op_fx75(self, x, b):
+        # store V0 to VX in the RPL user flags
+        self.flags[:x + 1] = self.v[:x + 1]
+        self.pc += 2
+
+    # FX85 (SUPER-CHIP)
+    def op_fx85(self, x, b):
+        # fill V0 to VX from the RPL user flags
+        self.v[:x + 1] = self.flags[:x + 1]
+        self.pc += 2
+
+    # F000 NNNN (XO-CHIP)
+    def op_f000(self, a, b):
+        # set I to the 16 bit address in the next two bytes
+        pc = self.pc
+        memory = self.memory
+        if pc + 3 >= len(memory):
+            raise IndexError("F000 NNNN reads past the end of memory")
+        self.i = (memory[pc + 2] << 8) | memory[pc + 3]
+        self.pc += 4
+
+    # FN01 (XO-CHIP)
+    def op_fn01(self, n, b):
+        # select the planes in bitmask N for drawing, clearing and scrolling
+        self.framebuffer.selected = n & 0x3
+        self.pc += 2
+
+    # F002 (XO-CHIP)
+    def op_f002(self, a, b):
+        # load the 16 byte audio pattern at I
+        i = self.i
+        if i + 16 > len(self.memory):
+            raise IndexError("F002 reads past the end of memory")
+        self.pattern = bytes(self.memory[i:i + 16])
+        self.pc += 2
+
+    # FX3A (XO-CHIP)
+    def op_fx3a(self, x, b):
+        # set the playback rate of the audio pattern to VX
+        self.pitch = self.v[x]
+        self.pc += 2
+
+    # 5XY2 (XO-CHIP)
+    def op_5xy2(self, x, y):
+        # store VX to VY in memory starting at I, in reverse order when X
+        # is larger than Y. I is not changed
+        v = self.v
+        regs = v[x:y + 1] if x <= y else v[y:x + 1][::-1]
+        i = self.i
+        if i + len(regs) > len(self.memory):
+            raise IndexError("5XY2 writes past the end of memory")
+        self.memory[i:i + len(regs)] = bytes(regs)
+        self.pc += 2
+
+    # 5XY3 (XO-CHIP)
+    def op_5xy3(self, x, y):
+        # fill VX to VY from memory starting at I, see 5XY2
+        count = abs(x - y) + 1
+        i = self.i
+        if i + count > len(self.memory):
+            raise IndexError("5XY3 reads past the end of memory")
+        data = list(self.memory[i:i + count])
+        if x <= y:
+            self.v[x:y + 1] = data
+        else:
+            self.v[y:x + 1] = data[::-1]
+        self.pc += 2
+
+    def skip_next(self):
+        # XO-CHIP skips step over F000 NNNN as a whole
+        pc = self.pc + 2
+        memory = self.memory
+        if pc + 1 < len(memory) and memory[pc] == 0xF0 and memory[pc + 1] == 0x00:
+            self.pc = pc + 4
+        else:
+            self.pc = pc + 2
+
+    # 3XNN (XO-CHIP)
+    def op_3xnn_xo(self, x, nn):
+        if self.v[x] == nn:
+            self.skip_next()
+        else:
+            self.pc += 2
+
+    # 4XNN (XO-CHIP)
+    def op_4xnn_xo(self, x, nn):
+        if self.v[x] != nn:
+            self.skip_next()
+        else:
+            self.pc += 2
+
+    # 5XY0 (XO-CHIP)
+    def op_5xy0_xo(self, x, y):
+        if self.v[x] == self.v[y]:
+            self.skip_next()
+        else:
+            self.pc += 2
+
+    # 9XY0 (XO-CHIP)
+    def op_9xy0_xo(self, x, y):
+        if self.v[x] != self.v[y]:
+            self.skip_next()
+        else:
+            self.pc += 2
+
+    # EX9E (XO-CHIP)
+    def op_ex9e_xo(self, x, b):
+        if self.keys[self.v[x]]:
+            self.skip_next()
+        else:
+            self.pc += 2
+
+    # EXA1 (XO-CHIP)
+    def op_exa1_xo(self, x, b):
+        if not self.keys[self.v[x]]:
+            self.skip_next()
+        else:
+            self.pc += 2
+
+    # FX55
+    def op_fx55(self, x, b):
+        # store V0 to VX (including VX) in memory starting at
+        # address I
+        # [LEGACY] I is set to I + X + 1 after operation
+        i = self.i
+        if i + x >= len(self.memory):
+            raise IndexError("FX55 writes past the end of memory")
+        self.memory[i:i + x + 1] = self.v[:x + 1]
+        if "legacy_load_store" in self.quirks:
+            self.i = (i + x + 1) & 0x00FFFF
+        self.pc += 2
+
+    # FX65
+    def op_fx65(self, x, b):
+        # fill V0 to VX (including VX) with values from memory
+        # starting at address I
+        # [LEGACY] I is set to I + X + 1 after operation
+        i = self.i
+        if i + x >= len(self.memory):
+            raise IndexError("FX65 reads past the end of memory")
+        self.v[:x + 1] = self.memory[i:i + x + 1]
+        if "legacy_load_store" in self.quirks:
+            self.i = (i + x + 1) & 0x00FFFF
+        self.pc += 2
+
+    # handler and operand layout per leading nibble, for the groups
+    # that are not decoded further
+    ops = {
+        0x1: ("op_1nnn", "nnn"),
+        0x2: ("op_2nnn", "nnn"),
+        0x3: ("op_3xnn", "xnn"),
+        0x4: ("op_4xnn", "xnn"),
+        0x5: ("op_5xy0", "xy"),
+        0x6: ("op_6xnn", "xnn"),
+        0x7: ("op_7xnn", "xnn"),
+        0x9: ("op_9xy0", "xy"),
+        0xA: ("op_annn", "nnn"),
+        0xB: ("op_bnnn", "nnn"),
+        0xC: ("op_cxnn", "xnn"),
+    }
+
+    # 8XYN, keyed by N
+    alu_ops = {
+        0x0: "op_8xy0",
+        0x1: "op_8xy1",
+        0x2: "op_8xy2",
+        0x3: "op_8xy3",
+        0x4: "op_8xy4",
+        0x5: "op_8xy5",
+        0x6: "op_8xy6",
+        0x7: "op_8xy7",
+        0xE: "op_8xye",
+    }
+
+    # FXNN, keyed by the last nibble
+    f_ops = {
+        0x7: "op_fx07",
+        0xA: "op_fx0a",
+        0x8: "op_fx18",
+        0xE: "op_fx1e",
+        0x9: "op_fx29",
+        0x3: "op_fx33",
+    }
+
+    # FX?5, keyed by the third nibble
+    f5_ops = {
+        0x1: "op_fx15",
+        0x5: "op_fx55",
+        0x6: "op_fx65",
+    }
+
+    # SUPER-CHIP 00NN, keyed by NN. SUPER-CHIP opcodes are part of
+    # XO-CHIP as well
+    schip_00_ops = {
+        0xFB: "op_00fb",
+        0xFC: "op_00fc",
+        0xFD: "op_00fd",
+        0xFE: "op_00fe",
+        0xFF: "op_00ff",
+    }
+
+    # SUPER-CHIP FXNN, keyed by NN
+    schip_f_ops = {
+        0x30: "op_fx30",
+        0x75: "op_fx75",
+        0x85: "op_fx85",
+    }
+
+    # XO-CHIP FXNN, keyed by NN
+    xo_f_ops = {
+        0x01: "op_fn01",
+        0x3A: "op_fx3a",
+    }
+
+    # XO-CHIP versions of the skips, see skip_next
+    xo_skips = {
+        "op_3xnn": "op_3xnn_xo",
+        "op_4xnn": "op_4xnn_xo",
+        "op_5xy0": "op_5xy0_xo",
+        "op_9xy0": "op_9xy0_xo",
+        "op_ex9e": "op_ex9e_xo",
+        "op_exa1": "op_exa1_xo",
+    }
+
+    def shutdown(self):
+        self.running = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a chip8 rom headless and report throughput")
+    parser.add_argument("rom")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--ips", type=int, default=DEFAULT_IPS, help="instructions per second of emulated time")
+    parser.add_argument("--jit", action="store_true", help="translate hot code into python functions")
+    parser.add_argument("--aot", action="store_true", help="like --jit, with the reachable code compiled up front and cached, see aot.py")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the CXNN random numbers")
+    parser.add_argument("--platform", choices=PLATFORMS, default=None, help="machine to emulate, guessed from the file extension if left out")
+    parser.add_argument("--no-skip-idle", action="store_true", help="execute idle loops instead of skipping them, e.g. to measure raw throughput")
+    parser.add_argument("--profile", default=None, help="count executed opcodes and addresses, write them to this json file")
+    parser.add_argument("--trace", default=None, help="record every executed instruction to this file, see tracer.py")
+    args = parser.parse_args()
+
+    if args.profile and args.trace:
+        # both replace the interpreter loop, see Core.step
+        parser.error("--profile and --trace cannot be combined")
+
+    if args.aot:
+        from aot import AotCore
+        emu = AotCore(args.seed)
+    elif args.jit:
+        from jit import JitCore
+        emu = JitCore(args.seed)
+    else:
+        emu = Core(args.seed)
+    emu.set_speed(args.ips)
+    emu.skip_idle = not args.no_skip_idle
+    emu.set_platform(args.platform or guess_platform(args.rom))
+    emu.load_rom(args.rom)
+
+    if args.profile:
+        from profiler import Profiler
+        emu.profiler = Profiler()
+
+    if args.trace:
+        from tracer import Tracer
+        emu.tracer = Tracer(args.trace, emu.counter)
+
+    start = time.perf_counter()
+    emu.run_frames(args.frames)
+    elapsed = time.perf_counter() - start
+
+    print(f"{emu.counter} instructions in {elapsed:.3f}s ({emu.counter / elapsed:.0f} instructions/s)")
+
+    if args.profile:
+        print(f"wrote profile to {emu.profiler.save(emu, args.profile)}")
+
+    if args.trace:
+        print(f"wrote trace to {emu.tracer.close()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,553 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from core import Core, EXTENSIONS, PLATFORMS, PROGRAM_START, QUIRKS, guess_platform
+
+# instructions between two state comparisons. comparisons also happen at
+# frame ends when a frame is shorter
+INTERVAL = 1000
+
+# fast paths that can be checked against the reference interpreter, a
+# plain Core without idle skipping
+ENGINES = ("jit", "aot", "idle")
+
+# what both engines are told to do, recorded since the last comparison so
+# that a divergence can be replayed
+STEP = 0
+TICK = 1
+KEYS = 2
+STATE = 3
+
+# file extension of fuzz roms by platform
+ROM_EXTENSIONS = {platform: extension for extension, platform in EXTENSIONS.items()}
+
+
+def make_engine(engine, seed, cache_dir=None):
+    # engine is one of ENGINES, or None for the reference
+    if engine == "jit":
+        from jit import JitCore
+        return JitCore(seed)
+    if engine == "aot":
+        from aot import AotCore
+        emu = AotCore(seed)
+        if cache_dir is not None:
+            emu.cache_dir = cache_dir
+        return emu
+    emu = Core(seed)
+    emu.skip_idle = engine == "idle"
+    return emu
+
+
+def snapshot(core):
+    # the state that is compared, by name. hashed for the periodic checks,
+    # compared field by field once engines diverged
+    fb = core.framebuffer
+    return {
+        "pc": core.pc,
+        "i": core.i,
+        "sp": core.sp,
+        "v": bytes(core.v),
+        "stack": core.stack.tobytes(),
+        "timers": (core.delay_timer, core.sound_timer),
+        "memory": bytes(core.memory),
+        "screen": (fb.x_size, fb.y_size, fb.selected, tuple(tuple(rows) for rows in fb.planes)),
+        "flags": tuple(core.flags),
+    }
+
+
+def state_hash(core):
+    # python's hash of bytes and tuples runs in C, a comparison costs a few
+    # microseconds. only ever compared within one process
+    return hash(tuple(snapshot(core).values()))
+
+
+def perform(emu, op, arg):
+    # one recorded operation, returns the name of the exception it raised
+    # or None. a machine that raised is not run any further
+    try:
+        if op == STEP:
+            emu.step(arg)
+        elif op == TICK:
+            emu.tick_timers()
+        elif op == KEYS:
+            emu.keys[:] = [bool((arg >> idx) & 1) for idx in range(16)]
+        elif op == STATE:
+            cycles_per_frame, quirks, state = arg
+            emu.cycles_per_frame = cycles_per_frame
+            emu.set_quirks(quirks)
+            emu.load_state(state)
+    except Exception as e:
+        return type(e).__name__
+    return None
+
+
+def describe(name, reference, candidate):
+    # short text for one field that differs
+    if name == "v":
+        return ", ".join(f"V{idx:X} {a:02X}/{b:02X}" for idx, (a, b) in enumerate(zip(reference, candidate)) if a != b)
+    if name == "memory":
+        addresses = [addr for addr in range(min(len(reference), len(candidate))) if reference[addr] != candidate[addr]]
+        shown = ", ".join(f"{addr:#05x} {reference[addr]:02X}/{candidate[addr]:02X}" for addr in addresses[:8])
+        more = f" and {len(addresses) - 8} more" if len(addresses) > 8 else ""
+        return f"{len(addresses)} bytes: {shown}{more}"
+    if name == "screen":
+        if reference[:3] != candidate[:3]:
+            return f"size and planes {reference[:3]}/{candidate[:3]}"
+        rows = sorted({y for a, b in zip(reference[3], candidate[3]) for y in range(len(a)) if a[y] != b[y]})
+        return f"rows {', '.join(map(str, rows))}"
+    if name in ("pc", "i"):
+        return f"{reference:#05x}/{candidate:#05x}"
+    return f"{reference}/{candidate}"
+
+
+class Divergence:
+    # first point where the candidate engine stopped matching the reference.
+    # fields maps each field that differs to "reference/candidate" text.
+    # counter is the number of the bad instruction since boot, 1 based.
+    # state is a save state of the reference right before it, loadable with
+    # chip8.py --state.
+    # span is 1 once bisected. when restoring the last matching state on
+    # fresh engines does not diverge again, the cached code of the
+    # candidate is involved and only the span of instructions starting at
+    # counter is known
+
+    def __init__(self, engine, frame, counter, pc, opcode, after, fields, state, span=1):
+
+        self.engine = engine
+        self.frame = frame
+        self.counter = counter
+        self.pc = pc
+        self.opcode = opcode
+        # True when the instruction itself matched and what followed it
+        # (a timer tick, a key change) diverged. pc and opcode are those of
+        # the next instruction then, and state is from right before the
+        # divergence as well
+        self.after = after
+        self.fields = fields
+        self.state = state
+        self.span = span
+        # (start, end) of the compiled block of the candidate around pc
+        self.block = None
+        # set by the fuzz driver
+        self.rom = None
+
+    def __str__(self):
+        where = f"instruction {self.counter}, pc {self.pc:#05x}, opcode {self.opcode:04X}"
+        if self.span > 1:
+            where = f"within {self.span} instructions from {where}, not reproducible from a save state"
+        elif self.after:
+            where = f"after instruction {self.counter}, before pc {self.pc:#05x}, opcode {self.opcode:04X}"
+        else:
+            where = f"at {where}"
+        lines = [f"{self.engine} diverged in frame {self.frame} {where}"]
+        lines += [f"  {name:<7} {text}" for name, text in self.fields.items()]
+        if self.block is not None:
+            lines.append(f"  block   {self.block[0]:#05x}-{self.block[1]:#05x} of the candidate")
+        return "\n".join(lines)
+
+
+class Lockstep:
+    # runs a candidate engine and the reference Core side by side on the
+    # same rom, seed and inputs. their states are hashed and compared every
+    # interval instructions. on a mismatch the operations since the last
+    # matching comparison are replayed on fresh engines restored from its
+    # save state, bisecting down to the first instruction after which the
+    # two differ
+
+    def __init__(self, rom_path, engine, seed=0, platform=None, quirks=(), cycles_per_frame=None, interval=INTERVAL, cache_dir=None):
+
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine {engine}, expected one of: {', '.join(ENGINES)}")
+
+        self.rom_path = rom_path
+        self.engine = engine
+        self.seed = seed
+        self.platform = platform or guess_platform(rom_path)
+        self.quirks = quirks
+        self.cycles_per_frame = cycles_per_frame
+        self.interval = interval
+        self.cache_dir = cache_dir
+
+        self.reference, self.candidate = self.boot()
+        self.frame = 0
+        self.comparisons = 0
+        # why the run ended early, both engines raised the same exception
+        self.halted = None
+
+        # last matching comparison: STATE argument restoring the reference
+        # there and its frame, then every operation and the instructions
+        # run since
+        self.checkpoint = None
+        self.checkpoint_frame = 0
+        self.ops = []
+        self.pending = 0
+        self.errors = [None, None]
+        self.save_checkpoint()
+
+    def boot(self):
+        engines = []
+        for engine in (None, self.engine):
+            emu = make_engine(engine, self.seed, self.cache_dir)
+            emu.set_platform(self.platform)
+            emu.set_quirks(self.quirks)
+            if self.cycles_per_frame:
+                emu.cycles_per_frame = self.cycles_per_frame
+            emu.load_rom(self.rom_path)
+            engines.append(emu)
+        return engines
+
+    def apply(self, op, arg=None):
+        self.ops.append((op, arg))
+        for idx, emu in enumerate((self.reference, self.candidate)):
+            if self.errors[idx] is None:
+                self.errors[idx] = perform(emu, op, arg)
+
+    def run(self, frames, events=None):
+        # events maps frame numbers to [(op, arg)] applied in front of that
+        # frame, KEYS and STATE only. returns a Divergence or None
+        events = events or {}
+        for _ in range(frames):
+            for op, arg in events.get(self.frame, ()):
+                self.apply(op, arg)
+                if op == STATE:
+                    divergence = self.compare()
+                    if divergence is not None or self.halted:
+                        return divergence
+
+            left = self.reference.cycles_per_frame
+            while left:
+                n = min(left, self.interval - self.pending)
+                self.apply(STEP, n)
+                self.pending += n
+                left -= n
+                if self.pending == self.interval or any(self.errors):
+                    divergence = self.compare()
+                    if divergence is not None or self.halted:
+                        return divergence
+            self.apply(TICK)
+            self.frame += 1
+
+        return self.compare()
+
+    def compare(self):
+        self.comparisons += 1
+        reference_error, candidate_error = self.errors
+        if reference_error or candidate_error:
+            if reference_error == candidate_error:
+                self.halted = f"both raised {reference_error}"
+                return None
+            return self.bisect()
+
+        if state_hash(self.reference) != state_hash(self.candidate):
+            return self.bisect()
+
+        self.save_checkpoint()
+        return None
+
+    def save_checkpoint(self):
+        reference = self.reference
+        self.checkpoint = (reference.cycles_per_frame, reference.quirks, reference.save_state())
+        self.checkpoint_frame = self.frame
+        self.ops = []
+        self.pending = 0
+
+    def probe(self, limit, exact=False):
+        # fresh engines at the checkpoint, then the recorded operations up
+        # to the limit-th instruction. operations between that instruction
+        # and the next one are run as well unless exact is set.
+        # returns (reference, candidate, errors)
+        engines = self.boot()
+        errors = [perform(emu, STATE, self.checkpoint) for emu in engines]
+
+        done = 0
+        for op, arg in self.ops:
+            if op == STEP and done + arg > limit:
+                # the limit-th instruction is inside this step, what comes
+                # after the step follows later instructions
+                arg = limit - done
+                for idx, emu in enumerate(engines):
+                    if errors[idx] is None and arg:
+                        errors[idx] = perform(emu, STEP, arg)
+                break
+            if op != STEP and exact and done == limit:
+                break
+            if op == STEP:
+                done += arg
+            for idx, emu in enumerate(engines):
+                if errors[idx] is None:
+                    errors[idx] = perform(emu, op, arg)
+
+        return engines[0], engines[1], errors
+
+    def differs(self, limit, exact=False):
+        reference, candidate, errors = self.probe(limit, exact)
+        if any(errors):
+            return errors[0] != errors[1]
+        return state_hash(reference) != state_hash(candidate)
+
+    def bisect(self):
+        total = sum(arg for op, arg in self.ops if op == STEP)
+
+        if self.differs(total):
+            # smallest k for which running up to the k-th instruction, and
+            # the timer ticks and key changes after it, differs. the
+            # checkpoint itself (exact 0) matched
+            low, high = -1, total
+            while high - low > 1:
+                middle = (low + high) // 2
+                if self.differs(middle):
+                    high = middle
+                else:
+                    low = middle
+            bad = high
+            span = 1
+            reference, candidate, errors = self.probe(bad, exact=True)
+            after = bad == 0 or not (any(errors) or state_hash(reference) != state_hash(candidate))
+            if after:
+                # the instruction matched, what ran between it and the next
+                # one did not
+                before = reference
+                reference, candidate, errors = self.probe(bad)
+            else:
+                before, _, _ = self.probe(bad - 1)
+        else:
+            bad = 1
+            span = total
+            after = False
+            before, _, _ = self.probe(0, exact=True)
+            reference, candidate, errors = self.reference, self.candidate, self.errors
+
+        # frame the bad instruction ran in
+        frame = self.checkpoint_frame
+        done = 0
+        for op, arg in self.ops:
+            if done >= bad:
+                break
+            if op == STEP:
+                done += arg
+            elif op == TICK:
+                frame += 1
+
+        # compiled engines stop blocks at any instruction, so the bad one is
+        # found exactly. the block around it helps telling translation bugs
+        # from handler bugs
+        covering = [(start, end) for start, (func, count, end) in getattr(candidate, "blocks", {}).items() if start <= before.pc < end]
+        block = min(covering) if covering else None
+
+        if any(errors):
+            fields = {"error": f"{errors[0]}/{errors[1]}"}
+        else:
+            reference_state = snapshot(reference)
+            candidate_state = snapshot(candidate)
+            fields = {
+                name: describe(name, reference_state[name], candidate_state[name])
+                for name in reference_state if reference_state[name] != candidate_state[name]
+            }
+
+        # the bad instruction, or the one after the divergence
+        memory = before.memory
+        pc = before.pc
+        opcode = (memory[pc] << 8) | memory[pc + 1] if pc + 1 < len(memory) else 0
+        counter = before.counter if after else before.counter + 1
+        divergence = Divergence(self.engine, frame, counter, pc, opcode, after, fields, before.save_state(), span)
+        divergence.block = block
+        return divergence
+
+
+def random_keys(seed, frames):
+    # key changes for frames, a few per second with at most two keys down
+    rng = random.Random(seed)
+    events = {}
+    for frame in range(frames):
+        if rng.random() < 0.1:
+            mask = 0
+            for _ in range(rng.randrange(3)):
+                mask |= 1 << rng.randrange(16)
+            events[frame] = [(KEYS, mask)]
+    return events
+
+
+def replay_events(path):
+    # events of an input log written by replay.InputRecorder, and the frame
+    # it ends at
+    import replay
+
+    events = {}
+    end = 0
+    for frame, kind, payload in replay.read_events(path):
+        end = frame
+        if kind == replay.KEYS:
+            events.setdefault(frame, []).append((KEYS, payload))
+        elif kind == replay.STATE:
+            events.setdefault(frame, []).append((STATE, payload))
+    return events, end
+
+
+# share of the instructions random_rom draws as fully random words, with
+# encodings the decoder folds onto the same handler (FXY3 runs FX33 for
+# any Y) or does not know at all
+RANDOM_WORDS = 0.1
+
+
+def random_rom(rng, size=256, platform="chip8"):
+    # size random instructions. jumps and calls mostly go forward and the
+    # last instruction jumps back to the start, so execution keeps passing
+    # through most of the program instead of settling in a short cycle.
+    # I points into the program or at the font, so FX33/FX55 keep
+    # rewriting the code the fast engines compiled
+    end = PROGRAM_START + size * 2
+    f_ops = [0x07, 0x0A, 0x15, 0x18, 0x1E, 0x29, 0x33, 0x55, 0x65]
+    zero_ops = [0x00E0, 0x00EE]
+    if platform != "chip8":
+        f_ops += [0x30, 0x75, 0x85]
+        zero_ops += [0x00C0, 0x00FB, 0x00FC, 0x00FE, 0x00FF]
+    if platform == "xochip":
+        f_ops += [0x01, 0x02, 0x3A]
+        zero_ops += [0x00D0]
+
+    words = []
+    for idx in range(size - 1):
+        kind = rng.randrange(16)
+        x = rng.randrange(16)
+        low = rng.randrange(0x100)
+        if rng.random() < 0.1:
+            target = PROGRAM_START + 2 * rng.randrange(size)
+        else:
+            target = PROGRAM_START + 2 * rng.randrange(idx + 1, size)
+        if rng.random() < RANDOM_WORDS:
+            op = rng.randrange(0x10000)
+            # addresses stay in the program like below, so a random jump
+            # does not run off into empty memory and I does not point
+            # where FX55 faults
+            if op >> 12 in (0x1, 0x2, 0xB):
+                op = (op & 0xF000) | target
+            elif op >> 12 == 0xA:
+                op = 0xA000 | rng.randrange(0, end)
+        elif kind == 0x0:
+            op = rng.choice(zero_ops)
+            if op in (0x00C0, 0x00D0):
+                op |= rng.randrange(16)
+        elif kind in (0x1, 0x2):
+            op = (kind << 12) | target
+        elif kind == 0xA:
+            op = 0xA000 | rng.randrange(0, end)
+        elif kind == 0xB:
+            op = 0xB000 | target
+        elif kind == 0x8:
+            op = 0x8000 | (x << 8) | (rng.randrange(16) << 4) | rng.choice([0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE])
+        elif kind == 0xE:
+            op = 0xE000 | (x << 8) | rng.choice([0x9E, 0xA1])
+        elif kind == 0xF:
+            op = 0xF000 | (x << 8) | rng.choice(f_ops)
+        else:
+            op = (kind << 12) | (x << 8) | low
+        words.append(op)
+    words.append(0x1000 | PROGRAM_START)
+
+    return b"".join(word.to_bytes(2, "big") for word in words)
+
+
+def fuzz_one(seed, engine, platform, frames, interval, size):
+    # checks one random rom, executed in a worker process.
+    # returns (seed, Divergence or None, instructions, halted)
+    rng = random.Random(seed)
+    rom = random_rom(rng, size, platform)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"fuzz_{seed}{ROM_EXTENSIONS[platform]}")
+        with open(path, "wb") as f:
+            f.write(rom)
+        checker = Lockstep(path, engine, seed, platform, interval=interval, cache_dir=os.path.join(tmp, "aot_cache"))
+        divergence = checker.run(frames, random_keys(seed, frames))
+
+    if divergence is not None:
+        divergence.rom = rom
+    return seed, divergence, checker.reference.counter, checker.halted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fast engine in lockstep with the reference interpreter and report where they diverge")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    check = commands.add_parser("check", help="check one rom")
+    check.add_argument("rom")
+    check.add_argument("--frames", type=int, default=600, help="frames to run, by default the length of --replay or 600")
+    check.add_argument("--replay", default=None, help="input log written with chip8.py --record to feed both engines")
+    check.add_argument("--quirks", default="", help=f"comma separated, any of: {', '.join(QUIRKS)}")
+    check.add_argument("--save-divergence", default=None, metavar="PATH", help="write a save state from right before the first bad instruction")
+    check.add_argument("--seed", type=int, default=0, help="seed for the CXNN random numbers")
+
+    fuzz = commands.add_parser("fuzz", help="check random roms in a process pool")
+    fuzz.add_argument("--roms", type=int, default=100)
+    fuzz.add_argument("--first-seed", type=int, default=0, help="rom k is generated from seed first-seed + k")
+    fuzz.add_argument("--frames", type=int, default=300)
+    fuzz.add_argument("--size", type=int, default=256, help="instructions per rom")
+    fuzz.add_argument("--jobs", type=int, default=os.cpu_count())
+    fuzz.add_argument("--out", default=".", help="directory the roms that diverged are written to")
+
+    for command in (check, fuzz):
+        command.add_argument("--engine", choices=ENGINES, default="jit")
+        command.add_argument("--interval", type=int, default=INTERVAL, help="instructions between state comparisons")
+        command.add_argument("--platform", choices=PLATFORMS, default=None, help="machine to emulate, guessed from the file extension" if command is check else "machine to emulate, chip8 by default")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    if args.command == "check":
+        quirks = [quirk for quirk in args.quirks.split(",") if quirk]
+        unknown = set(quirks) - set(QUIRKS)
+        if unknown:
+            print(f"unknown quirks: {', '.join(sorted(unknown))}")
+            return 1
+
+        events = None
+        frames = args.frames
+        if args.replay:
+            events, frames = replay_events(args.replay)
+
+        checker = Lockstep(args.rom, args.engine, args.seed, args.platform, quirks, interval=args.interval)
+        divergence = checker.run(frames, events)
+        elapsed = time.perf_counter() - start
+
+        if divergence is None:
+            halted = f", stopped early: {checker.halted}" if checker.halted else ""
+            print(f"{args.engine} matches the reference: {checker.frame} frames, {checker.reference.counter} instructions, "
+                  f"{checker.comparisons} comparisons in {elapsed:.2f}s{halted}")
+            return 0
+
+        print(divergence)
+        if args.save_divergence:
+            with open(args.save_divergence, "wb") as f:
+                f.write(divergence.state)
+            print(f"wrote state before the divergence to {args.save_divergence}")
+        return 1
+
+    platform = args.platform or "chip8"
+    seeds = range(args.first_seed, args.first_seed + args.roms)
+    diverged = 0
+    instructions = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(fuzz_one, seed, args.engine, platform, args.frames, args.interval, args.size) for seed in seeds]
+        for future in futures:
+            seed, divergence, count, halted = future.result()
+            instructions += count
+            if divergence is None:
+                continue
+            diverged += 1
+            path = os.path.join(args.out, f"fuzz_{seed}{ROM_EXTENSIONS[platform]}")
+            with open(path, "wb") as f:
+                f.write(divergence.rom)
+            print(f"seed {seed}, wrote {path}")
+            print(divergence)
+
+    elapsed = time.perf_counter() - start
+    print(f"{args.roms} roms, {diverged} diverged, {instructions} instructions in {elapsed:.1f}s")
+    return 1 if diverged else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+from framebuffer import Framebuffer
+
+
+class Display:
+    # what a front-end needs from a display backend. the framebuffer is
+    # owned by the core, a display only draws it:
+    #   start         open the output and draw everything
+    #   clear         clear the framebuffer
+    #   refresh       draw the rows marked dirty in the framebuffer, or all
+    #                 of them with full=True, then reset framebuffer.dirty
+    #   show_menu     draw the help text around the picture
+    #   show_paused   mark the output as paused or running again
+    #   destroy       close the output
+    # backends: screen.Screen (pygame window), terminal.TerminalDisplay
+    # (ANSI terminal)
+
+    def __init__(self, framebuffer=None):
+
+        if framebuffer is None:
+            framebuffer = Framebuffer()
+        self.framebuffer = framebuffer
+
+        self.x_size = framebuffer.x_size
+        self.y_size = framebuffer.y_size
+
+    def start(self):
+        self.show_menu()
+
+    def clear(self):
+        self.framebuffer.clear()
+
+    def dump(self):
+        return self.framebuffer.dump()
+
+    def refresh(self, full=False):
+        raise NotImplementedError
+
+    def show_menu(self):
+        self.refresh(full=True)
+
+    def show_paused(self, paused):
+        pass
+
+    def destroy(self):
+        pass
+
+
+class Input:
+    # what a front-end needs from an input source. inputs turn whatever
+    # the player does into calls on the front-end (press, release,
+    # toggle_pause, save_slot, ...), from the emulation thread only:
+    #   start         take over the input device
+    #   poll          handle everything that arrived, without blocking
+    #   wait          block until something arrives or wake() is called,
+    #                 then handle it
+    #   wake          make wait return, safe to call from any thread
+    #   frame_done    called after every frame, for inputs that time
+    #                 key releases themselves
+    #   pick_rom      let the player choose a library rom, returns its
+    #                 path or None when cancelled
+    #   stop          give the input device back
+    # inputs: chip8.PygameInput (keyboard of the pygame window),
+    # terminal.TerminalInput (keys typed into the terminal)
+
+    def start(self, emu):
+        pass
+
+    def poll(self, emu):
+        pass
+
+    def wait(self, emu):
+        raise NotImplementedError
+
+    def wake(self):
+        pass
+
+    def frame_done(self, emu):
+        pass
+
+    def pick_rom(self, emu):
+        return None
+
+    def stop(self, emu):
+        pass
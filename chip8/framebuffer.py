@@ -0,0 +1,138 @@
+import csv
+
+
+class Framebuffer:
+    # framebuffer of one or more bit planes, each stored as one int per row.
+    # bit (x_size - 1 - x) of a row is the pixel at x, so the leftmost
+    # pixel is the most significant bit. sprites are drawn with one shift,
+    # one AND and one XOR per row at any width, 64 or 128 pixels, and
+    # scrolling moves whole rows or shifts whole rows.
+    # the color of a pixel is its bit in plane 0, plus 2 times its bit in
+    # plane 1 and so on. rows is plane 0, the only one on CHIP-8 and
+    # SUPER-CHIP. selected is the bitmask of planes that drawing, clearing
+    # and scrolling apply to (XO-CHIP FN01).
+    # dirty is a bitmask of rows changed since the last refresh, bit y
+    # stands for row y. front-ends reset it once they drew those rows
+
+    def __init__(self, x_size=64, y_size=32, planes=1):
+
+        self.planes = None
+        self.selected = 1
+        self.dirty = 0
+        self.resize(x_size, y_size, planes)
+
+    @property
+    def rows(self):
+        return self.planes[0]
+
+    @rows.setter
+    def rows(self, rows):
+        self.planes[0] = rows
+
+    def resize(self, x_size, y_size, planes=None):
+        # switches resolution (SUPER-CHIP 00FE/00FF), clears the screen
+        self.x_size = x_size
+        self.y_size = y_size
+        if planes is not None:
+            self.planes = [None] * planes
+            self.selected = 1
+        self.clear()
+
+    def clear(self, mask=None):
+        # clears the planes in mask, all of them by default
+        for plane in range(len(self.planes)):
+            if mask is None or (mask >> plane) & 1:
+                self.planes[plane] = [0] * self.y_size
+        self.mark_all_dirty()
+
+    def mark_all_dirty(self):
+        self.dirty = (1 << self.y_size) - 1
+
+    def selected_planes(self):
+        return [plane for plane in range(len(self.planes)) if (self.selected >> plane) & 1]
+
+    def visible_rows(self):
+        # rows with a pixel set where any plane has one, for monochrome
+        # front-ends
+        combined = self.planes[0]
+        for rows in self.planes[1:]:
+            combined = [a | b for a, b in zip(combined, rows)]
+        return combined
+
+    def to_bytes(self):
+        # rows packed big endian, top row first, plane after plane
+        width = self.x_size // 8
+        return b"".join([row.to_bytes(width, "big") for rows in self.planes for row in rows])
+
+    def get_pixel(self, x, y):
+        # color of the pixel, the plane 0 bit on single plane screens
+        shift = self.x_size - 1 - x
+        color = 0
+        for plane, rows in enumerate(self.planes):
+            color |= ((rows[y] >> shift) & 1) << plane
+        return color
+
+    def draw(self, x, y, sprite, plane=0, width=8):
+        # XOR sprite rows of width pixels (8, or 16 for SUPER-CHIP 16x16
+        # sprites) onto a plane at (x, y).
+        # pixels past the right and bottom edge are clipped.
+        # returns 1 if any pixel was switched off, 0 otherwise
+        rows = self.planes[plane]
+        shift = self.x_size - width - x
+        collision = 0
+
+        if y < self.y_size:
+            height = min(len(sprite), self.y_size - y)
+            self.dirty |= ((1 << height) - 1) << y
+
+        for bits in sprite:
+            if y >= self.y_size:
+                break
+
+            if shift >= 0:
+                line = bits << shift
+            else:
+                line = bits >> -shift
+
+            collision |= rows[y] & line
+            rows[y] ^= line
+            y += 1
+
+        return 1 if collision else 0
+
+    def scroll_down(self, n):
+        # n is at most 15, less than the height in both resolutions
+        for plane in self.selected_planes():
+            rows = self.planes[plane]
+            rows[n:] = rows[:self.y_size - n]
+            rows[:n] = [0] * n
+        self.mark_all_dirty()
+
+    def scroll_up(self, n):
+        for plane in self.selected_planes():
+            rows = self.planes[plane]
+            rows[:self.y_size - n] = rows[n:]
+            rows[self.y_size - n:] = [0] * n
+        self.mark_all_dirty()
+
+    def scroll_right(self, n):
+        for plane in self.selected_planes():
+            self.planes[plane] = [row >> n for row in self.planes[plane]]
+        self.mark_all_dirty()
+
+    def scroll_left(self, n):
+        mask = (1 << self.x_size) - 1
+        for plane in self.selected_planes():
+            self.planes[plane] = [(row << n) & mask for row in self.planes[plane]]
+        self.mark_all_dirty()
+
+    def dump(self):
+
+        fname = "dump_screen.csv"
+
+        with open(fname, 'w') as f:
+            writer = csv.writer(f, delimiter=' ')
+            for y in range(self.y_size):
+                writer.writerow([self.get_pixel(x, y) for x in range(self.x_size)])
+
+        return fname
@@ -0,0 +1,294 @@
+from core import Core
+
+# longest run of instructions translated into one block
+MAX_BLOCK = 64
+
+# a step that starts in the middle of a block (the previous one ran out
+# of budget there) translates a block at that address once it started
+# this many steps
+HOT = 4
+
+# opcodes translated to inline python, keyed by handler name.
+# {x}, {y}, {nn}, {nnn} are filled in from the decoded operands
+INLINE = {
+    "op_6xnn": ["v[{x}] = {nn}"],
+    "op_7xnn": ["v[{x}] = (v[{x}] + {nn}) & 0xFF"],
+    "op_8xy0": ["v[{x}] = v[{y}]"],
+    "op_8xy1": ["v[{x}] = v[{x}] | v[{y}]"],
+    "op_8xy2": ["v[{x}] = v[{x}] & v[{y}]"],
+    "op_8xy3": ["v[{x}] = v[{x}] ^ v[{y}]"],
+    "op_8xy4": [
+        "t = v[{x}] + v[{y}]",
+        "v[15] = 1 if t > 0xFF else 0",
+        "v[{x}] = t & 0xFF",
+    ],
+    "op_8xy5": [
+        "vx = v[{x}]",
+        "vy = v[{y}]",
+        "v[15] = 0 if vy > vx else 1",
+        "v[{x}] = (vx - vy) & 0xFF",
+    ],
+    "op_8xy6": [
+        "vx = v[{x}]",
+        "v[15] = vx & 1",
+        "v[{x}] = vx >> 1",
+    ],
+    "op_8xy7": [
+        "vx = v[{x}]",
+        "vy = v[{y}]",
+        "v[15] = 0 if vx > vy else 1",
+        "v[{x}] = (vy - vx) & 0xFF",
+    ],
+    "op_8xye": [
+        "vx = v[{x}]",
+        "v[15] = (vx >> 7) & 1",
+        "v[{x}] = (vx << 1) & 0xFF",
+    ],
+    "op_annn": ["self.i = {nnn}"],
+    "op_fx07": ["v[{x}] = self.delay_timer & 0xFF"],
+    "op_fx15": ["self.delay_timer = v[{x}]"],
+    "op_fx18": ["self.sound_timer = v[{x}]"],
+    "op_fx1e": ["self.i = (self.i + v[{x}]) & 0xFFFF"],
+    "op_fx29": ["self.i = v[{x}] * 5"],
+}
+
+# inline templates implement the default behaviour, with these quirks
+# switched on the opcodes go through their handlers instead
+QUIRKED = {
+    "op_8xy6": "legacy_shift",
+    "op_8xye": "legacy_shift",
+}
+
+# skip instructions, translated to a guarded exit when the skip is taken.
+# when it is not taken the block simply falls through
+SKIPS = {
+    "op_3xnn": "v[{x}] == {nn}",
+    "op_4xnn": "v[{x}] != {nn}",
+    "op_5xy0": "v[{x}] == v[{y}]",
+    "op_9xy0": "v[{x}] != v[{y}]",
+    "op_ex9e": "self.keys[v[{x}]]",
+    "op_exa1": "not self.keys[v[{x}]]",
+}
+
+# XO-CHIP skips, they skip 2 or 4 bytes depending on the next
+# instruction, so a block ends with them
+XO_SKIPS = set(Core.xo_skips.values())
+
+# opcodes that write memory and therefore may invalidate blocks,
+# including the one that is currently running
+WRITES = {"op_fx33", "op_fx55", "op_5xy2"}
+
+# opcodes that leave the straight line, a block always ends with them
+BRANCHES = {"op_1nnn", "op_2nnn", "op_00ee", "op_bnnn", "op_fx0a", "op_nop", "op_00fd"} | XO_SKIPS
+
+
+class JitCore(Core):
+    # translates straight-line runs of chip8 instructions into python
+    # functions, cached by their start address.
+    # a block is called as block(self, budget) and returns the number of
+    # instructions it executed, never more than budget. it stops wherever
+    # the budget runs out, so step(n) runs blocks at any n.
+    # blocks are translated at addresses that are entered by a branch,
+    # skip or the end of another block, not at every address a step
+    # happens to start at.
+    # writes to memory covered by a block (FX33, FX55, rom loads) drop
+    # that block so self modifying roms keep working
+
+    def init_system(self):
+        self.flush_blocks()
+        super().init_system()
+
+    def load_rom(self, path=None):
+        super().load_rom(path)
+        self.flush_blocks()
+
+    def flush_blocks(self):
+        # start address -> (function, instructions on the full path, end address)
+        self.blocks = {}
+        # non zero for every memory address that belongs to a cached block
+        self.code_map = bytearray(len(self.memory))
+        # set when a write dropped blocks, running blocks bail out on it
+        self.stale = False
+        # address -> number of steps that started there without a block
+        self.resumes = {}
+
+    def invalidate(self, start, end):
+        # memory in [start, end) has been written
+        if not any(self.code_map[start:end]):
+            return
+
+        blocks = self.blocks
+        for pc, (func, length, last) in list(blocks.items()):
+            if pc < end and start < last:
+                del blocks[pc]
+
+        self.code_map = bytearray(len(self.code_map))
+        for pc, (func, length, last) in blocks.items():
+            self.code_map[pc:last] = b"\x01" * (last - pc)
+
+        self.stale = True
+
+    def step(self, n=1):
+        if self.profiler is not None:
+            # profiling counts single instructions, blocks would hide them
+            return self.profiler.step(self, n)
+        if self.tracer is not None:
+            return self.tracer.step(self, n)
+
+        memory = self.memory
+        table = self.dispatch
+        blocks = self.blocks
+        remaining = n
+        if self.skip_idle:
+            remaining = self.skip_idle_loop(n)
+
+        # the first address is wherever the last step stopped, often in
+        # the middle of a block. later ones are only entry points when
+        # something jumped there
+        entry = None
+        while remaining > 0:
+            pc = self.pc
+            block = blocks.get(pc)
+            if block is None:
+                if entry is None:
+                    resumes = self.resumes
+                    resumes[pc] = resumes.get(pc, 0) + 1
+                    entry = resumes[pc] >= HOT
+                if entry:
+                    block = self.translate(pc)
+
+            if block is not None:
+                remaining -= block[0](self, remaining)
+                entry = True
+            else:
+                # single step up to the next entry point, also covers pc
+                # running off the end of memory
+                handler, a, b = table[(memory[pc] << 8) | memory[pc + 1]]
+                handler(self, a, b)
+                remaining -= 1
+                entry = self.pc != pc + 2
+
+        self.counter += n
+
+    def translate(self, start):
+        generated = self.block_source(start)
+        if generated is None:
+            return None
+
+        source, handlers, count, end = generated
+        namespace = dict(handlers)
+        exec(compile(source, f"<block {hex(start)}>", "exec"), namespace)
+        return self.add_block(start, namespace["block"], count, end)
+
+    def add_block(self, start, func, count, end):
+        block = (func, count, end)
+        self.blocks[start] = block
+        self.code_map[start:end] = b"\x01" * (end - start)
+        return block
+
+    def block_source(self, start, func_name="block"):
+        # python source of a function func_name(self, budget) for the block at
+        # start. returns (source, {handler name: handler}, instructions on
+        # the full path, end address) or None past the end of memory.
+        # handlers that are not inlined are called by their name, the
+        # source only works with them in its globals
+        memory = self.memory
+        if start + 1 >= len(memory):
+            return None
+
+        table = self.dispatch
+        body = []
+        handlers = {}
+
+        addr = start
+        count = 0
+        loops = False
+
+        while count < MAX_BLOCK and addr + 1 < len(memory):
+            handler, a, b = table[(memory[addr] << 8) | memory[addr + 1]]
+            name = handler.__name__
+
+            if count:
+                # budget is what is left of it when the iteration started
+                body.append(f"if budget == {count}:")
+                body.append(f"    self.pc = {addr}")
+                body.append(f"    return n + {count}")
+            count += 1
+
+            if name in INLINE and QUIRKED.get(name) not in self.quirks:
+                for line in INLINE[name]:
+                    body.append(line.format(x=a, y=b, nn=b, nnn=a))
+                addr += 2
+                continue
+
+            if name in SKIPS:
+                body.append(f"if {SKIPS[name].format(x=a, y=b, nn=b)}:")
+                body.append(f"    self.pc = {addr + 4}")
+                body.append(f"    return n + {count}")
+                addr += 2
+                continue
+
+            if name == "op_f000" and addr + 3 < len(memory):
+                # XO-CHIP F000 NNNN, the address is part of the block
+                body.append(f"self.i = {(memory[addr + 2] << 8) | memory[addr + 3]}")
+                addr += 4
+                continue
+
+            if name == "op_1nnn" and a == start:
+                # jump back to the start of the block, loop in place for
+                # as long as a full iteration still fits into the budget
+                loops = True
+                addr += 2
+                break
+
+            if name == "op_1nnn":
+                body.append(f"self.pc = {a}")
+                body.append(f"return n + {count}")
+                addr += 2
+                break
+
+            handlers[name] = handler
+            body.append(f"self.pc = {addr}")
+            body.append(f"{name}(self, {a!r}, {b!r})")
+            addr += 2
+
+            if name in BRANCHES:
+                body.append(f"return n + {count}")
+                break
+
+            if name in WRITES:
+                body.append("if self.stale:")
+                body.append("    self.stale = False")
+                body.append(f"    return n + {count}")
+        else:
+            body.append(f"self.pc = {addr}")
+            body.append(f"return n + {count}")
+
+        if loops:
+            body.append(f"n += {count}")
+            body.append(f"budget -= {count}")
+            body.append("if budget <= 0:")
+            body.append(f"    self.pc = {start}")
+            body.append("    return n")
+
+        source = f"def {func_name}(self, budget):\n"
+        source += "    v = self.v\n"
+        source += "    n = 0\n"
+        source += "    while True:\n"
+        source += "".join(f"        {line}\n" for line in body)
+
+        return source, handlers, count, addr
+
+    def op_fx33(self, x, b):
+        super().op_fx33(x, b)
+        self.invalidate(self.i, self.i + 3)
+
+    def op_fx55(self, x, b):
+        # I may have moved on, see the legacy_load_store quirk
+        i = self.i
+        super().op_fx55(x, b)
+        self.invalidate(i, i + x + 1)
+
+    def op_5xy2(self, x, y):
+        super().op_5xy2(x, y)
+        self.invalidate(self.i, self.i + abs(x - y) + 1)
@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from core import Core, EXTENSIONS, MEMORY_SIZE, PLATFORMS, PROGRAM_START, QUIRKS, XO_MEMORY_SIZE, guess_platform
+from regress import rom_hash
+
+# frames a rom runs headless before its screen is used as the thumbnail
+THUMBNAIL_FRAMES = 120
+
+# seed for CXNN, fixed so that thumbnails are reproducible
+SEED = 0
+
+
+def thumbnail(path, frames, cycles_per_frame, quirks, platform="chip8"):
+    # runs one rom headless and returns its packed screen as hex, all
+    # planes combined. 256 bytes for 64x32 screens, 1024 for 128x64.
+    # executed in a worker process
+    emu = Core(SEED)
+    emu.skip_idle = True
+    emu.set_platform(platform)
+    if cycles_per_frame:
+        emu.cycles_per_frame = cycles_per_frame
+    emu.set_quirks(quirks)
+    emu.load_rom(path)
+    try:
+        emu.run_frames(frames)
+    except Exception:
+        # broken or unsupported roms still get whatever they drew so far
+        pass
+    fb = emu.framebuffer
+    return b"".join([row.to_bytes(fb.x_size // 8, "big") for row in fb.visible_rows()]).hex()
+
+
+def entry_platform(entry):
+    # entries written before there were platforms have none
+    return entry.get("platform") or guess_platform(entry["path"])
+
+
+class Library:
+    # persistent index of known roms, keyed by the sha1 of their contents
+    # so settings follow a rom when it is renamed or moved. per entry:
+    #   title             file name without extension
+    #   path              where the rom was last seen
+    #   size              in bytes
+    #   cycles_per_frame  preferred speed, null for the default
+    #   quirks            list of Core.QUIRKS names
+    #   platform          one of core.PLATFORMS, guessed from the extension
+    #   thumbnail         packed screen after THUMBNAIL_FRAMES frames (hex),
+    #                     null until the worker pool got to it
+
+    def __init__(self, index_path="library.json"):
+
+        self.index_path = index_path
+        self.entries = {}
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.entries = json.load(f)
+
+        # thumbnails are filled in from pool callbacks
+        self.lock = threading.Lock()
+        self.pool = None
+        # thumbnails submitted to the pool, cancelled on close
+        self.futures = []
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.entries, indent=1, sort_keys=True)
+        with open(self.index_path, "w") as f:
+            f.write(data)
+
+    def scan(self, directory):
+        # adds every rom below directory to the index, returns the hashes of
+        # the new ones. known roms only get their path updated
+        added = []
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() not in EXTENSIONS:
+                    continue
+                path = os.path.join(root, name)
+                platform = guess_platform(path)
+                size = os.path.getsize(path)
+                memory_size = XO_MEMORY_SIZE if platform == "xochip" else MEMORY_SIZE
+                if size > memory_size - PROGRAM_START:
+                    continue
+
+                sha1 = rom_hash(path)
+                with self.lock:
+                    if sha1 in self.entries:
+                        self.entries[sha1]["path"] = path
+                        continue
+                    self.entries[sha1] = {
+                        "title": os.path.splitext(name)[0],
+                        "path": path,
+                        "size": size,
+                        "cycles_per_frame": None,
+                        "quirks": [],
+                        "platform": platform,
+                        "thumbnail": None,
+                    }
+                added.append(sha1)
+        return added
+
+    def generate_thumbnails(self, jobs=None):
+        # renders missing thumbnails in a background process pool, entries
+        # are updated as the results come in
+        with self.lock:
+            missing = [
+                (sha1, entry) for sha1, entry in self.entries.items()
+                if entry["thumbnail"] is None and os.path.exists(entry["path"])
+            ]
+        if not missing:
+            return
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=jobs)
+
+        for sha1, entry in missing:
+            future = self.pool.submit(thumbnail, entry["path"], THUMBNAIL_FRAMES, entry["cycles_per_frame"], entry["quirks"], entry_platform(entry))
+            future.add_done_callback(lambda future, sha1=sha1: self.thumbnail_done(sha1, future))
+            self.futures.append(future)
+
+    def thumbnail_done(self, sha1, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self.lock:
+            self.entries[sha1]["thumbnail"] = future.result()
+
+    def wait(self):
+        # blocks until every thumbnail that was asked for is done
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+            self.futures = []
+
+    def close(self):
+        # unfinished thumbnails are generated again next time. pending ones
+        # are cancelled by hand, shutdown(cancel_futures=True) needs
+        # python 3.9
+        if self.pool is not None:
+            for future in self.futures:
+                future.cancel()
+            self.pool.shutdown(wait=False)
+            self.pool = None
+            self.futures = []
+        self.save()
+
+    def titles(self):
+        # [(sha1, entry)] sorted by title, for pickers
+        with self.lock:
+            return sorted(self.entries.items(), key=lambda item: item[1]["title"].lower())
+
+    def lookup(self, path):
+        if not os.path.exists(path):
+            return None
+        return self.entries.get(rom_hash(path))
+
+    def apply(self, core, path, cycles_per_frame):
+        # per rom speed and quirks, cycles_per_frame is used for roms
+        # without a preferred speed. the platform of the entry is left to
+        # the caller, switching it resets the machine
+        entry = self.lookup(path)
+        if entry is None:
+            core.cycles_per_frame = cycles_per_frame
+            core.set_quirks(())
+            return None
+        core.cycles_per_frame = entry["cycles_per_frame"] or cycles_per_frame
+        core.set_quirks(entry["quirks"])
+        return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the rom library used by the F1 picker")
+    parser.add_argument("--index", default="library.json")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="add the roms below directories and render their thumbnails")
+    scan.add_argument("directories", nargs="+")
+    scan.add_argument("--jobs", type=int, default=os.cpu_count())
+
+    commands.add_parser("list", help="show the indexed roms and their settings")
+
+    settings = commands.add_parser("set", help="change the settings of one rom")
+    settings.add_argument("rom", help="path of the rom")
+    settings.add_argument("--title", default=None)
+    settings.add_argument("--cycles", type=int, default=None, help="cycles per frame, 0 for the default speed")
+    settings.add_argument("--quirks", default=None, help=f"comma separated, any of: {', '.join(QUIRKS)}")
+    settings.add_argument("--platform", choices=PLATFORMS, default=None)
+    args = parser.parse_args()
+
+    library = Library(args.index)
+
+    if args.command == "scan":
+        for directory in args.directories:
+            print(f"{len(library.scan(directory))} new roms in {directory}")
+        library.generate_thumbnails(args.jobs)
+        library.wait()
+        library.save()
+
+    elif args.command == "list":
+        for sha1, entry in library.titles():
+            speed = entry["cycles_per_frame"] or "default"
+            print(f"{sha1[:10]}  {entry['title']:<40} {entry['size']:5} bytes  {entry_platform(entry):<6}  cycles {speed:<8} {','.join(entry['quirks'])}")
+
+    elif args.command == "set":
+        entry = library.lookup(args.rom)
+        if entry is None:
+            print(f"{args.rom} is not in the library, scan its directory first")
+            return 1
+        if args.title is not None:
+            entry["title"] = args.title
+        if args.cycles is not None:
+            entry["cycles_per_frame"] = args.cycles or None
+        if args.quirks is not None:
+            quirks = [quirk for quirk in args.quirks.split(",") if quirk]
+            unknown = set(quirks) - set(QUIRKS)
+            if unknown:
+                print(f"unknown quirks: {', '.join(sorted(unknown))}")
+                return 1
+            entry["quirks"] = quirks
+        if args.platform is not None:
+            entry["platform"] = args.platform
+        # the thumbnail depends on speed, quirks and platform
+        entry["thumbnail"] = None
+        library.generate_thumbnails(1)
+        library.wait()
+        library.save()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
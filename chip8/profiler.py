@@ -0,0 +1,156 @@
+import argparse
+import json
+import math
+import sys
+import time
+
+# shades for the memory heatmap, from never executed to hottest
+SHADES = " .:-=+*#%@"
+
+
+class Profiler:
+    # counts executed opcodes per encoding and per address.
+    # attach with core.profiler = Profiler(); while attached Core.step runs
+    # the counting loop below instead of the plain one. when no profiler is
+    # attached the only cost is one attribute check per step() call
+    # (i.e. per frame), not per instruction
+
+    def __init__(self, memory_size=0x10000):
+
+        # executions per opcode encoding, classes and call targets are
+        # derived from this when exporting
+        self.opcodes = [0] * 0x10000
+        # executions per address, the default covers XO-CHIP memory as well
+        self.pcs = [0] * memory_size
+        # (instructions, seconds) per frame
+        self.frames = []
+
+        self.frame_counter = 0
+        self.frame_start = time.perf_counter()
+
+    def step(self, core, n):
+        memory = core.memory
+        table = core.dispatch
+        opcodes = self.opcodes
+        pcs = self.pcs
+
+        for _ in range(n):
+            pc = core.pc
+            opcode = (memory[pc] << 8) | memory[pc + 1]
+            pcs[pc] += 1
+            opcodes[opcode] += 1
+            handler, a, b = table[opcode]
+            handler(core, a, b)
+
+        core.counter += n
+
+    def frame_done(self, core):
+        now = time.perf_counter()
+        self.frames.append((core.counter - self.frame_counter, now - self.frame_start))
+        self.frame_counter = core.counter
+        self.frame_start = now
+
+    def report(self, core):
+        classes = {}
+        calls = {}
+        for opcode, count in enumerate(self.opcodes):
+            if not count:
+                continue
+            name = core.decode_name(opcode, core.platform)[0]
+            classes[name] = classes.get(name, 0) + count
+            if opcode & 0xF000 == 0x2000:
+                target = f"0x{opcode & 0x0FFF:03x}"
+                calls[target] = calls.get(target, 0) + count
+
+        frame_instructions = [instructions for instructions, seconds in self.frames]
+        frame_seconds = [seconds for instructions, seconds in self.frames]
+
+        return {
+            "instructions": sum(self.pcs),
+            "memory_size": len(core.memory),
+            "opcode_classes": classes,
+            "calls": calls,
+            "pcs": {f"0x{pc:03x}": count for pc, count in enumerate(self.pcs) if count},
+            "frames": {
+                "count": len(self.frames),
+                "instructions": frame_instructions,
+                "seconds": frame_seconds,
+            },
+        }
+
+    def save(self, core, fname="profile.json"):
+        with open(fname, "w") as f:
+            json.dump(self.report(core), f, indent=1)
+        return fname
+
+
+def word_counts(pcs, memory_size=4096):
+    # executions per 2 byte word, instructions are usually word aligned
+    counts = [0] * (memory_size // 2)
+    for pc, count in pcs.items():
+        counts[int(pc, 16) // 2] += count
+    return counts
+
+
+def heatmap(counts, width=64):
+    # one character per word, log scaled
+    top = math.log1p(max(counts)) or 1
+    lines = []
+    for start in range(0, len(counts), width):
+        row = counts[start:start + width]
+        if not any(row):
+            continue
+        cells = "".join(SHADES[round(math.log1p(count) / top * (len(SHADES) - 1))] for count in row)
+        lines.append(f"0x{start * 2:03x} |{cells}|")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show a profile written by Profiler.save")
+    parser.add_argument("profile")
+    parser.add_argument("--top", type=int, default=15, help="number of hot addresses, classes and calls to list")
+    parser.add_argument("--pgm", default=None, help="also write the heatmap as a greyscale pgm image 64 pixels wide, one pixel per word")
+    args = parser.parse_args()
+
+    with open(args.profile) as f:
+        profile = json.load(f)
+
+    total = profile["instructions"] or 1
+    print(f"{profile['instructions']} instructions, {profile['frames']['count']} frames\n")
+
+    print("opcode classes")
+    for name, count in sorted(profile["opcode_classes"].items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<10} {count:12} {count / total:7.1%}")
+
+    print("\nhot addresses")
+    for pc, count in sorted(profile["pcs"].items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {pc:<10} {count:12} {count / total:7.1%}")
+
+    if profile["calls"]:
+        print("\ncall targets (2NNN)")
+        for target, count in sorted(profile["calls"].items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {target:<10} {count:12}")
+
+    frames = profile["frames"]
+    if frames["count"]:
+        seconds = frames["seconds"]
+        instructions = frames["instructions"]
+        print(f"\nper frame: {sum(instructions) / len(instructions):.1f} instructions, "
+              f"{sum(seconds) / len(seconds) * 1000:.3f} ms mean, {max(seconds) * 1000:.3f} ms max")
+
+    # profiles from before there were platforms are 4 KB machines
+    counts = word_counts(profile["pcs"], profile.get("memory_size", 4096))
+    print("\nmemory heatmap, one column per 2 byte word")
+    for line in heatmap(counts):
+        print(line)
+
+    if args.pgm:
+        top = math.log1p(max(counts)) or 1
+        pixels = bytes(round(math.log1p(count) / top * 255) for count in counts)
+        with open(args.pgm, "wb") as f:
+            f.write(f"P5\n64 {len(counts) // 64}\n255\n".encode() + pixels)
+        print(f"\nwrote {args.pgm}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
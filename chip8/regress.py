@@ -0,0 +1,125 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from core import Core, DEFAULT_IPS, EXTENSIONS, guess_platform
+
+# seed for CXNN, fixed so that screen hashes are reproducible
+SEED = 0
+
+
+def run_rom(path, frames, checkpoints, ips, jit):
+    # runs one rom headless and hashes the framebuffer at the checkpoints.
+    # executed in a worker process
+    if jit:
+        from jit import JitCore
+        emu = JitCore(SEED)
+    else:
+        emu = Core(SEED)
+    emu.set_speed(ips)
+    # same results as running idle loops, only faster
+    emu.skip_idle = True
+
+    result = {"hashes": {}, "error": None}
+    start = time.perf_counter()
+    try:
+        emu.set_platform(guess_platform(path))
+        emu.load_rom(path)
+        for frame in range(1, frames + 1):
+            emu.run_frame()
+            if frame in checkpoints:
+                result["hashes"][str(frame)] = hashlib.sha1(emu.framebuffer.to_bytes()).hexdigest()
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    result["seconds"] = time.perf_counter() - start
+    result["instructions"] = emu.counter
+    return result
+
+
+def rom_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a directory of roms headless and compare screens against golden hashes")
+    parser.add_argument("rom_dir")
+    parser.add_argument("--frames", type=int, default=300, help="frames to run every rom for")
+    parser.add_argument("--checkpoints", default=None, help="comma separated frames to hash the screen at, default: the last frame")
+    parser.add_argument("--golden", default=None, help="golden hash file, default: golden.json in rom_dir")
+    parser.add_argument("--update", action="store_true", help="write the current hashes as the new golden values")
+    parser.add_argument("--ips", type=int, default=DEFAULT_IPS)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--jit", action="store_true")
+    args = parser.parse_args()
+
+    if args.checkpoints:
+        checkpoints = sorted(int(frame) for frame in args.checkpoints.split(","))
+    else:
+        checkpoints = [args.frames]
+    frames = max([args.frames] + checkpoints)
+
+    golden_path = args.golden or os.path.join(args.rom_dir, "golden.json")
+    golden = {}
+    if os.path.exists(golden_path):
+        with open(golden_path) as f:
+            golden = json.load(f)
+
+    roms = sorted(name for name in os.listdir(args.rom_dir) if os.path.splitext(name)[1].lower() in EXTENSIONS)
+    if not roms:
+        print(f"no {', '.join(EXTENSIONS)} files in {args.rom_dir}")
+        return 1
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            name: pool.submit(run_rom, os.path.join(args.rom_dir, name), frames, set(checkpoints), args.ips, args.jit)
+            for name in roms
+        }
+        results = {name: future.result() for name, future in futures.items()}
+    elapsed = time.perf_counter() - start
+
+    failed = 0
+    changed = False
+    for name in roms:
+        result = results[name]
+        expected = golden.get(name)
+        sha1 = rom_hash(os.path.join(args.rom_dir, name))
+
+        if result["error"]:
+            status = "ERROR"
+        elif expected is None or args.update:
+            status = "NEW"
+        elif expected["sha1"] != sha1:
+            status = "CHANGED"
+        else:
+            mismatched = [frame for frame, digest in result["hashes"].items() if expected["frames"].get(frame) != digest]
+            status = f"FAIL @{','.join(mismatched)}" if mismatched else "PASS"
+
+        if status not in ("PASS", "NEW"):
+            failed += 1
+
+        ips = result["instructions"] / result["seconds"] if result["seconds"] else 0
+        print(f"{status:<12} {result['seconds']:7.3f}s {ips:12.0f} ips  {name}")
+        if result["error"]:
+            print(f"             {result['error']}")
+
+        if status == "NEW":
+            golden[name] = {"sha1": sha1, "frames": result["hashes"]}
+            changed = True
+
+    print(f"{len(roms)} roms, {failed} failed, {elapsed:.2f}s")
+
+    if changed:
+        with open(golden_path, "w") as f:
+            json.dump(golden, f, indent=2, sort_keys=True)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import argparse
+import hashlib
+import struct
+import sys
+import time
+import zlib
+from core import Core, QUIRKS
+
+# input log, all little endian:
+#   header  magic, format version
+#   then events, each starting with the frame it applies to (u32, counted
+#   from the start of the recording) and its kind (u8):
+#     KEYS   key state bitmask (u16), from this frame on
+#     STATE  cycles per frame (u16), quirks bitmask (u8), length (u32) and
+#            a zlib compressed save state. written at the start and after
+#            every jump the inputs cannot explain: reboots, rom changes,
+#            loaded states and rewinding
+#     END    the recording stopped before this frame
+MAGIC = b"C8IN"
+VERSION = 1
+
+HEADER = struct.Struct("<4sB")
+EVENT = struct.Struct("<IB")
+KEYS_EVENT = struct.Struct("<H")
+STATE_EVENT = struct.Struct("<HBI")
+
+KEYS = 0
+STATE = 1
+END = 2
+
+
+def key_mask(keys):
+    mask = 0
+    for idx, pressed in enumerate(keys):
+        if pressed:
+            mask |= 1 << idx
+    return mask
+
+
+def quirk_mask(quirks):
+    return sum(1 << idx for idx, quirk in enumerate(QUIRKS) if quirk in quirks)
+
+
+class InputRecorder:
+    # records everything a run depends on besides the machine itself:
+    # key changes between frames and save states at discontinuities.
+    # the front-end calls before_frame(core) in front of every run_frame
+    # and state_changed() whenever the machine state jumped
+
+    def __init__(self, path):
+
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION))
+
+        self.frame = 0
+        self.keys = None
+        # the first frame always starts with a full state
+        self.pending_state = True
+
+    def state_changed(self):
+        # the state is taken lazily in front of the next frame, so e.g.
+        # rewinding for a while only ends up as one state in the log
+        self.pending_state = True
+
+    def before_frame(self, core):
+        if self.pending_state:
+            state = zlib.compress(core.save_state())
+            self.file.write(EVENT.pack(self.frame, STATE))
+            self.file.write(STATE_EVENT.pack(core.cycles_per_frame, quirk_mask(core.quirks), len(state)))
+            self.file.write(state)
+            self.keys = key_mask(core.keys)
+            self.pending_state = False
+
+        keys = key_mask(core.keys)
+        if keys != self.keys:
+            self.file.write(EVENT.pack(self.frame, KEYS))
+            self.file.write(KEYS_EVENT.pack(keys))
+            self.keys = keys
+
+        self.frame += 1
+
+    def close(self):
+        self.file.write(EVENT.pack(self.frame, END))
+        self.file.close()
+        return self.path
+
+
+def read_events(path):
+    # yields (frame, kind, payload). payload is the key bitmask for KEYS,
+    # (cycles per frame, quirks, save state) for STATE and None for END
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a chip8 input log")
+    if version != VERSION:
+        raise ValueError(f"unsupported input log version {version}, expected {VERSION}")
+
+    offset = HEADER.size
+    while offset < len(data):
+        frame, kind = EVENT.unpack_from(data, offset)
+        offset += EVENT.size
+
+        if kind == KEYS:
+            payload, = KEYS_EVENT.unpack_from(data, offset)
+            offset += KEYS_EVENT.size
+        elif kind == STATE:
+            cycles_per_frame, quirks, length = STATE_EVENT.unpack_from(data, offset)
+            offset += STATE_EVENT.size
+            state = zlib.decompress(data[offset:offset + length])
+            offset += length
+            payload = (cycles_per_frame, [quirk for idx, quirk in enumerate(QUIRKS) if quirks & (1 << idx)], state)
+        elif kind == END:
+            payload = None
+        else:
+            raise ValueError(f"unknown event {kind} at byte {offset - EVENT.size}")
+
+        yield frame, kind, payload
+
+
+def replay(emu, path):
+    # runs a recording on emu headless and as fast as possible, returns
+    # the number of frames run
+    frame = 0
+    for event_frame, kind, payload in read_events(path):
+        while frame < event_frame:
+            emu.run_frame()
+            frame += 1
+
+        if kind == KEYS:
+            emu.keys[:] = [bool((payload >> idx) & 1) for idx in range(16)]
+        elif kind == STATE:
+            cycles_per_frame, quirks, state = payload
+            emu.cycles_per_frame = cycles_per_frame
+            emu.set_quirks(quirks)
+            emu.load_state(state)
+        else:
+            break
+
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an input log headless at full speed")
+    parser.add_argument("log")
+    parser.add_argument("--jit", action="store_true")
+    parser.add_argument("--expect", default=None, help="sha1 the final screen must have, exits with 1 otherwise")
+    args = parser.parse_args()
+
+    if args.jit:
+        from jit import JitCore
+        emu = JitCore()
+    else:
+        emu = Core()
+    emu.skip_idle = True
+
+    start = time.perf_counter()
+    frames = replay(emu, args.log)
+    elapsed = time.perf_counter() - start
+
+    digest = hashlib.sha1(emu.framebuffer.to_bytes()).hexdigest()
+    print(f"{frames} frames in {elapsed:.3f}s ({frames / elapsed:.0f} frames/s), screen {digest}")
+
+    if args.expect and args.expect != digest:
+        print(f"expected screen {args.expect}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import zlib
+from collections import deque
+
+# states are compared in blocks of the first size, blocks that differ are
+# compared again in blocks of the next size and so on. the chunks that are
+# stored are FINE bytes long
+SIZES = (4096, 512, 64)
+FINE = SIZES[-1]
+
+# changed chunks are compressed once there are more bytes of them than this
+COMPRESS_ABOVE = 1024
+
+
+def diff(old, new, start=0, end=None, level=0):
+    # [(offset, chunk of old)] for every FINE chunk where new differs from
+    # old, both states come from the same machine and have the same length
+    if end is None:
+        end = len(new)
+    size = SIZES[level]
+    chunks = []
+    for offset in range(start, end, size):
+        stop = min(offset + size, end)
+        chunk = old[offset:stop]
+        if chunk == new[offset:stop]:
+            continue
+        if size == FINE:
+            chunks.append((offset, chunk))
+        else:
+            chunks += diff(old, new, offset, stop, level + 1)
+    return chunks
+
+
+class Rewind:
+    # bounded history of per-frame save states for stepping back in time.
+    # only the newest state is kept whole. every older frame is stored as
+    # the chunks of it that differ from the frame after it, consecutive
+    # frames usually differ in a few bytes only. a frame is restored by
+    # patching those chunks back into the newer state, newest first.
+    #
+    # frames never depend on older ones, so when the limits are exceeded
+    # the oldest frame is simply dropped. a frame whose state changed size
+    # (the screen resolution or the platform changed) is stored whole
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, max_frames=60 * 30, level=1):
+
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self.level = level
+
+        self.clear()
+
+    def clear(self):
+        # the newest state, None while the history is empty
+        self.last = None
+        # one (size, compressed, data) per older frame, oldest first. data
+        # is the whole state when size is None, else the changed chunks
+        # as [(offset, chunk)] or zlib compressed as bytes
+        self.deltas = deque()
+        self.size = 0
+
+    def __len__(self):
+        if self.last is None:
+            return 0
+        return len(self.deltas) + 1
+
+    def push(self, core):
+        state = core.save_state()
+
+        if self.last is not None:
+            if len(state) != len(self.last):
+                delta = (None, False, self.last)
+                self.size += len(self.last)
+            else:
+                delta = self.pack(diff(self.last, state))
+            self.deltas.append(delta)
+        self.last = state
+
+        while self.deltas and (self.size > self.max_bytes or len(self) > self.max_frames):
+            self.drop_oldest()
+
+    def pack(self, chunks):
+        # chunks cost their bytes plus their offset
+        size = sum(len(chunk) for offset, chunk in chunks) + 4 * len(chunks)
+        if size <= COMPRESS_ABOVE:
+            self.size += size
+            return (size, False, chunks)
+        # the number of chunks, their offsets, then the chunks. only the
+        # last chunk of a state can be shorter than FINE
+        offsets = b"".join(offset.to_bytes(4, "little") for offset, chunk in [(len(chunks), None)] + chunks)
+        packed = zlib.compress(offsets + b"".join(chunk for offset, chunk in chunks), self.level)
+        self.size += len(packed)
+        return (size, True, packed)
+
+    def unpack(self, delta):
+        size, compressed, data = delta
+        if not compressed:
+            return data
+        data = zlib.decompress(data)
+        count = int.from_bytes(data[:4], "little")
+        offsets = [int.from_bytes(data[k:k + 4], "little") for k in range(4, 4 * count + 4, 4)]
+        chunks = data[4 * count + 4:]
+        return [(offset, chunks[k * FINE:(k + 1) * FINE]) for k, offset in enumerate(offsets)]
+
+    def cost(self, delta):
+        size, compressed, data = delta
+        if size is None or compressed:
+            return len(data)
+        return size
+
+    def drop_oldest(self):
+        self.size -= self.cost(self.deltas.popleft())
+
+    def step_back(self, core):
+        # goes back one frame: the newest state is the frame the machine is
+        # in right now, so it is dropped and the one before it restored.
+        # the restored frame becomes the newest state, frames pushed after
+        # it continue the history from there. returns False once there is
+        # nothing left to go back to
+        if not self.deltas:
+            return False
+
+        delta = self.deltas.pop()
+        self.size -= self.cost(delta)
+        if delta[0] is None:
+            self.last = delta[2]
+        else:
+            previous = bytearray(self.last)
+            for offset, chunk in self.unpack(delta):
+                previous[offset:offset + len(chunk)] = chunk
+            self.last = bytes(previous)
+
+        core.load_state(self.last)
+        return True
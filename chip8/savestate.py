@@ -0,0 +1,180 @@
+import struct
+from array import array
+from random import Random
+
+# binary save state layout, all little endian:
+#   header     magic, format version
+#   registers  pc, i, sp, delay timer, sound timer, paused, keys (bitmask),
+#              instruction counter
+#   stack      16 x u16
+#   v          16 x u8
+#   rng        state of the CXNN random number generator
+#   platform   index into PLATFORMS (u8)
+#   memory     memory size (u32) followed by the raw bytes
+#   screen     width, height (u16 each), number of planes and the selected
+#              ones (u8 each), followed by the packed rows plane by plane
+#   extension  SUPER-CHIP flags, XO-CHIP audio pattern and pitch
+# version 1 states have no platform, planes or extension, they are CHIP-8
+# states with one plane
+MAGIC = b"C8ST"
+VERSION = 2
+
+# core.PLATFORMS by their number in save states, only ever append to it
+PLATFORMS = ("chip8", "schip", "xochip")
+
+HEADER = struct.Struct("<4sB")
+REGISTERS = struct.Struct("<HHBBB?HQ")
+STACK = struct.Struct("<16H")
+V = struct.Struct("<16B")
+# random.Random state: version, 624 words of mersenne twister state plus
+# the position, and the cached gaussian (flag + value)
+RNG = struct.Struct("<B625I?d")
+PLATFORM = struct.Struct("<B")
+SIZE = struct.Struct("<I")
+SCREEN = struct.Struct("<HH")
+PLANES = struct.Struct("<BB")
+EXTENSION = struct.Struct("<16B16sB")
+
+# memory is compared in blocks of this many bytes on loading, see
+# changed_ranges
+COMPARE_SIZE = 256
+
+
+class StateError(ValueError):
+    pass
+
+
+def changed_ranges(old, new):
+    # [(start, end)] of the bytes where new differs from old, one range per
+    # block of COMPARE_SIZE bytes. both are the same length
+    ranges = []
+    for start in range(0, len(new), COMPARE_SIZE):
+        end = min(start + COMPARE_SIZE, len(new))
+        if old[start:end] == new[start:end]:
+            continue
+        while old[start] == new[start]:
+            start += 1
+        while old[end - 1] == new[end - 1]:
+            end -= 1
+        ranges.append((start, end))
+    return ranges
+
+
+def save(core):
+    keys = 0
+    for idx, pressed in enumerate(core.keys):
+        if pressed:
+            keys |= 1 << idx
+
+    rng_version, rng_words, gauss = core.rng.getstate()
+    fb = core.framebuffer
+
+    return b"".join((
+        HEADER.pack(MAGIC, VERSION),
+        REGISTERS.pack(core.pc, core.i, core.sp, core.delay_timer, core.sound_timer, core.paused, keys, core.counter),
+        STACK.pack(*core.stack),
+        V.pack(*core.v),
+        RNG.pack(rng_version, *rng_words, gauss is not None, gauss or 0.0),
+        PLATFORM.pack(PLATFORMS.index(core.platform)),
+        SIZE.pack(len(core.memory)),
+        bytes(core.memory),
+        SCREEN.pack(fb.x_size, fb.y_size),
+        PLANES.pack(len(fb.planes), fb.selected),
+        fb.to_bytes(),
+        EXTENSION.pack(*core.flags, core.pattern, core.pitch),
+    ))
+
+
+def load(core, data):
+    view = memoryview(data)
+    offset = 0
+
+    def read(layout):
+        nonlocal offset
+        if offset + layout.size > len(view):
+            raise StateError("save state is truncated")
+        values = layout.unpack_from(view, offset)
+        offset += layout.size
+        return values
+
+    magic, version = read(HEADER)
+    if magic != MAGIC:
+        raise StateError("not a chip8 save state")
+    if version not in (1, VERSION):
+        raise StateError(f"unsupported save state version {version}, expected {VERSION}")
+
+    pc, i, sp, delay_timer, sound_timer, paused, keys, counter = read(REGISTERS)
+    stack = read(STACK)
+    v = read(V)
+    rng = read(RNG)
+    platform = 0
+    if version > 1:
+        platform, = read(PLATFORM)
+    if platform >= len(PLATFORMS):
+        raise StateError(f"save state has unknown platform {platform}")
+    platform = PLATFORMS[platform]
+
+    memory_size, = read(SIZE)
+    memory = view[offset:offset + memory_size]
+    offset += memory_size
+    x_size, y_size = read(SCREEN)
+    planes, selected = 1, 1
+    if version > 1:
+        planes, selected = read(PLANES)
+    row_bytes = x_size // 8
+    plane_bytes = row_bytes * y_size
+    rows = view[offset:offset + plane_bytes * planes]
+    offset += len(rows)
+    extension = None
+    if version > 1:
+        extension = read(EXTENSION)
+
+    if len(memory) != memory_size or len(rows) != plane_bytes * planes:
+        raise StateError("save state is truncated")
+    if (x_size, y_size) not in ((64, 32), (128, 64)) or planes not in (1, 2):
+        raise StateError(f"save state screen is {x_size}x{y_size} with {planes} planes")
+
+    if memory_size != core.memory_size(platform):
+        raise StateError(f"save state has {memory_size} bytes of memory, {platform} has {core.memory_size(platform)}")
+    rng = (rng[0], tuple(rng[1:626]), rng[627] if rng[626] else None)
+    try:
+        Random().setstate(rng)
+    except (ValueError, TypeError):
+        raise StateError("save state has a bad random number generator state") from None
+
+    # the state is valid, nothing was changed before this point
+    if platform != core.platform:
+        core.set_platform(platform)
+    # memory changed behind the back of the opcode handlers, only what
+    # actually differs, so engines keep the code they compiled
+    changed = changed_ranges(core.memory, memory)
+
+    core.pc = pc
+    core.i = i
+    core.sp = sp
+    core.delay_timer = delay_timer
+    core.sound_timer = sound_timer
+    core.paused = paused
+    core.counter = counter
+    core.keys[:] = [bool((keys >> idx) & 1) for idx in range(16)]
+    core.stack[:] = array("H", stack)
+    core.v[:] = v
+    core.memory[:] = memory
+    core.rng.setstate(rng)
+
+    if extension is not None:
+        core.flags[:] = extension[:16]
+        core.pattern = extension[16]
+        core.pitch = extension[17]
+
+    fb = core.framebuffer
+    fb.resize(x_size, y_size, planes)
+    fb.selected = selected
+    for plane in range(planes):
+        start = plane * plane_bytes
+        fb.planes[plane] = [int.from_bytes(rows[start + y * row_bytes:start + (y + 1) * row_bytes], "big") for y in range(y_size)]
+    fb.mark_all_dirty()
+    core.draw_flag = True
+
+    for start, end in changed:
+        core.invalidate(start, end)
@@ -0,0 +1,47 @@
+import time
+
+
+class FrameScheduler:
+    # paces emulation at a fixed frame rate against the monotonic clock.
+    # the caller emulates whole frames (a batch of instructions plus one
+    # timer tick), so timers tick exactly once per emulated frame no matter
+    # how fast the host is. wait() sleeps once per frame and returns how
+    # many frames are due: more than one when the host fell behind, capped
+    # at max_catchup, in which case the surplus frames are dropped and the
+    # schedule restarts from now
+
+    def __init__(self, fps=60, max_catchup=4, clock=time.monotonic, sleep=time.sleep):
+
+        self.frame_time = 1 / fps
+        self.max_catchup = max_catchup
+        self.clock = clock
+        self.sleep = sleep
+
+        # when the next frame is due
+        self.deadline = None
+        # frames skipped because the host could not keep up
+        self.dropped = 0
+
+    def reset(self):
+        # start a fresh schedule, e.g. after pausing
+        self.deadline = None
+
+    def wait(self):
+        now = self.clock()
+        if self.deadline is None:
+            self.deadline = now
+
+        if now < self.deadline:
+            self.sleep(self.deadline - now)
+            now = self.clock()
+
+        due = max(1, int((now - self.deadline) // self.frame_time) + 1)
+
+        if due > self.max_catchup:
+            self.dropped += due - self.max_catchup
+            due = self.max_catchup
+            self.deadline = now + self.frame_time
+        else:
+            self.deadline += due * self.frame_time
+
+        return due
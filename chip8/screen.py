@@ -1,15 +1,20 @@
-import tkinter
 import pygame
 from pygame.locals import *
-import csv
+from display import Display
 
+# colors of the XO-CHIP pixel values, plane 0 bit plus 2 times plane 1 bit
+PALETTE = [(0, 0, 0), (255, 255, 255), (170, 170, 170), (85, 85, 85)]
 
-class Screen:
+# size of rom library thumbnails in the picker, 128x64 screens are shrunk
+THUMBNAIL_SIZE = (64, 32)
 
-    def __init__(self):
 
-        self.x_size = 64
-        self.y_size = 32
+class Screen(Display):
+    # pygame window backend
+
+    def __init__(self, framebuffer=None):
+
+        super().__init__(framebuffer)
 
         self.upscaling = 10
         self.window = None
@@ -18,43 +23,67 @@ class Screen:
         self.window_size_y = 0
 
         self.margin_x = 0
-        self.margin_y = 70
+        self.margin_y = 80
 
         # colors for pygame
         self.white = (255, 255, 255)
         self.black = (0, 0, 0)
 
-        self.pixels = None
-        self.clear()
+        # RGB bytes for every possible 8 pixel wide byte of a row
+        self.lut = [
+            b"".join(bytes(self.white if (b >> (7 - bit)) & 1 else self.black) for bit in range(8))
+            for b in range(256)
+        ]
+        # the same for two planes, indexed by (plane 0 byte << 8) | plane 1
+        # byte. built when the first XO-CHIP rom draws, see plane_lut
+        self.lut_planes = None
+        # unscaled RGB image of the framebuffer
+        self.buffer = bytearray(self.x_size * self.y_size * 3)
+        self.image = None
 
-        pygame.init()
-        self.font = pygame.font.Font(pygame.font.get_default_font(), 14)
+        # rom library thumbnails by sha1, see show_picker
+        self.thumbnails = {}
+
+        self.font = None
 
     def start(self):
 
+        # only what the window needs, the mixer is opened by audio.ToneAudio
+        pygame.display.init()
+        pygame.font.init()
+        self.font = pygame.font.Font(pygame.font.get_default_font(), 14)
+
         self.window_size_x = (self.x_size * self.upscaling) + self.margin_x
         self.window_size_y = (self.y_size * self.upscaling) + self.margin_y
 
         pygame.display.set_caption("Chip8 Emulator")
 
         self.window = pygame.display.set_mode((self.window_size_x, self.window_size_y), RESIZABLE)
+        self.image = pygame.image.frombuffer(self.buffer, (self.x_size, self.y_size), "RGB")
 
         self.show_menu()
 
-    def clear(self):
-        # pixels[x][y]
-        self.pixels = [[0]*self.y_size for i in range(self.x_size)]
-
-    def dump(self):
-
-        fname = "dump_screen.csv"        
-        transposed = list(zip(*self.pixels))
-
-        with open(fname, 'w') as f:
-            writer = csv.writer(f, delimiter=' ')
-            writer.writerows(transposed)
-
-        return fname
+    def resize(self):
+        # SUPER-CHIP switched resolution. the window keeps its size, the
+        # pixels get bigger or smaller to fill the same area
+        self.x_size = self.framebuffer.x_size
+        self.y_size = self.framebuffer.y_size
+        self.upscaling = (self.window_size_x - self.margin_x) // self.x_size
+        self.buffer = bytearray(self.x_size * self.y_size * 3)
+        self.image = pygame.image.frombuffer(self.buffer, (self.x_size, self.y_size), "RGB")
+
+    def plane_lut(self):
+        if self.lut_planes is None:
+            # 4 pixels at a time, indexed by (plane 0 nibble << 4) | plane 1 nibble
+            nibbles = [
+                b"".join(bytes(PALETTE[((p0 >> (3 - bit)) & 1) | (((p1 >> (3 - bit)) & 1) << 1)]) for bit in range(4))
+                for p0 in range(16) for p1 in range(16)
+            ]
+            self.lut_planes = [
+                nibbles[(p0 & 0xF0) | (p1 >> 4)] + nibbles[((p0 & 0xF) << 4) | (p1 & 0xF)]
+                for p0 in range(256) for p1 in range(256)
+            ]
+        return self.lut_planes
 
     def show_menu(self):
 
@@ -74,20 +103,22 @@ class Screen:
             (self.window_size_x, self.y_size * self.upscaling)
         )
 
-        offset_y += self.render_text("ESC: Quit", offset_x, offset_y)[1]
-        offset_x += self.render_text("F1: Change ROM", offset_x, offset_y)[0]
+        columns = [
+            ["ESC: Quit", "F1: Change ROM", "F6: Save state"],
+            ["F2: Reboot ROM", "F3: Pause / Unpause", "F7: Load state"],
+            ["F4: Dump screen", "F5: Dump memory & registers", "BKSP: Rewind (hold)"],
+        ]
 
-        offset_y = y
-        offset_x += 30
-        offset_y += self.render_text("F2: Reboot ROM", offset_x, offset_y)[1]
-        offset_x += self.render_text("F3: Pause / Unpause", offset_x, offset_y)[0]
-
-        offset_y = y
-        offset_x += 30
-        offset_y += self.render_text("F4: Dump screen", offset_x, offset_y)[1]
-        offset_x += self.render_text("F5: Dump memory & registers", offset_x, offset_y)[0]
+        for column in columns:
+            offset_y = y
+            width = 0
+            for text in column:
+                size = self.render_text(text, offset_x, offset_y)
+                offset_y += size[1]
+                width = max(width, size[0])
+            offset_x += width + 30
 
-        self.refresh()
+        self.refresh(full=True)
 
     def show_paused(self, paused):
 
@@ -97,36 +128,114 @@ class Screen:
             x = self.window_size_x - size[0]
             y = self.window_size_y - size[1]
             self.window.blit(self.font.render(text, True, self.white), (x, y))
-            self.refresh()
+            self.refresh(full=True)
         else:
             self.show_menu()
 
 
+    def picker_rows(self):
+        # roms visible at once, the bottom line is kept for help text
+        return (self.window_size_y - 30) // (THUMBNAIL_SIZE[1] + 8)
+
+    def thumbnail(self, sha1, packed):
+        # image of a packed framebuffer (hex), as stored by the library,
+        # 64x32 or 128x64 shrunk to THUMBNAIL_SIZE
+        if sha1 not in self.thumbnails:
+            data = bytes.fromhex(packed)
+            size = (128, 64) if len(data) == 128 * 64 // 8 else (64, 32)
+            rgb = b"".join([self.lut[b] for b in data])
+            image = pygame.image.frombuffer(rgb, size, "RGB")
+            self.thumbnails[sha1] = pygame.transform.scale(image, THUMBNAIL_SIZE)
+        return self.thumbnails[sha1]
+
+    def show_picker(self, entries, selected):
+        # rom library, one line per rom with its thumbnail and title.
+        # entries are (sha1, entry) pairs as returned by Library.titles
+        self.window.fill(self.black)
+
+        width, height = THUMBNAIL_SIZE
+        row_height = height + 8
+        rows = self.picker_rows()
+        top = max(0, min(selected - rows // 2, len(entries) - rows))
+
+        for row, (sha1, entry) in enumerate(entries[top:top + rows]):
+            y = row * row_height + 4
+            if top + row == selected:
+                pygame.draw.rect(self.window, self.white, (0, y - 4, self.window_size_x, row_height), 1)
+
+            # thumbnails still being generated are left empty
+            if entry["thumbnail"] is not None:
+                self.window.blit(self.thumbnail(sha1, entry["thumbnail"]), (8, y))
+            pygame.draw.rect(self.window, self.white, (7, y - 1, width + 2, height + 2), 1)
+
+            self.render_text(entry["title"], width + 24, y + 8)
+
+        self.render_text(
+            "UP/DOWN: Select   ENTER: Load   F1: Other file   ESC: Back",
+            8,
+            self.window_size_y - 22
+        )
+        pygame.display.flip()
+
     def render_text(self, text, x, y):
 
         self.window.blit(self.font.render(text, True, self.white), (x, y))
         return self.font.size(text)
 
-    def refresh(self):
-        for x in range(self.x_size):
+    def refresh(self, full=False):
+        # only rows marked dirty in the framebuffer are converted and
+        # pushed to the display. the unscaled image lives in self.buffer,
+        # which backs self.image, so each dirty band is one scaled blit
+        fb = self.framebuffer
+        if (fb.x_size, fb.y_size) != (self.x_size, self.y_size):
+            self.resize()
+            full = True
+        if full:
+            fb.mark_all_dirty()
+
+        dirty = fb.dirty
+        fb.dirty = 0
+
+        stride = self.x_size * 3
+        row_bytes = self.x_size // 8
+        if len(fb.planes) == 1:
+            rows = fb.rows
+            lut = self.lut
             for y in range(self.y_size):
-
-                col = self.black
-                if self.pixels[x][y] == 1:
-                    col = self.white
-
-                pygame.draw.rect(
-                    self.window,
-                    col,
-                    (
-                        self.upscaling * x,
-                        self.upscaling * y,
-                        self.upscaling,
-                        self.upscaling
-                    )
-                )
-        # update full display
-        pygame.display.flip()
+                if (dirty >> y) & 1:
+                    line = rows[y].to_bytes(row_bytes, "big")
+                    self.buffer[y * stride:(y + 1) * stride] = b"".join([lut[b] for b in line])
+        else:
+            rows, rows_1 = fb.planes[:2]
+            lut = self.plane_lut()
+            for y in range(self.y_size):
+                if (dirty >> y) & 1:
+                    line = rows[y].to_bytes(row_bytes, "big")
+                    line_1 = rows_1[y].to_bytes(row_bytes, "big")
+                    self.buffer[y * stride:(y + 1) * stride] = b"".join([lut[(b << 8) | b_1] for b, b_1 in zip(line, line_1)])
+
+        rects = []
+        y = 0
+        while dirty:
+            if not dirty & 1:
+                dirty >>= 1
+                y += 1
+                continue
+
+            # contiguous band of dirty rows
+            top = y
+            while dirty & 1:
+                dirty >>= 1
+                y += 1
+
+            band = self.image.subsurface((0, top, self.x_size, y - top))
+            scaled = pygame.transform.scale(band, (self.x_size * self.upscaling, (y - top) * self.upscaling))
+            rects.append(self.window.blit(scaled, (0, top * self.upscaling)))
+
+        if full:
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
 
     def destroy(self):
         pygame.quit()
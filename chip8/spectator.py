@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import struct
+import sys
+import threading
+from collections import deque
+from framebuffer import Framebuffer
+
+# spectator protocol over tcp, all little endian:
+#   client  one line with the name of the instance to watch, empty for
+#           the first one. then messages, each starting with its kind (u8):
+#             ACK  number of a frame the client is done with (u32)
+#             KEY  keypad key (u8), pressed (u8), if the server takes input
+#   server  header: magic, protocol version
+#           then frames, each starting with its kind (u8) and number (u32,
+#           counted per instance, gaps are frames the client was too slow
+#           for):
+#             KEYFRAME  width (u16), height (u16), every row packed big
+#                       endian. first frame and after the size changed
+#             DELTA     number of rows (u16), then per row its index (u16)
+#                       and its packed pixels, against the previous frame
+#                       the client got
+MAGIC = b"C8SP"
+VERSION = 1
+
+HEADER = struct.Struct("<4sB")
+FRAME = struct.Struct("<BI")
+KEYFRAME_SIZE = struct.Struct("<HH")
+DELTA_ROWS = struct.Struct("<H")
+ROW = struct.Struct("<H")
+MESSAGE = struct.Struct("<B")
+ACK = struct.Struct("<I")
+KEY = struct.Struct("<BB")
+
+KEYFRAME = 0
+DELTA = 1
+
+ACK_MESSAGE = 0
+KEY_MESSAGE = 1
+
+# frames sent to a client but not acknowledged yet. while a client is at
+# the limit, newer frames replace older ones on the server instead of
+# queueing up in socket buffers, and it gets the difference between what
+# it has and the newest frame once it caught up
+MAX_IN_FLIGHT = 2
+
+
+class Instance:
+    # one emulator on the server. publish() is called from the emulation
+    # thread and only hands a copy of the rows to the event loop, it never
+    # waits for clients. key presses of clients go the other way: they are
+    # queued and the emulation thread applies them with apply_keys between
+    # frames, after wake() (if given) got it out of waiting for input
+
+    def __init__(self, loop, core, allow_input, wake=None):
+
+        self.loop = loop
+        self.core = core
+        self.allow_input = allow_input
+        self.wake = wake
+
+        # (key, pressed) from clients, not applied yet
+        self.pending = deque()
+        # keys applied since the last frame started
+        self.changed = set()
+
+        # emulation thread side
+        self.published = 0
+
+        # event loop side: latest frame and one wake up event per client
+        self.frame = 0
+        self.screen = None
+        self.clients = set()
+
+    def publish(self):
+        fb = self.core.framebuffer
+        self.published += 1
+        # XO-CHIP colors are not sent, every set pixel is
+        screen = (fb.x_size, fb.y_size, tuple(fb.visible_rows()))
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.update, self.published, screen)
+
+    def update(self, frame, screen):
+        self.frame = frame
+        self.screen = screen
+        for wake in self.clients:
+            wake.set()
+
+    def queue_key(self, key, pressed):
+        # event loop side
+        self.pending.append((key, pressed))
+        if self.wake is not None:
+            self.wake()
+
+    def apply_keys(self, before_frame=True):
+        # emulation thread side, in front of every frame and while the
+        # front-end waits for input. a key that changes again is left for
+        # after the next frame, so that a press and release arriving
+        # together still last one frame
+        keys = self.core.keys
+        pending = self.pending
+        changed = self.changed
+        while pending:
+            key, pressed = pending[0]
+            if key in changed:
+                break
+            pending.popleft()
+            keys[key] = pressed
+            changed.add(key)
+        if before_frame:
+            changed.clear()
+
+
+class SpectatorServer:
+    # streams the screens of any number of emulators to tcp clients. runs
+    # its own asyncio loop in a background thread, see the protocol above.
+    # a client that cannot keep up only delays itself, see MAX_IN_FLIGHT
+
+    def __init__(self, host="127.0.0.1", port=0):
+
+        self.host = host
+        self.port = port
+        self.instances = {}
+
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.handlers = set()
+
+        # frames clients skipped because they were too slow
+        self.dropped = 0
+
+    def start(self):
+        # returns once the server listens, port 0 picks a free port
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.serve, args=(ready,), name="spectator", daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self.port
+
+    def serve(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+        self.port = self.server.sockets[0].getsockname()[1]
+        ready.set()
+        self.loop.run_forever()
+
+        self.server.close()
+        for task in self.handlers:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*self.handlers, return_exceptions=True))
+        self.loop.close()
+
+    def add(self, core, name="", allow_input=False, wake=None):
+        # allow_input lets clients press keys on core, wake is called from
+        # the server thread when they did. returns the instance, call its
+        # publish() whenever the screen of core changed and its apply_keys()
+        # in front of every frame
+        instance = Instance(self.loop, core, allow_input, wake)
+        self.loop.call_soon_threadsafe(self.instances.__setitem__, name, instance)
+        instance.publish()
+        return instance
+
+    def close(self):
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.handlers.add(task)
+
+        instance = None
+        client = Client()
+        messages = None
+
+        try:
+            name = (await reader.readline()).decode().strip()
+            if name:
+                instance = self.instances.get(name)
+            elif self.instances:
+                instance = next(iter(self.instances.values()))
+            if instance is None:
+                return
+
+            writer.write(HEADER.pack(MAGIC, VERSION))
+            instance.clients.add(client.wake)
+            messages = asyncio.ensure_future(self.read_messages(reader, instance, client))
+
+            frame = 0
+            size = None
+            rows = None
+            while not messages.done():
+                if instance.frame == frame or client.in_flight >= MAX_IN_FLIGHT:
+                    await client.wake.wait()
+                    client.wake.clear()
+                    continue
+
+                width, height, screen = instance.screen
+                if (width, height) != size:
+                    writer.write(FRAME.pack(KEYFRAME, instance.frame) + KEYFRAME_SIZE.pack(width, height))
+                    writer.write(b"".join([row.to_bytes(width // 8, "big") for row in screen]))
+                else:
+                    changed = [y for y in range(height) if screen[y] != rows[y]]
+                    data = [FRAME.pack(DELTA, instance.frame), DELTA_ROWS.pack(len(changed))]
+                    for y in changed:
+                        data.append(ROW.pack(y))
+                        data.append(screen[y].to_bytes(width // 8, "big"))
+                    writer.write(b"".join(data))
+
+                if frame:
+                    self.dropped += instance.frame - frame - 1
+                frame = instance.frame
+                size = (width, height)
+                rows = screen
+                client.in_flight += 1
+                await writer.drain()
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # the server closes, asyncio reports handlers that end cancelled
+            pass
+        finally:
+            if instance is not None:
+                instance.clients.discard(client.wake)
+                for key in client.pressed:
+                    instance.queue_key(key, False)
+            if messages is not None:
+                messages.cancel()
+            writer.close()
+            self.handlers.discard(task)
+
+    async def read_messages(self, reader, instance, client):
+        # runs until the client disconnects, then wakes up its writer
+        try:
+            while True:
+                kind, = MESSAGE.unpack(await reader.readexactly(MESSAGE.size))
+                if kind == ACK_MESSAGE:
+                    await reader.readexactly(ACK.size)
+                    client.in_flight -= 1
+                    client.wake.set()
+                elif kind == KEY_MESSAGE:
+                    key, down = KEY.unpack(await reader.readexactly(KEY.size))
+                    if not instance.allow_input or key > 0xF:
+                        continue
+                    # like a second keyboard
+                    instance.queue_key(key, bool(down))
+                    if down:
+                        client.pressed.add(key)
+                    else:
+                        client.pressed.discard(key)
+                else:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            client.wake.set()
+
+
+class Client:
+    # what the server tracks per connection
+
+    def __init__(self):
+
+        self.wake = asyncio.Event()
+        self.in_flight = 0
+        # keys this client holds down, released when it goes away
+        self.pressed = set()
+
+
+class Viewer:
+    # client side, keeps a framebuffer in sync with one instance
+
+    def __init__(self, reader, writer):
+
+        self.reader = reader
+        self.writer = writer
+        self.framebuffer = Framebuffer()
+        self.frame = 0
+
+    @classmethod
+    async def connect(cls, host, port, name=""):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(name.encode() + b"\n")
+
+        magic, version = HEADER.unpack(await reader.readexactly(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{host}:{port} is not a chip8 spectator server")
+        if version != VERSION:
+            raise ValueError(f"unsupported spectator protocol version {version}, expected {VERSION}")
+        return cls(reader, writer)
+
+    async def next_frame(self):
+        # applies the next frame to framebuffer and marks the changed rows
+        # dirty, returns its number
+        kind, self.frame = FRAME.unpack(await self.reader.readexactly(FRAME.size))
+        fb = self.framebuffer
+
+        if kind == KEYFRAME:
+            width, height = KEYFRAME_SIZE.unpack(await self.reader.readexactly(KEYFRAME_SIZE.size))
+            data = await self.reader.readexactly(width // 8 * height)
+            if (width, height) != (fb.x_size, fb.y_size):
+                fb = self.framebuffer = Framebuffer(width, height)
+            row_bytes = width // 8
+            fb.rows = [int.from_bytes(data[y * row_bytes:(y + 1) * row_bytes], "big") for y in range(height)]
+            fb.mark_all_dirty()
+        elif kind == DELTA:
+            count, = DELTA_ROWS.unpack(await self.reader.readexactly(DELTA_ROWS.size))
+            row_bytes = fb.x_size // 8
+            for _ in range(count):
+                y, = ROW.unpack(await self.reader.readexactly(ROW.size))
+                fb.rows[y] = int.from_bytes(await self.reader.readexactly(row_bytes), "big")
+                fb.dirty |= 1 << y
+        else:
+            raise ValueError(f"unknown frame kind {kind}")
+
+        # lets the server send the next one
+        self.writer.write(MESSAGE.pack(ACK_MESSAGE) + ACK.pack(self.frame))
+        return self.frame
+
+    def press(self, key, pressed=True):
+        self.writer.write(MESSAGE.pack(KEY_MESSAGE) + KEY.pack(key, pressed))
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def watch(host, port, name):
+    # draws an instance in the terminal until the server goes away
+    from terminal import TerminalDisplay
+
+    viewer = await Viewer.connect(host, port, name)
+    display = None
+    try:
+        while True:
+            try:
+                await viewer.next_frame()
+            except asyncio.IncompleteReadError:
+                break
+            if display is None or display.framebuffer is not viewer.framebuffer:
+                display = TerminalDisplay(viewer.framebuffer)
+                display.menu = [f"watching {name or 'the first instance'} on {host}:{port}"]
+                display.start()
+            display.refresh()
+    finally:
+        if display is not None:
+            display.destroy()
+        await viewer.close()
+
+
+def parse_address(address):
+    # "host:port" or "port"
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch an emulator started with --spectate in the terminal")
+    parser.add_argument("address", help="host:port of the spectator server")
+    parser.add_argument("--name", default="", help="instance to watch, the first one if left out")
+    args = parser.parse_args()
+
+    host, port = parse_address(args.address)
+    try:
+        asyncio.run(watch(host, port, args.name))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+import os
+import re
+import select
+import sys
+import termios
+import tty
+import chip8
+from chip8 import KEYPAD
+from display import Display, Input
+
+# a terminal cell shows two pixels on top of each other,
+# indexed by (top pixel << 1) | bottom pixel
+CELLS = [" ".encode(), "▄".encode(), "▀".encode(), "█".encode()]
+
+# unchanged cells between two changed ones are written again instead of
+# moving the cursor when that is shorter, a cursor move takes ~8 bytes and
+# a cell up to 3
+MAX_GAP = 2
+
+CLEAR = b"\x1b[2J"
+HIDE_CURSOR = b"\x1b[?25l"
+SHOW_CURSOR = b"\x1b[?25h"
+
+# frames a key counts as held after the terminal sent it. terminals only
+# send key presses (and repeats while held), never releases
+KEY_HOLD_FRAMES = 10
+
+# what arrow and function keys send, their letters are not keypad keys
+ESCAPE_SEQUENCE = re.compile(rb"\x1b(\[[0-9;]*[A-Za-z~]|O.)")
+
+# front-end actions of the function keys, by what xterm and rxvt send for
+# them. the same keys as in the window, F1 (the rom picker) aside
+FUNCTION_KEYS = {
+    b"\x1bOQ": "reboot", b"\x1b[12~": "reboot",
+    b"\x1bOR": "toggle_pause", b"\x1b[13~": "toggle_pause",
+    b"\x1bOS": "dump_screen", b"\x1b[14~": "dump_screen",
+    b"\x1b[15~": "dump_memory",
+    b"\x1b[17~": "save_slot",
+    b"\x1b[18~": "load_slot",
+}
+
+BACKSPACE = ("\x7f", "\x08")
+
+
+def move(line, column):
+    # 1 based, like the terminal
+    return f"\x1b[{line};{column}H".encode()
+
+
+class TerminalDisplay(Display):
+    # ANSI terminal backend, for running over ssh without an X server.
+    # the picture is drawn with unicode half blocks, one cell per two
+    # rows, followed by one line of help text. refresh compares the rows
+    # against what was last written and only writes the cells that changed,
+    # so a frame usually costs a few dozen bytes
+
+    def __init__(self, framebuffer=None, out=None):
+
+        super().__init__(framebuffer)
+
+        self.out = out if out is not None else sys.stdout.buffer
+        self.menu = [
+            "ESC: Quit  F2: Reboot  P/F3: Pause  F6/F7: Save/Load state",
+            "BKSP: Rewind  F4/F5: Dump screen/memory  keypad: 1234 qwer asdf zxcv",
+        ]
+
+        # rows as they are on the terminal, None until the first refresh
+        self.shown = None
+        self.status_line = self.y_size // 2 + 1
+
+        # for measuring how much a frame costs
+        self.bytes_written = 0
+        self.refreshes = 0
+
+    def write(self, data):
+        self.out.write(data)
+        self.out.flush()
+        self.bytes_written += len(data)
+
+    def start(self):
+        self.write(HIDE_CURSOR + CLEAR)
+        self.shown = None
+        self.show_menu()
+
+    def show_menu(self):
+        for idx, text in enumerate(self.menu):
+            self.write(move(self.status_line + idx, 1) + b"\x1b[2K" + text.encode())
+        self.refresh(full=True)
+
+    def show_paused(self, paused):
+        if paused:
+            text = b"PAUSED"
+            self.write(move(self.status_line, self.x_size - len(text) + 1) + text)
+        else:
+            self.show_menu()
+
+    def refresh(self, full=False):
+        fb = self.framebuffer
+        if (fb.x_size, fb.y_size) != (self.x_size, self.y_size):
+            # SUPER-CHIP switched resolution, start over at the new size
+            self.x_size = fb.x_size
+            self.y_size = fb.y_size
+            self.status_line = self.y_size // 2 + 1
+            self.start()
+            return
+        if self.shown is None:
+            full = True
+
+        dirty = fb.dirty
+        fb.dirty = 0
+
+        # colors are not told apart, every set pixel is drawn
+        rows = fb.visible_rows()
+        width = self.x_size
+        everything = (1 << width) - 1
+        out = []
+
+        for line in range(self.y_size // 2):
+            y = line * 2
+            if not full and not (dirty >> y) & 3:
+                continue
+
+            top = rows[y]
+            bottom = rows[y + 1]
+            if full:
+                changed = everything
+            else:
+                changed = (top ^ self.shown[y]) | (bottom ^ self.shown[y + 1])
+
+            while changed:
+                # leftmost changed cell, then the run of changed cells
+                # from there including short unchanged gaps
+                start = width - changed.bit_length()
+                end = start + 1
+                gap = 0
+                while end < width and gap <= MAX_GAP:
+                    if (changed >> (width - 1 - end)) & 1:
+                        gap = 0
+                    else:
+                        gap += 1
+                    end += 1
+                end -= gap
+
+                out.append(move(line + 1, start + 1))
+                for x in range(start, end):
+                    shift = width - 1 - x
+                    out.append(CELLS[(((top >> shift) & 1) << 1) | ((bottom >> shift) & 1)])
+
+                # only the cells right of the run are left
+                changed &= (1 << (width - end)) - 1
+
+        self.shown = list(rows)
+        self.refreshes += 1
+        if out:
+            self.write(b"".join(out))
+
+    def destroy(self):
+        self.write(move(self.status_line + len(self.menu), 1) + SHOW_CURSOR)
+
+
+def read_keys(fd, timeout=0):
+    # bytes typed since the last call, waits up to timeout seconds for them
+    # (None waits until something arrives)
+    data = b""
+    while select.select([fd], [], [], timeout)[0]:
+        chunk = os.read(fd, 64)
+        if not chunk:
+            break
+        data += chunk
+        timeout = 0
+    return data
+
+
+class TerminalInput(Input):
+    # keys typed into the terminal, which is put into cbreak mode while
+    # running. terminals send no key releases, so keypad keys and
+    # backspace (rewinding) count as held for KEY_HOLD_FRAMES frames after
+    # each press or repeat
+
+    def __init__(self, fd=None):
+
+        self.fd = fd if fd is not None else sys.stdin.fileno()
+        # terminal attributes to restore on stop
+        self.saved = None
+        # pipe that wake() writes to, so that wait() returns
+        self.wake_read = None
+        self.wake_write = None
+        # frames left until each keypad key counts as released
+        self.held = [0] * 16
+        self.rewind_held = 0
+
+    def start(self, emu):
+        self.wake_read, self.wake_write = os.pipe()
+        self.saved = termios.tcgetattr(self.fd)
+        tty.setcbreak(self.fd)
+
+    def stop(self, emu):
+        if self.saved is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved)
+            self.saved = None
+        if self.wake_read is not None:
+            os.close(self.wake_read)
+            os.close(self.wake_write)
+            self.wake_read = self.wake_write = None
+
+    def poll(self, emu):
+        self.handle(emu, read_keys(self.fd, 0))
+
+    def wait(self, emu):
+        readable = select.select([self.fd, self.wake_read], [], [])[0]
+        if self.wake_read in readable:
+            os.read(self.wake_read, 64)
+        self.handle(emu, read_keys(self.fd, 0))
+
+    def wake(self):
+        try:
+            os.write(self.wake_write, b"\0")
+        except (OSError, TypeError):
+            # stopped already
+            pass
+
+    def handle(self, emu, data):
+        for match in ESCAPE_SEQUENCE.finditer(data):
+            action = FUNCTION_KEYS.get(match.group(0))
+            if action is not None:
+                getattr(emu, action)()
+
+        for char in ESCAPE_SEQUENCE.sub(b"", data).decode(errors="ignore").lower():
+            if char in KEYPAD:
+                self.held[KEYPAD[char]] = KEY_HOLD_FRAMES
+                emu.press(KEYPAD[char])
+            elif char in ("\x1b", "\x03"):
+                emu.quit()
+            elif char == "p":
+                emu.toggle_pause()
+            elif char in BACKSPACE:
+                self.rewind_held = KEY_HOLD_FRAMES
+                emu.set_rewinding(True)
+
+    def frame_done(self, emu):
+        for key, frames in enumerate(self.held):
+            if frames:
+                self.held[key] = frames - 1
+                if frames == 1:
+                    emu.release(key)
+        if self.rewind_held:
+            self.rewind_held -= 1
+            if not self.rewind_held:
+                emu.set_rewinding(False)
+
+
+def main():
+    # the options of chip8.py, with the terminal instead of the window
+    parser = chip8.make_parser("Run a chip8 rom in the terminal", dialog=False)
+    displays = []
+
+    def frontend(emu):
+        display = TerminalDisplay(emu.framebuffer)
+        displays.append(display)
+        return display, TerminalInput()
+
+    chip8.main(parser, frontend)
+
+    for display in displays:
+        print(f"{display.bytes_written / max(1, display.refreshes):.0f} bytes per refresh")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+import argparse
+import queue
+import struct
+import sys
+import threading
+
+# binary execution trace, all little endian:
+#   header  magic, format version, instruction counter at the first record
+#   then one record per executed instruction:
+#     pc (u16), opcode (u16), changed V registers (u16 bitmask), flags (u8)
+#     new value of every changed V register (u8 each, ascending)
+#     new I (u16)              if flags & CHANGED_I
+#     new SP (u8)              if flags & CHANGED_SP
+#     new delay timer (u8)     if flags & CHANGED_DELAY
+#     new sound timer (u8)     if flags & CHANGED_SOUND
+#     address (u16), length (u8) and the written bytes
+#                              if flags & WROTE_MEMORY
+MAGIC = b"C8TR"
+VERSION = 1
+
+HEADER = struct.Struct("<4sBQ")
+RECORD = struct.Struct("<HHHB")
+WRITE = struct.Struct("<HB")
+
+CHANGED_I = 0x01
+CHANGED_SP = 0x02
+CHANGED_DELAY = 0x04
+CHANGED_SOUND = 0x08
+WROTE_MEMORY = 0x10
+
+# records are collected in memory and handed to the writer thread in
+# chunks of about this many bytes
+CHUNK_SIZE = 1 << 18
+
+# handlers that write memory, keyed by name since many encodings decode
+# to the same handler (FXY3 is FX33 for any Y)
+WRITES = {"op_fx33", "op_fx55", "op_5xy2"}
+
+
+class Tracer:
+    # records every executed instruction to a file.
+    # attach with core.tracer = Tracer(path, core.counter); while attached Core.step runs
+    # the recording loop below. encoding happens on the emulation thread,
+    # the file is written by a background thread so the loop never waits
+    # for the disk. call close() to flush the rest
+
+    def __init__(self, path, counter=0):
+
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, counter))
+
+        self.buffer = bytearray()
+        self.records = 0
+
+        # chunks of encoded records, None tells the writer to stop
+        self.chunks = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self.write_chunks, name="trace writer", daemon=True)
+        self.writer.start()
+
+    def write_chunks(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            self.file.write(chunk)
+        self.file.close()
+
+    def step(self, core, n):
+        memory = core.memory
+        table = core.dispatch
+        v = core.v
+        buffer = self.buffer
+        pack_record = RECORD.pack
+        pack_write = WRITE.pack
+
+        for _ in range(n):
+            pc = core.pc
+            opcode = (memory[pc] << 8) | memory[pc + 1]
+            before = v[:]
+            i = core.i
+            sp = core.sp
+            delay_timer = core.delay_timer
+            sound_timer = core.sound_timer
+
+            handler, a, b = table[opcode]
+            handler(core, a, b)
+
+            changed = 0
+            values = b""
+            if v != before:
+                changed_values = []
+                for idx in range(16):
+                    if v[idx] != before[idx]:
+                        changed |= 1 << idx
+                        changed_values.append(v[idx])
+                values = bytes(changed_values)
+
+            flags = 0
+            extra = b""
+            if core.i != i:
+                flags |= CHANGED_I
+                extra += core.i.to_bytes(2, "little")
+            if core.sp != sp:
+                flags |= CHANGED_SP
+                extra += bytes((core.sp,))
+            if core.delay_timer != delay_timer:
+                flags |= CHANGED_DELAY
+                extra += bytes((core.delay_timer,))
+            if core.sound_timer != sound_timer:
+                flags |= CHANGED_SOUND
+                extra += bytes((core.sound_timer,))
+
+            name = handler.__name__
+            if name in WRITES:
+                flags |= WROTE_MEMORY
+                if name == "op_fx33":
+                    length = 3
+                elif name == "op_fx55":
+                    length = a + 1
+                else:
+                    length = abs(a - b) + 1
+                # cut short at the end of memory
+                written = memory[i:i + length]
+                extra += pack_write(i, len(written)) + written
+
+            buffer += pack_record(pc, opcode, changed, flags)
+            buffer += values
+            buffer += extra
+
+        core.counter += n
+        self.records += n
+
+        if len(buffer) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.chunks.put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        self.chunks.put(None)
+        self.writer.join()
+        return self.path
+
+
+def read(path):
+    # yields (counter, pc, opcode, {register: value}, memory write or None)
+    # for every record. registers are "V0".."VF", "I", "SP", "DT", "ST",
+    # a memory write is (address, bytes)
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, counter = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a chip8 trace")
+    if version != VERSION:
+        raise ValueError(f"unsupported trace version {version}, expected {VERSION}")
+
+    offset = HEADER.size
+    end = len(data)
+    while offset + RECORD.size <= end:
+        pc, opcode, changed, flags = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+
+        registers = {}
+        for idx in range(16):
+            if changed & (1 << idx):
+                registers[f"V{idx:X}"] = data[offset]
+                offset += 1
+        if flags & CHANGED_I:
+            registers["I"] = int.from_bytes(data[offset:offset + 2], "little")
+            offset += 2
+        if flags & CHANGED_SP:
+            registers["SP"] = data[offset]
+            offset += 1
+        if flags & CHANGED_DELAY:
+            registers["DT"] = data[offset]
+            offset += 1
+        if flags & CHANGED_SOUND:
+            registers["ST"] = data[offset]
+            offset += 1
+
+        write = None
+        if flags & WROTE_MEMORY:
+            address, length = WRITE.unpack_from(data, offset)
+            offset += WRITE.size
+            write = (address, data[offset:offset + length])
+            offset += length
+
+        yield counter, pc, opcode, registers, write
+        counter += 1
+
+
+def parse_range(text):
+    # "0x200-0x2ff", "512" or "0x200-"
+    start, _, end = text.partition("-")
+    start = int(start, 0) if start else 0
+    if not _:
+        return start, start
+    return start, int(end, 0) if end else None
+
+
+def opcode_matcher(pattern):
+    # 4 hex digits, any other character matches any nibble: "8xy4", "Fx55"
+    if len(pattern) != 4:
+        raise ValueError(f"opcode pattern {pattern!r} needs 4 characters")
+    mask = 0
+    value = 0
+    for char in pattern:
+        mask <<= 4
+        value <<= 4
+        if char in "0123456789abcdefABCDEF":
+            mask |= 0xF
+            value |= int(char, 16)
+    return lambda opcode: opcode & mask == value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a trace written by Tracer")
+    parser.add_argument("trace")
+    parser.add_argument("--pc", default=None, help="only addresses in this range, e.g. 0x200-0x2ff")
+    parser.add_argument("--opcode", action="append", default=[], help="only opcodes matching, e.g. 8xy4 or Fx55; can be given more than once")
+    parser.add_argument("--range", default=None, help="only instructions with these counter values, e.g. 1000-2000")
+    parser.add_argument("--register", default=None, help="only instructions that changed this register, e.g. VF or I")
+    parser.add_argument("--writes", action="store_true", help="only instructions that wrote memory")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many printed instructions")
+    args = parser.parse_args()
+
+    pc_range = parse_range(args.pc) if args.pc else None
+    counter_range = parse_range(args.range) if args.range else None
+    matchers = [opcode_matcher(pattern) for pattern in args.opcode]
+
+    printed = 0
+    for counter, pc, opcode, registers, write in read(args.trace):
+        if counter_range:
+            if counter < counter_range[0]:
+                continue
+            if counter_range[1] is not None and counter > counter_range[1]:
+                break
+        if pc_range and not (pc >= pc_range[0] and (pc_range[1] is None or pc <= pc_range[1])):
+            continue
+        if matchers and not any(match(opcode) for match in matchers):
+            continue
+        if args.register and args.register.upper() not in registers:
+            continue
+        if args.writes and write is None:
+            continue
+
+        changes = " ".join(f"{name}={value:02X}" for name, value in registers.items())
+        if write:
+            changes += f" [{write[0]:03X}]={write[1].hex().upper()}"
+        print(f"{counter:10}  {pc:03X}  {opcode:04X}  {changes}")
+
+        printed += 1
+        if args.limit is not None and printed >= args.limit:
+            break
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+import pytest
+import savestate
+from aot import AotCore
+from core import Core
+from jit import JitCore
+from rewind import Rewind
+from savestate import StateError
+
+# jumps to the block at 0x206 (a jump to the next address would look
+# like falling through), loops through it once, then writes into it with
+# FX33 (BCD of 250 at 0x209: 6B00 becomes 6B02, 6D00 becomes 0500 =
+# 00E0) and runs it again. the second pass must see the new code
+SELF_MODIFYING_FX33 = [
+    0x6C00, 0x1206, 0x1204,
+    0x7C01, 0x6B00, 0x6D00, 0x3C02, 0x1212, 0x1210,
+    0x60FA, 0xA209, 0xF033, 0x1206,
+]
+
+# the same with FX55 writing 6B42 over 6B00
+SELF_MODIFYING_FX55 = [
+    0x6C00, 0x1206, 0x1204,
+    0x7C01, 0x6B00, 0x3C02, 0x1210, 0x120E,
+    0x606B, 0x6142, 0xA208, 0xF155, 0x1206,
+]
+
+# random numbers, BCD into memory and sprites, so every frame changes
+# registers, memory and the screen
+BUSY = [0xC0FF, 0xA300, 0xF033, 0xF029, 0xD125, 0x7101, 0x7203, 0x1200]
+
+# offsets into version 2 save states
+PLATFORM = savestate.HEADER.size + savestate.REGISTERS.size + savestate.STACK.size + savestate.V.size + savestate.RNG.size
+MEMORY = PLATFORM + savestate.PLATFORM.size + savestate.SIZE.size
+
+
+def write_rom(tmp_path, words, name="test.ch8"):
+    path = tmp_path / name
+    path.write_bytes(b"".join(word.to_bytes(2, "big") for word in words))
+    return str(path)
+
+
+def make_engine(engine, tmp_path):
+    emu = engine(1)
+    if engine is AotCore:
+        emu.cache_dir = str(tmp_path / "aot")
+    return emu
+
+
+def run_in_steps(emu, sizes, total):
+    # steps of varying size, so blocks get cut off at every point
+    done = 0
+    while done < total:
+        for size in sizes:
+            emu.step(size)
+            done += size
+
+
+@pytest.mark.parametrize("engine", [JitCore, AotCore])
+@pytest.mark.parametrize("program, value", [(SELF_MODIFYING_FX33, 0x02), (SELF_MODIFYING_FX55, 0x42)])
+@pytest.mark.parametrize("sizes", [(1,), (3, 7), (64,)])
+def test_writes_into_compiled_code(tmp_path, engine, program, value, sizes):
+    rom = write_rom(tmp_path, program)
+    reference = Core(1)
+    reference.load_rom(rom)
+    emu = make_engine(engine, tmp_path)
+    emu.load_rom(rom)
+
+    run_in_steps(reference, sizes, 200)
+    run_in_steps(emu, sizes, 200)
+
+    assert reference.v[0xB] == value
+    assert reference.v[0xC] == 2
+    assert emu.save_state() == reference.save_state()
+
+
+@pytest.mark.parametrize("engine", [JitCore, AotCore])
+def test_loading_a_state_keeps_blocks_of_unchanged_code(tmp_path, engine):
+    emu = make_engine(engine, tmp_path)
+    emu.load_rom(write_rom(tmp_path, SELF_MODIFYING_FX55))
+    emu.step(3)
+    state = emu.save_state()
+    emu.step(3)
+    assert emu.blocks
+
+    blocks = dict(emu.blocks)
+    emu.load_state(state)
+    assert emu.blocks == blocks
+
+    # a state with other code in the block at 0x206
+    patched = bytearray(state)
+    patched[MEMORY + 0x208:MEMORY + 0x20A] = b"\x6b\x42"
+    emu.load_state(bytes(patched))
+    assert 0x206 not in emu.blocks
+    run_in_steps(emu, (5,), 50)
+    assert emu.v[0xB] == 0x42
+
+
+def test_save_state_round_trip(tmp_path):
+    emu = Core(1)
+    emu.load_rom(write_rom(tmp_path, BUSY))
+    emu.run_frames(10)
+    state = emu.save_state()
+
+    emu.run_frames(10)
+    after = emu.save_state()
+
+    emu.load_state(state)
+    assert emu.save_state() == state
+    # the random number generator is part of the state as well
+    emu.run_frames(10)
+    assert emu.save_state() == after
+
+
+@pytest.mark.parametrize("platform", ["schip", "xochip"])
+def test_save_state_switches_platform(tmp_path, platform):
+    emu = Core(1)
+    emu.set_platform(platform)
+    emu.load_rom(write_rom(tmp_path, BUSY))
+    emu.run_frames(5)
+    state = emu.save_state()
+
+    other = Core(2)
+    other.load_state(state)
+    assert other.platform == platform
+    assert other.save_state() == state
+
+
+def test_version_1_states_load(tmp_path):
+    emu = Core(1)
+    emu.load_rom(write_rom(tmp_path, BUSY))
+    emu.run_frames(5)
+    state = emu.save_state()
+
+    # the same state without the platform, planes and extension
+    screen = MEMORY + len(emu.memory)
+    rows = screen + savestate.SCREEN.size + savestate.PLANES.size
+    old = b"".join((
+        savestate.HEADER.pack(savestate.MAGIC, 1),
+        state[savestate.HEADER.size:PLATFORM],
+        state[PLATFORM + savestate.PLATFORM.size:screen + savestate.SCREEN.size],
+        state[rows:len(state) - savestate.EXTENSION.size],
+    ))
+
+    other = Core(2)
+    other.load_state(old)
+    assert other.save_state() == state
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda state: b"XXXX" + state[4:],
+    lambda state: state[:4] + bytes((savestate.VERSION + 1,)) + state[5:],
+    lambda state: state[:len(state) // 2],
+    lambda state: state[:-1],
+])
+def test_bad_states_leave_the_machine_alone(tmp_path, corrupt):
+    emu = Core(1)
+    emu.load_rom(write_rom(tmp_path, BUSY))
+    emu.run_frames(5)
+    state = emu.save_state()
+    emu.run_frames(5)
+    before = emu.save_state()
+
+    with pytest.raises(StateError):
+        emu.load_state(corrupt(state))
+    assert emu.save_state() == before
+
+
+def test_state_with_the_wrong_memory_size_leaves_the_machine_alone(tmp_path):
+    emu = Core(1)
+    emu.load_rom(write_rom(tmp_path, BUSY))
+    emu.run_frames(5)
+    before = emu.save_state()
+
+    # a chip8 state claiming to be an XO-CHIP one
+    state = bytearray(before)
+    state[PLATFORM] = savestate.PLATFORMS.index("xochip")
+
+    with pytest.raises(StateError):
+        emu.load_state(bytes(state))
+    assert emu.platform == "chip8"
+    assert emu.save_state() == before
+
+
+def record(emu, rewind, frames):
+    states = []
+    for _ in range(frames):
+        emu.run_frame()
+        rewind.push(emu)
+        states.append(emu.save_state())
+    return states
+
+
+@pytest.mark.parametrize("platform", ["chip8", "xochip"])
+def test_rewind_restores_every_frame(tmp_path, platform):
+    emu = Core(1)
+    emu.set_platform(platform)
+    emu.load_rom(write_rom(tmp_path, BUSY))
+    rewind = Rewind()
+    states = record(emu, rewind, 120)
+
+    # the newest state is the current frame, the first step goes before it
+    states.pop()
+    while states:
+        assert rewind.step_back(emu)
+        assert emu.save_state() == states.pop()
+    assert not rewind.step_back(emu)
+    assert len(rewind) == 1
+
+
+def test_rewind_continues_from_the_restored_frame(tmp_path):
+    emu = Core(1)
+    emu.load_rom(write_rom(tmp_path, BUSY))
+    rewind = Rewind()
+    states = record(emu, rewind, 30)
+
+    for _ in range(10):
+        rewind.step_back(emu)
+    assert emu.save_state() == states[19]
+
+    record(emu, rewind, 5)
+    for _ in range(5):
+        rewind.step_back(emu)
+    assert emu.save_state() == states[19]
+    rewind.step_back(emu)
+    assert emu.save_state() == states[18]
+
+
+def test_rewind_limits(tmp_path):
+    emu = Core(1)
+    emu.load_rom(write_rom(tmp_path, BUSY))
+
+    rewind = Rewind(max_frames=20)
+    states = record(emu, rewind, 50)
+    assert len(rewind) == 20
+    for _ in range(19):
+        rewind.step_back(emu)
+    assert emu.save_state() == states[30]
+
+    rewind = Rewind(max_bytes=2000)
+    record(emu, rewind, 50)
+    assert rewind.size <= 2000
+
+
+def test_rewind_across_a_platform_switch(tmp_path):
+    emu = Core(1)
+    rom = write_rom(tmp_path, BUSY)
+    emu.load_rom(rom)
+    rewind = Rewind()
+    states = record(emu, rewind, 5)
+
+    emu.set_platform("xochip")
+    emu.load_rom(rom)
+    states += record(emu, rewind, 5)
+
+    states.pop()
+    while states:
+        assert rewind.step_back(emu)
+        assert emu.save_state() == states.pop()
+    assert emu.platform == "chip8"